@@ -1,14 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, g, send_file, current_app
+from flask import Flask, render_template, request, redirect, url_for, flash, g, send_file, current_app, jsonify, make_response, session, stream_with_context
 import database
-import pandas as pd
-from io import BytesIO
+import importer
+import exporter
 from werkzeug.utils import secure_filename
 import os
 import sqlite3
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 import pytz
-from collections import defaultdict
 import re
+import functools
+import itertools
+import hashlib
+import hmac
+import json
+import time
+import uuid
 
 app = Flask(__name__)
 # **สำคัญมาก: เปลี่ยน 'your_super_secret_key_here_please_change_this_to_a_complex_random_string' เป็นคีย์ลับที่ซับซ้อนของคุณเอง!**
@@ -22,17 +28,30 @@ app.config['WHEEL_IMAGE_FOLDER'] = 'static/images/wheels'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['WHEEL_IMAGE_FOLDER'], exist_ok=True)
 
-ALLOWED_EXCEL_EXTENSIONS = {'xlsx', 'xls'}
+ALLOWED_IMPORT_EXTENSIONS = set(importer.IMPORT_FORMATS) # Excel, CSV, Parquet
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
-def allowed_excel_file(filename):
+def allowed_import_file(filename):
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXCEL_EXTENSIONS
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_IMPORT_EXTENSIONS
 
 def allowed_image_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
 
+def parse_size_filter_arg(value):
+    # "17" -> 17.0 (ค่าตรงตัว), "16-18" -> (16.0, 18.0) (ช่วง), ค่าที่อ่านไม่ได้จะคืน None
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        if '-' in value:
+            low, high = value.split('-', 1)
+            return (float(low) if low.strip() else None, float(high) if high.strip() else None)
+        return float(value)
+    except ValueError:
+        return None
+
 def get_db():
     if 'db' not in g:
         g.db = database.get_db_connection()
@@ -42,70 +61,195 @@ def get_db():
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        database.release_db_connection(db) # คืน connection เข้า pool แทนการปิดทิ้ง
 
 def setup_database():
     with app.app_context():
         conn = get_db()
         database.init_db(conn)
+        importer.recover_import_jobs(conn)
         close_db()
 
 def get_bkk_time():
     bkk_tz = pytz.timezone('Asia/Bangkok')
     return datetime.now(bkk_tz)
 
+# ETag เปลี่ยนเมื่อ deploy โค้ด/เทมเพลตชุดใหม่ด้วย (ทุก worker ได้ค่าเดียวกัน)
+ETAG_SALT = os.environ.get('APP_VERSION') or str(int(os.path.getmtime(__file__)))
+
+def conditional_get(*tables):
+    # ตอบ 304 เมื่อข้อมูลในตารางที่หน้านี้ใช้ไม่เปลี่ยน: อ่าน version จาก data_generations ครั้งเดียว ไม่ต้อง render หรือสร้างไฟล์ใหม่
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('_flashes'):
+                return view(*args, **kwargs) # มีข้อความ flash รอแสดงอยู่ ต้อง render ใหม่เสมอ
+
+            generations, last_modified = database.get_data_version(get_db(), tables)
+            etag = hashlib.sha1(repr((ETAG_SALT, request.full_path, generations)).encode('utf-8')).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and request.if_modified_since >= last_modified)
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response # redirect/ข้อผิดพลาด ไม่ต้องแนบ validator
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True # ให้ client ถามกลับทุกครั้ง (revalidate)
+            return response
+        return wrapper
+    return decorator
+
 @app.context_processor
 def inject_global_data():
     return dict(get_bkk_time=get_bkk_time)
 
+# ทุก endpoint ใต้ /admin ต้องส่ง Authorization: Bearer <ADMIN_TOKEN>; ถ้าไม่ได้ตั้ง ADMIN_TOKEN จะปิด endpoint เหล่านี้ไว้
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def admin_token_valid():
+    supplied = request.headers.get('Authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {ADMIN_TOKEN}'.encode('utf-8'))
+
+@app.route('/admin/db_pool_stats')
+def db_pool_stats():
+    if not admin_token_valid():
+        return api_error('Forbidden', 403)
+    return jsonify(database.get_pool().stats())
+
+@app.route('/admin/catalog_cache_stats')
+def catalog_cache_stats():
+    if not admin_token_valid():
+        return api_error('Forbidden', 403)
+    return jsonify(database.catalog_cache.stats())
+
+@app.route('/admin/backup', methods=['POST'])
+def admin_backup():
+    # body (ไม่บังคับ): {"steps": ["backup", "vacuum", "optimize" | "analyze"]} ค่าเริ่มต้นคือ backup อย่างเดียว
+    # รันเป็นงานเบื้องหลัง ตอบ 202 พร้อม job_id ทันที แล้วดูผลที่ /admin/backup/<job_id>
+    if not admin_token_valid():
+        return api_error('Forbidden', 403)
+    payload = request.get_json(silent=True) or {}
+    steps = payload.get('steps') or ['backup']
+    if not isinstance(steps, list) or any(step not in database.MAINTENANCE_STEPS for step in steps):
+        return api_error(f"steps must be a list of {', '.join(database.MAINTENANCE_STEPS)}")
+    job_id = importer.submit_maintenance_job(get_db(), steps)
+    if job_id is None:
+        return api_error(f'maintenance already queued or ran within the last {database.BACKUP_MIN_INTERVAL}s', 429)
+    return jsonify({'job_id': job_id, 'status_url': url_for('admin_backup_status', job_id=job_id)}), 202
+
+@app.route('/admin/backup/<int:job_id>')
+def admin_backup_status(job_id):
+    if not admin_token_valid():
+        return api_error('Forbidden', 403)
+    job = database.get_import_job(get_db(), job_id)
+    if job is None or job['kind'] != database.MAINTENANCE_JOB_KIND:
+        return api_error('Maintenance job not found', 404)
+    report = json.loads(job['message']) if job['status'] == 'done' and job['message'] else None
+    return jsonify({'job_id': job_id, 'status': job['status'], 'steps': job['filename'].split(),
+                    'created_at': job['created_at'], 'started_at': job['started_at'], 'finished_at': job['finished_at'],
+                    'report': report, 'message': None if report is not None else job['message'],
+                    'seconds': round(sum(step['seconds'] for step in report), 3) if report else None})
+
+INDEX_PAGE_SIZE = 50
+
+def read_index_filters():
+    # ค่าค้นหา/กรองของหน้า index (ใช้ทั้งหน้าหลักและ /index_items)
+    tire_size_args = {key: request.args.get(f'tire_{key}', '').strip() for key in ('width', 'aspect', 'rim')}
+    tire_size_filters = {key: parse_size_filter_arg(value) for key, value in tire_size_args.items()}
+    return {
+        'tire_query': request.args.get('tire_query', '').strip(),
+        'tire_selected_brand': request.args.get('tire_brand_filter', 'all').strip(),
+        'tire_size_args': tire_size_args,
+        'tire_size_filters': {key: value for key, value in tire_size_filters.items() if value is not None},
+        'wheel_query': request.args.get('wheel_query', '').strip(),
+        'wheel_selected_brand': request.args.get('wheel_brand_filter', 'all').strip(),
+    }
+
 @app.route('/')
+@conditional_get('tires', 'wheels', 'promotions')
 def index():
     conn = get_db()
-    
-    tire_query = request.args.get('tire_query', '').strip()
-    tire_selected_brand = request.args.get('tire_brand_filter', 'all').strip()
-    
-    all_tires = database.get_all_tires(conn, query=tire_query, brand_filter=tire_selected_brand)
-    available_tire_brands = database.get_all_tire_brands(conn)
-
-    tires_by_brand = defaultdict(list)
-    for tire in all_tires:
-        tires_by_brand[tire['brand']].append(tire)
-    
-    sorted_tire_brands = sorted(tires_by_brand.keys())
-
-    wheel_query = request.args.get('wheel_query', '').strip()
-    wheel_selected_brand = request.args.get('wheel_brand_filter', 'all').strip()
-
-    all_wheels = database.get_all_wheels(conn, query=wheel_query, brand_filter=wheel_selected_brand)
-    available_wheel_brands = database.get_all_wheel_brands(conn)
-    
-    wheels_by_brand = defaultdict(list)
-    for wheel in all_wheels:
-        wheels_by_brand[wheel['brand']].append(wheel)
-
-    sorted_wheel_brands = sorted(wheels_by_brand.keys())
-
+    filters = read_index_filters()
     active_tab = request.args.get('tab', 'tires')
+    if active_tab not in ('tires', 'wheels'):
+        active_tab = 'tires'
+
+    # ดึงเฉพาะแท็บที่เปิดอยู่: แสดงรายชื่อยี่ห้อ + จำนวน แล้วโหลดสินค้าของแต่ละยี่ห้อทีละหน้าผ่าน /index_items
+    tire_brand_counts = []
+    available_tire_brands = []
+    wheel_brand_counts = []
+    available_wheel_brands = []
+    if active_tab == 'tires':
+        tire_brand_counts = database.get_tire_brand_counts(conn, query=filters['tire_query'], brand_filter=filters['tire_selected_brand'],
+                                                           size_filters=filters['tire_size_filters'])
+        available_tire_brands = database.get_all_tire_brands(conn)
+    else:
+        wheel_brand_counts = database.get_wheel_brand_counts(conn, query=filters['wheel_query'], brand_filter=filters['wheel_selected_brand'])
+        available_wheel_brands = database.get_all_wheel_brands(conn)
+
+    tire_filter_args = {f'tire_{key}': value for key, value in filters['tire_size_args'].items() if value}
+    if filters['tire_query']:
+        tire_filter_args['tire_query'] = filters['tire_query']
+    wheel_filter_args = {'wheel_query': filters['wheel_query']} if filters['wheel_query'] else {}
 
     return render_template('index.html', 
-                           tires=all_tires, 
-                           tires_by_brand=tires_by_brand, 
-                           sorted_tire_brands=sorted_tire_brands, 
-                           tire_query=tire_query,
+                           tire_brand_counts=tire_brand_counts,
+                           tire_query=filters['tire_query'],
                            available_tire_brands=available_tire_brands,
-                           tire_selected_brand=tire_selected_brand,
+                           tire_selected_brand=filters['tire_selected_brand'],
+                           tire_size_args=filters['tire_size_args'],
+                           tire_filter_args=tire_filter_args,
                            
-                           wheels_by_brand=wheels_by_brand,
-                           sorted_wheel_brands=sorted_wheel_brands,
-                           wheel_query=wheel_query,
+                           wheel_brand_counts=wheel_brand_counts,
+                           wheel_query=filters['wheel_query'],
                            available_wheel_brands=available_wheel_brands,
-                           wheel_selected_brand=wheel_selected_brand,
+                           wheel_selected_brand=filters['wheel_selected_brand'],
+                           wheel_filter_args=wheel_filter_args,
                            
                            active_tab=active_tab)
 
+@app.route('/index_items')
+@conditional_get('tires', 'wheels', 'promotions')
+def index_items():
+    # ส่งแถวตาราง (HTML fragment) ของยี่ห้อเดียวทีละหน้า ด้วย keyset cursor
+    conn = get_db()
+    filters = read_index_filters()
+    tab = request.args.get('tab', 'tires')
+    brand = request.args.get('brand', '')
+    query = filters['wheel_query'] if tab == 'wheels' else filters['tire_query']
+    after = database.decode_cursor(request.args.get('after'),
+                                   database.page_cursor_shape(conn, 'wheel' if tab == 'wheels' else 'tire', query))
+
+    if tab == 'wheels':
+        rows, next_after = database.get_wheels_page(conn, query=filters['wheel_query'], brand_filter=brand,
+                                                    after=after, limit=INDEX_PAGE_SIZE)
+        template = '_wheel_rows.html'
+    else:
+        rows, next_after = database.get_tires_page(conn, query=filters['tire_query'], brand_filter=brand,
+                                                   size_filters=filters['tire_size_filters'], after=after, limit=INDEX_PAGE_SIZE)
+        template = '_tire_rows.html'
+
+    next_url = None
+    if next_after:
+        next_args = request.args.to_dict()
+        next_args['after'] = database.encode_cursor(next_after)
+        next_url = url_for('index_items', **next_args)
+    return render_template(template, tires=rows, wheels=rows, next_url=next_url)
+
 # --- Promotions Routes ---
 @app.route('/promotions')
+@conditional_get('promotions')
 def promotions():
     conn = get_db()
     all_promotions = database.get_all_promotions(conn, include_inactive=True) 
@@ -417,15 +561,17 @@ def delete_tire(tire_id):
     conn = get_db()
     tire = database.get_tire(conn, tire_id)
 
-    if tire is None:
+    if tire is None or tire['deleted_at']:
         flash('ไม่พบยางที่ระบุ', 'danger') 
     elif tire['quantity'] > 0:
         flash('ไม่สามารถลบยางได้เนื่องจากยังมีสต็อกเหลืออยู่. กรุณาปรับสต็อกให้เป็น 0 ก่อน.', 'danger')
         return redirect(url_for('index', tab='tires')) 
     else: 
         try:
-            database.delete_tire(conn, tire_id)
-            flash('ลบยางสำเร็จ!', 'success')
+            if database.delete_tire(conn, tire_id) == 'deleted':
+                flash('ลบยางสำเร็จ!', 'success')
+            else:
+                flash('ลบยางออกจากรายการแล้ว (ประวัติการเคลื่อนไหวสต็อกยังเก็บไว้ตรวจสอบย้อนหลัง)', 'success')
         except Exception as e:
             flash(f'เกิดข้อผิดพลาดในการลบยาง: {e}', 'danger')
     
@@ -433,6 +579,7 @@ def delete_tire(tire_id):
 
 # --- Wheel Routes ---
 @app.route('/wheel_detail/<int:wheel_id>')
+@conditional_get('wheels', 'wheel_fitments')
 def wheel_detail(wheel_id):
     conn = get_db()
     wheel = database.get_wheel(conn, wheel_id)
@@ -517,20 +664,22 @@ def delete_wheel(wheel_id):
     conn = get_db()
     wheel = database.get_wheel(conn, wheel_id)
 
-    if wheel is None:
+    if wheel is None or wheel['deleted_at']:
         flash('ไม่พบแม็กที่ระบุ', 'danger')
     elif wheel['quantity'] > 0: 
         flash('ไม่สามารถลบแม็กได้เนื่องจากยังมีสต็อกเหลืออยู่. กรุณาปรับสต็อกให้เป็น 0 ก่อน.', 'danger')
         return redirect(url_for('index', tab='wheels')) 
     else:
         try:
-            if wheel['image_filename']:
-                image_path = os.path.join(app.config['WHEEL_IMAGE_FOLDER'], wheel['image_filename']) 
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            
-            database.delete_wheel(conn, wheel_id)
-            flash('ลบแม็กสำเร็จ!', 'success')
+            # A soft-deleted wheel keeps its row (and image) for the ledger; only a real delete removes the file
+            if database.delete_wheel(conn, wheel_id) == 'deleted':
+                if wheel['image_filename']:
+                    image_path = os.path.join(app.config['WHEEL_IMAGE_FOLDER'], wheel['image_filename'])
+                    if os.path.exists(image_path):
+                        os.remove(image_path)
+                flash('ลบแม็กสำเร็จ!', 'success')
+            else:
+                flash('ลบแม็กออกจากรายการแล้ว (ประวัติการเคลื่อนไหวสต็อกยังเก็บไว้ตรวจสอบย้อนหลัง)', 'success')
         except Exception as e:
             flash(f'เกิดข้อผิดพลาดในการลบแม็ก: {e}', 'danger')
     
@@ -576,20 +725,11 @@ def delete_fitment(fitment_id, wheel_id):
 
 
 # --- Stock Movement Routes ---
+STOCK_MOVEMENT_LABELS = {'tire': ('ยาง', 'เส้น'), 'wheel': ('แม็ก', 'วง')}
+
 @app.route('/stock_movement', methods=('GET', 'POST'))
 def stock_movement():
     conn = get_db()
-    
-    tires = database.get_all_tires(conn)
-    wheels = database.get_all_wheels(conn)
-    active_tab = request.args.get('tab', 'tire_movements') 
-
-    cursor_tire_movements = conn.execute("SELECT tm.*, t.brand, t.model, t.size FROM tire_movements tm JOIN tires t ON tm.tire_id = t.id ORDER BY tm.timestamp DESC LIMIT 50")
-    tire_movements_history = cursor_tire_movements.fetchall()
-
-    cursor_wheel_movements = conn.execute("SELECT wm.*, w.brand, w.model, w.diameter FROM wheel_movements wm JOIN wheels w ON wm.wheel_id = w.id ORDER BY wm.timestamp DESC LIMIT 50")
-    wheel_movements_history = cursor_wheel_movements.fetchall()
-
 
     if request.method == 'POST':
         submit_type = request.form.get('submit_type')
@@ -619,47 +759,22 @@ def stock_movement():
                 flash('จำนวนที่เปลี่ยนแปลงต้องมากกว่า 0', 'danger')
                 return redirect(url_for('stock_movement', tab=active_tab_on_error))
             
-            if submit_type == 'tire_movement':
-                tire_id = int(item_id)
-                current_tire = database.get_tire(conn, tire_id)
-                if current_tire is None:
-                    flash('ไม่พบยางที่ระบุ', 'danger')
-                    return redirect(url_for('stock_movement', tab=active_tab_on_error))
-                
-                new_quantity = current_tire['quantity']
-                if move_type == 'IN':
-                    new_quantity += quantity_change
-                elif move_type == 'OUT':
-                    if new_quantity < quantity_change:
-                        flash(f'สต็อกยางไม่พอสำหรับการจ่ายออก. มีเพียง {new_quantity} เส้น.', 'danger')
-                        return redirect(url_for('stock_movement', tab=active_tab_on_error))
-                    new_quantity -= quantity_change
-                
-                database.update_tire_quantity(conn, tire_id, new_quantity)
-                database.add_tire_movement(conn, tire_id, move_type, quantity_change, new_quantity, notes)
-                flash(f'บันทึกการเคลื่อนไหวสต็อกยางสำเร็จ! คงเหลือ: {new_quantity} เส้น', 'success')
-                return redirect(url_for('stock_movement', tab='tire_movements'))
-
-            elif submit_type == 'wheel_movement':
-                wheel_id = int(item_id)
-                current_wheel = database.get_wheel(conn, wheel_id)
-                if current_wheel is None:
-                    flash('ไม่พบแม็กที่ระบุ', 'danger')
-                    return redirect(url_for('stock_movement', tab=active_tab_on_error))
-                
-                new_quantity = current_wheel['quantity']
-                if move_type == 'IN':
-                    new_quantity += quantity_change
-                elif move_type == 'OUT':
-                    if new_quantity < quantity_change:
-                        flash(f'สต็อกแม็กไม่พอสำหรับการจ่ายออก. มีเพียง {new_quantity} วง.', 'danger')
-                        return redirect(url_for('stock_movement', tab=active_tab_on_error))
-                    new_quantity -= quantity_change
-                
-                database.update_wheel_quantity(conn, wheel_id, new_quantity)
-                database.add_wheel_movement(conn, wheel_id, move_type, quantity_change, new_quantity, notes)
-                flash(f'บันทึกการเคลื่อนไหวสต็อกแม็กสำเร็จ! คงเหลือ: {new_quantity} วง', 'success')
-                return redirect(url_for('stock_movement', tab='wheel_movements'))
+            if move_type not in database.STOCK_MOVEMENT_SIGNS:
+                flash('ประเภทการเคลื่อนไหวไม่ถูกต้อง', 'danger')
+                return redirect(url_for('stock_movement', tab=active_tab_on_error))
+
+            kind = 'tire' if submit_type == 'tire_movement' else 'wheel'
+            item_label, unit = STOCK_MOVEMENT_LABELS[kind]
+            moved, new_quantity = database.move_stock(conn, kind, int(item_id), move_type, quantity_change, notes)
+            if not moved:
+                if new_quantity is None:
+                    flash(f'ไม่พบ{item_label}ที่ระบุ', 'danger')
+                else:
+                    flash(f'สต็อก{item_label}ไม่พอสำหรับการจ่ายออก. มีเพียง {new_quantity} {unit}.', 'danger')
+                return redirect(url_for('stock_movement', tab=active_tab_on_error))
+
+            flash(f'บันทึกการเคลื่อนไหวสต็อก{item_label}สำเร็จ! คงเหลือ: {new_quantity} {unit}', 'success')
+            return redirect(url_for('stock_movement', tab=f'{kind}_movements'))
 
         except ValueError:
             flash('ข้อมูลตัวเลขไม่ถูกต้อง กรุณาตรวจสอบ', 'danger')
@@ -668,6 +783,13 @@ def stock_movement():
             flash(f'เกิดข้อผิดพลาดในการบันทึกการเคลื่อนไหวสต็อก: {e}', 'danger')
             return redirect(url_for('stock_movement', tab=active_tab_on_error))
     
+    # POST จะ redirect เสมอ จึงโหลดรายการสินค้า/ประวัติเฉพาะตอนแสดงหน้า
+    tires = database.get_all_tires(conn)
+    wheels = database.get_all_wheels(conn)
+    active_tab = request.args.get('tab', 'tire_movements')
+    tire_movements_history = database.get_recent_tire_movements(conn, limit=50)
+    wheel_movements_history = database.get_recent_wheel_movements(conn, limit=50)
+
     return render_template('stock_movement.html', 
                            tires=tires, 
                            wheels=wheels, 
@@ -675,55 +797,235 @@ def stock_movement():
                            tire_movements=tire_movements_history, 
                            wheel_movements=wheel_movements_history)
 
+MOVEMENT_HISTORY_PAGE_SIZE = 100
+
+def read_movement_filters(args):
+    # ?kind=tire|wheel&item_id=&type=IN|OUT&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD (date_to รวมทั้งวัน)
+    kind = args.get('kind', 'tire')
+    if kind not in database.STOCK_KINDS:
+        raise ValueError("kind must be 'tire' or 'wheel'")
+    move_type = args.get('type', '').strip() or None
+    if move_type and move_type not in database.STOCK_MOVEMENT_SIGNS:
+        raise ValueError("type must be 'IN' or 'OUT'")
+    item_id = args.get('item_id', '').strip()
+    try:
+        item_id = int(item_id) if item_id else None
+    except ValueError:
+        raise ValueError("item_id must be an integer")
+    try:
+        date_from = date.fromisoformat(args['date_from']) if args.get('date_from') else None
+        date_to = date.fromisoformat(args['date_to']) if args.get('date_to') else None
+    except ValueError:
+        raise ValueError("date_from/date_to must be YYYY-MM-DD")
+    return {
+        'kind': kind,
+        'item_id': item_id,
+        'move_type': move_type,
+        'since': date_from.isoformat() if date_from else None,
+        'until': (date_to + timedelta(days=1)).isoformat() if date_to else None,
+    }
+
+@app.route('/stock_movement/history')
+@conditional_get('tire_movements', 'wheel_movements', 'tires', 'wheels')
+def movement_history():
+    # ประวัติการเคลื่อนไหวทั้งหมด กรองตามสินค้า/ประเภท/ช่วงวันที่ แบ่งหน้าด้วย keyset (timestamp, id)
+    try:
+        filters = read_movement_filters(request.args)
+    except ValueError as e:
+        flash(f'ตัวกรองไม่ถูกต้อง: {e}', 'danger')
+        return redirect(url_for('movement_history'))
+    after = database.decode_cursor(request.args.get('after'), database.MOVEMENT_CURSOR_SHAPE)
+    movements, next_after = database.get_movements_page(get_db(), after=after, limit=MOVEMENT_HISTORY_PAGE_SIZE, **filters)
+
+    next_url = None
+    if next_after:
+        next_args = request.args.to_dict()
+        next_args['after'] = database.encode_cursor(next_after)
+        next_url = url_for('movement_history', **next_args)
+    return render_template('movement_history.html', movements=movements, filters=filters,
+                           item_columns=database.STOCK_KINDS[filters['kind']]['item_columns'], next_url=next_url)
+
+# --- Low Stock Routes ---
+def parse_reorder_point(value):
+    # ช่องว่าง = ไม่กำหนด (ใช้เกณฑ์ของยี่ห้อ/ค่าเริ่มต้นแทน)
+    value = (value or '').strip()
+    if not value:
+        return None
+    reorder_point = int(value)
+    if reorder_point < 0:
+        raise ValueError('reorder point must not be negative')
+    return reorder_point
+
+@app.route('/low_stock')
+@conditional_get('tires', 'wheels', 'reorder_thresholds')
+def low_stock():
+    # รายการที่ต้องสั่งเพิ่ม อ่านจาก low_stock_alerts (trigger อัปเดตให้ทุกครั้งที่สต็อก/เกณฑ์เปลี่ยน)
+    conn = get_db()
+    kind = request.args.get('kind', 'tire')
+    if kind not in database.STOCK_KINDS:
+        kind = 'tire'
+    brand = request.args.get('brand', '').strip()
+    alerts = database.get_low_stock_alerts(conn, kind, brand or None)
+    brands = database.get_all_tire_brands(conn) if kind == 'tire' else database.get_all_wheel_brands(conn)
+    return render_template('low_stock.html', kind=kind, brand=brand, alerts=alerts, brands=brands,
+                           counts=database.get_low_stock_counts(conn),
+                           thresholds=database.get_reorder_thresholds(conn, kind),
+                           item_columns=database.STOCK_KINDS[kind]['item_columns'])
+
+@app.route('/low_stock/thresholds', methods=['POST'])
+def set_reorder_threshold():
+    conn = get_db()
+    kind = request.form.get('kind', 'tire')
+    if kind not in database.STOCK_KINDS:
+        flash('ประเภทสินค้าไม่ถูกต้อง', 'danger')
+        return redirect(url_for('low_stock'))
+    try:
+        reorder_point = parse_reorder_point(request.form.get('reorder_point'))
+        item_id = request.form.get('item_id', '').strip()
+        if item_id:
+            if not database.set_item_reorder_point(conn, kind, int(item_id), reorder_point):
+                flash('ไม่พบสินค้าที่ระบุ', 'danger')
+                return redirect(url_for('low_stock', kind=kind))
+            flash(f'บันทึกเกณฑ์สั่งซื้อของสินค้า ID {item_id} สำเร็จ!', 'success')
+        else:
+            brand = request.form.get('brand', '').strip() or '*'
+            if brand == '*' and reorder_point is None:
+                flash('กรุณาระบุเกณฑ์เริ่มต้น', 'danger')
+                return redirect(url_for('low_stock', kind=kind))
+            database.set_brand_reorder_point(conn, kind, brand, reorder_point)
+            flash(f'บันทึกเกณฑ์สั่งซื้อของ {"ค่าเริ่มต้น" if brand == "*" else brand} สำเร็จ!', 'success')
+    except ValueError:
+        flash('เกณฑ์สั่งซื้อต้องเป็นจำนวนเต็มตั้งแต่ 0 ขึ้นไป', 'danger')
+    return redirect(url_for('low_stock', kind=kind))
+
+# --- Reports ---
+def valuation_labels(kind):
+    # ใช้หัวคอลัมน์เดียวกับไฟล์ส่งออก (ทุน SC, ราคาขายส่ง 1, ...)
+    columns = exporter.TIRE_EXPORT_COLUMNS if kind == 'tire' else exporter.WHEEL_EXPORT_COLUMNS
+    return {key: header for header, key, _ in columns}
+
+def read_valuation_args(args):
+    kind = args.get('kind', 'tire')
+    group_by = args.get('group', 'brand')
+    if kind not in database.VALUATION_KINDS:
+        raise ValueError("kind must be 'tire' or 'wheel'")
+    if group_by not in database.VALUATION_GROUPS:
+        raise ValueError(f"group must be one of {', '.join(database.VALUATION_GROUPS)}")
+    return kind, group_by
+
+@app.route('/reports/valuation')
+@conditional_get('tires', 'wheels')
+def valuation_report():
+    # มูลค่าสต็อกและกำไรขั้นต้น แยกตามยี่ห้อ/ขนาด อ่านจากตารางสรุปที่ trigger อัปเดตให้ ไม่ต้อง export ไป pivot เอง
+    try:
+        kind, group_by = read_valuation_args(request.args)
+    except ValueError as e:
+        flash(f'ตัวเลือกรายงานไม่ถูกต้อง: {e}', 'danger')
+        return redirect(url_for('valuation_report'))
+    rows, totals = database.get_valuation_report(get_db(), kind, group_by)
+    config = database.VALUATION_KINDS[kind]
+    return render_template('valuation_report.html', kind=kind, group_by=group_by, rows=rows, totals=totals,
+                           group_columns=database.valuation_group_columns(kind, group_by),
+                           costs=config['costs'], prices=config['prices'],
+                           labels=valuation_labels(kind))
+
 # --- Import/Export Routes ---
 @app.route('/export_import', methods=('GET', 'POST'))
 def export_import():
     active_tab = request.args.get('tab', 'tires_excel')
-    return render_template('export_import.html', active_tab=active_tab)
+    import_jobs = database.get_recent_import_jobs(get_db())
+    return render_template('export_import.html', active_tab=active_tab, import_jobs=import_jobs)
+
+def save_import_upload(file, kind):
+    # ตั้งชื่อไฟล์ใหม่แต่คงนามสกุลไว้ (worker ใช้นามสกุลเลือกวิธีอ่าน; secure_filename ตัดชื่อภาษาไทยทิ้งหมด)
+    extension = file.filename.rsplit('.', 1)[1].lower()
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{kind}_{uuid.uuid4().hex}.{extension}")
+    file.save(file_path)
+    # ติ๊ก "ตรวจสอบก่อนนำเข้า" = dry run: สรุปความเปลี่ยนแปลงให้ดูก่อน ยังไม่บันทึกจนกว่าจะยืนยัน
+    mode = 'preview' if request.form.get('dry_run') else 'apply'
+    return importer.submit_import_job(get_db(), kind, file.filename, file_path, mode=mode)
+
+IMPORT_JOB_FIELDS = ('id', 'kind', 'filename', 'status', 'mode', 'total_rows', 'processed_rows', 'imported_count',
+                     'updated_count', 'unchanged_count', 'error_count', 'message', 'created_at', 'started_at', 'finished_at')
+IMPORT_DIFF_PAGE_SIZE = 200
+
+@app.route('/import_jobs/<int:job_id>')
+def import_job_status(job_id):
+    job = database.get_import_job(get_db(), job_id)
+    if job is None:
+        return api_error('Import job not found', 404)
+    return jsonify({field: job[field] for field in IMPORT_JOB_FIELDS})
+
+@app.route('/import_jobs/<int:job_id>/errors')
+def import_job_errors(job_id):
+    # แถวที่นำเข้าไม่ได้ทั้งหมดของงาน แบ่งหน้าด้วย ?after=<เลขแถว>&limit=
+    conn = get_db()
+    if database.get_import_job(conn, job_id) is None:
+        return api_error('Import job not found', 404)
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', API_DEFAULT_LIMIT, type=int), API_MAX_LIMIT)
+    errors = database.get_import_job_errors(conn, job_id, after=after, limit=limit)
+    data = [{'row_number': row['row_number'], 'message': row['message']} for row in errors]
+    next_after = data[-1]['row_number'] if len(data) == limit else None
+    return jsonify({'data': data, 'next_after': next_after})
+
+@app.route('/import_jobs/<int:job_id>/diff')
+def import_job_diff(job_id):
+    # ผลของ dry run: สรุปจำนวนเพิ่ม/อัปเดต/ไม่เปลี่ยน ส่วนต่างสต็อกและราคา และรายการแถวที่จะเปลี่ยน
+    conn = get_db()
+    job = database.get_import_job(conn, job_id)
+    if job is None or job['status'] != 'previewed':
+        flash('ไม่พบผลการตรวจสอบของงานนำเข้านี้ (อาจยืนยันหรือยกเลิกไปแล้ว)', 'warning')
+        return redirect(url_for('export_import'))
+    after = request.args.get('after', 0, type=int)
+    summary = database.get_import_diff_summary(conn, job['kind'], job_id)
+    rows = database.get_import_diff_rows(conn, job['kind'], job_id, after=after, limit=IMPORT_DIFF_PAGE_SIZE)
+    next_after = rows[-1]['row_number'] if len(rows) == IMPORT_DIFF_PAGE_SIZE else None
+    key_columns = database.IMPORT_KINDS[job['kind']]['key']
+    return render_template('import_diff.html', job=job, summary=summary, rows=rows, key_columns=key_columns, next_after=next_after)
+
+@app.route('/import_jobs/<int:job_id>/confirm', methods=('POST',))
+def confirm_import_job(job_id):
+    if importer.confirm_import_job(get_db(), job_id):
+        flash(f'ยืนยันแล้ว กำลังบันทึกการนำเข้า (งาน #{job_id}) โดยไม่ต้องอ่านไฟล์ซ้ำ', 'info')
+    else:
+        flash('งานนำเข้านี้ยืนยันไม่ได้ (อาจยืนยันหรือยกเลิกไปแล้ว)', 'danger')
+    return redirect(url_for('export_import'))
+
+@app.route('/import_jobs/<int:job_id>/discard', methods=('POST',))
+def discard_import_job(job_id):
+    if database.discard_import_job(get_db(), job_id):
+        flash(f'ยกเลิกงานนำเข้า #{job_id} แล้ว ไม่มีการเปลี่ยนแปลงข้อมูล', 'success')
+    else:
+        flash('งานนำเข้านี้ยกเลิกไม่ได้ (อาจยืนยันหรือยกเลิกไปแล้ว)', 'danger')
+    return redirect(url_for('export_import'))
+
+def export_response(rows, columns, basename, sheet_name):
+    # ?format=xlsx (ค่าเริ่มต้น), csv หรือ parquet
+    export_format = request.args.get('format', 'xlsx')
+    if export_format == 'csv':
+        response = current_app.response_class(stream_with_context(exporter.iter_csv(rows, columns)), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename={basename}.csv'
+        return response
+    if export_format == 'parquet':
+        output = exporter.write_parquet(rows, columns)
+        return send_file(output, download_name=f'{basename}.parquet', as_attachment=True, mimetype='application/vnd.apache.parquet')
+    output = exporter.write_xlsx(rows, columns, sheet_name)
+    return send_file(output, download_name=f'{basename}.xlsx', as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
 @app.route('/export_tires_action')
+@conditional_get('tires', 'promotions')
 def export_tires_action():
     conn = get_db()
-    tires = database.get_all_tires(conn) 
+    tires = database.iter_tires(conn)
+    first_tire = next(tires, None)
     
-    if not tires:
+    if first_tire is None:
         flash('ไม่มีข้อมูลยางให้ส่งออก', 'warning')
         return redirect(url_for('export_import', tab='tires_excel'))
 
-    data = []
-    for tire in tires:
-        data.append({
-            'ID': tire['id'],
-            'ยี่ห้อ': tire['brand'],
-            'รุ่นยาง': tire['model'],
-            'เบอร์ยาง': tire['size'],
-            'สต็อก': tire['quantity'],
-            'ทุน SC': tire['cost_sc'],
-            'ทุน Dunlop': tire['cost_dunlop'],
-            'ทุน Online': tire['cost_online'],
-            'ราคาขายส่ง 1': tire['wholesale_price1'],
-            'ราคาขายส่ง 2': tire['wholesale_price2'],
-            'ราคาต่อเส้น': tire['price_per_item'], # Changed from retail_price
-            'ID โปรโมชัน': tire['promotion_id'], 
-            'ชื่อโปรโมชัน': tire['promo_name'], 
-            'ประเภทโปรโมชัน': tire['promo_type'], 
-            'ค่าโปรโมชัน Value1': tire['promo_value1'],
-            'ค่าโปรโมชัน Value2': tire['promo_value2'],
-            'รายละเอียดโปรโมชัน': tire['display_promo_description_text'], # Using the generated description
-            'ราคาโปรโมชันคำนวณ(เส้น)': tire['display_promo_price_per_item'], # Display calculated price per item
-            'ราคาโปรโมชันคำนวณ(4เส้น)': tire['display_price_for_4'], # Display calculated price for 4 items
-            'ปีผลิต': tire['year_of_manufacture']
-        })
-    
-    df = pd.DataFrame(data)
-    
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    df.to_excel(writer, index=False, sheet_name='Tires Stock')
-    writer.close()
-    output.seek(0)
-    
-    return send_file(output, download_name='tire_stock.xlsx', as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    # เขียนทีละแถวจาก cursor ลงไฟล์ xlsx แบบ constant_memory แล้วส่งไฟล์เป็น stream
+    return export_response(itertools.chain([first_tire], tires), exporter.TIRE_EXPORT_COLUMNS, 'tire_stock', 'Tires Stock')
 
 @app.route('/import_tires_action', methods=('POST',))
 def import_tires_action():
@@ -737,127 +1039,27 @@ def import_tires_action():
         flash('ไม่ได้เลือกไฟล์', 'danger')
         return redirect(url_for('export_import', tab='tires_excel'))
     
-    if file and allowed_excel_file(file.filename):
-        try:
-            df = pd.read_excel(file)
-            conn = get_db()
-            imported_count = 0
-            updated_count = 0
-            error_rows = []
-
-            # Expected columns from Excel for Tires (Adjusted for promo_id import and price_per_item)
-            expected_tire_cols = [
-                'ยี่ห้อ', 'รุ่นยาง', 'เบอร์ยาง', 'สต็อก', 'ทุน SC', 'ทุน Dunlop', 'ทุน Online',
-                'ราคาขายส่ง 1', 'ราคาขายส่ง 2', 'ราคาต่อเส้น', 'ID โปรโมชัน', 'ปีผลิต' 
-            ]
-            
-            if not all(col in df.columns for col in expected_tire_cols):
-                missing_cols = [col for col in expected_tire_cols if col not in df.columns]
-                flash(f'ไฟล์ Excel ขาดคอลัมน์ที่จำเป็น: {", ".join(missing_cols)}. โปรดดาวน์โหลดไฟล์ตัวอย่างเพื่อดูรูปแบบที่ถูกต้อง.', 'danger')
-                return redirect(url_for('export_import', tab='tires_excel'))
-
-            for index, row in df.iterrows():
-                try:
-                    brand = str(row.get('ยี่ห้อ', '')).strip()
-                    model = str(row.get('รุ่นยาง', '')).strip()
-                    size = str(row.get('เบอร์ยาง', '')).strip()
-                    
-                    if not brand or not model or not size:
-                        raise ValueError("ข้อมูล 'ยี่ห้อ', 'รุ่นยาง', หรือ 'เบอร์ยาง' ไม่สามารถเว้นว่างได้")
-
-                    quantity = int(row['สต็อก']) if pd.notna(row['สต็อก']) else 0
-                    price_per_item = float(row['ราคาต่อเส้น']) if pd.notna(row['ราคาต่อเส้น']) else 0.0 # Changed from retail_price
-
-                    cost_sc = float(row['ทุน SC']) if pd.notna(row['ทุน SC']) else None 
-                    cost_dunlop = float(row['ทุน Dunlop']) if pd.notna(row['ทุน Dunlop']) else None
-                    cost_online = float(row['ทุน Online']) if pd.notna(row['ทุน Online']) else None
-                    wholesale_price1 = float(row['ราคาขายส่ง 1']) if pd.notna(row['ราคาขายส่ง 1']) else None
-                    wholesale_price2 = float(row['ราคาขายส่ง 2']) if pd.notna(row['ราคาขายส่ง 2']) else None
-                    
-                    promotion_id = int(row.get('ID โปรโมชัน')) if pd.notna(row.get('ID โปรโมชัน')) else None
-                    
-                    year_of_manufacture = int(row['ปีผลิต']) if pd.notna(row['ปีผลิต']) else None
-                    
-                    existing_tire = conn.execute("SELECT id, quantity FROM tires WHERE brand = ? AND model = ? AND size = ?", (brand, model, size)).fetchone()
-
-                    if existing_tire:
-                        tire_id = existing_tire['id']
-                        database.update_tire_import(conn, tire_id, brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, # Changed from retail_price
-                                                    promotion_id, year_of_manufacture)
-                        updated_count += 1
-                        
-                        old_quantity = existing_tire['quantity']
-                        if quantity != old_quantity:
-                            movement_type = 'IN' if quantity > old_quantity else 'OUT'
-                            quantity_change_diff = abs(quantity - old_quantity)
-                            database.add_tire_movement(conn, tire_id, movement_type, quantity_change_diff, quantity, "Import from Excel (Qty Update)")
-                        
-                    else:
-                        new_tire_id = database.add_tire_import(conn, brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, # Changed from retail_price
-                                                               promotion_id, year_of_manufacture)
-                        database.add_tire_movement(conn, new_tire_id, 'IN', quantity, quantity, "Import from Excel (initial stock)")
-                        imported_count += 1
-                except Exception as row_e:
-                    error_rows.append(f"แถวที่ {index + 2}: {row_e} - {row.to_dict()}")
-            
-            conn.commit()
-            
-            message = f'นำเข้าข้อมูลยางสำเร็จ: เพิ่มใหม่ {imported_count} รายการ, อัปเดต {updated_count} รายการ.'
-            if error_rows:
-                message += f' พบข้อผิดพลาดใน {len(error_rows)} แถว: {"; ".join(error_rows[:3])}{"..." if len(error_rows) > 3 else ""}'
-                flash(message, 'warning')
-            else:
-                flash(message, 'success')
-            
-            return redirect(url_for('export_import', tab='tires_excel'))
-
-        except Exception as e:
-            flash(f'เกิดข้อผิดพลาดในการนำเข้าไฟล์ Excel ของยาง: {e}', 'danger')
-            if 'db' in g and g.db is not None:
-                g.db.rollback()
-            return redirect(url_for('export_import', tab='tires_excel'))
+    if file and allowed_import_file(file.filename):
+        # บันทึกไฟล์แล้วส่งเข้าคิวนำเข้าเบื้องหลัง ไม่ให้ request ค้างจน gunicorn timeout
+        job_id = save_import_upload(file, 'tires')
+        flash(f'ได้รับไฟล์แล้ว กำลังนำเข้าข้อมูลยางเบื้องหลัง (งาน #{job_id}) ดูความคืบหน้าได้ในตารางด้านล่าง', 'info')
+        return redirect(url_for('export_import', tab='tires_excel'))
     else:
-        flash('ชนิดไฟล์ไม่ถูกต้อง อนุญาตเฉพาะ .xlsx และ .xls เท่านั้น', 'danger')
+        flash('ชนิดไฟล์ไม่ถูกต้อง อนุญาตเฉพาะ .xlsx, .xls, .csv และ .parquet เท่านั้น', 'danger')
         return redirect(url_for('export_import', tab='tires_excel'))
 
 @app.route('/export_wheels_action')
+@conditional_get('wheels')
 def export_wheels_action():
     conn = get_db()
-    wheels = database.get_all_wheels(conn)
+    wheels = database.iter_wheels(conn)
+    first_wheel = next(wheels, None)
     
-    if not wheels:
+    if first_wheel is None:
         flash('ไม่มีข้อมูลแม็กให้ส่งออก', 'warning')
         return redirect(url_for('export_import', tab='wheels_excel'))
 
-    data = []
-    for wheel in wheels:
-        data.append({
-            'ID': wheel['id'],
-            'ยี่ห้อ': wheel['brand'],
-            'ลาย': wheel['model'],
-            'ขอบ': wheel['diameter'],
-            'รู': wheel['pcd'],
-            'กว้าง': wheel['width'],
-            'ET': wheel['et'],
-            'สี': wheel['color'],
-            'สต็อก': wheel['quantity'],
-            'ทุน': wheel['cost'],
-            'ทุน Online': wheel['cost_online'],
-            'ราคาขายส่ง 1': wheel['wholesale_price1'],
-            'ราคาขายส่ง 2': wheel['wholesale_price2'],
-            'ราคาขายปลีก': wheel['retail_price'],
-            'ไฟล์รูปภาพ': wheel['image_filename']
-        })
-    
-    df = pd.DataFrame(data)
-    
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    df.to_excel(writer, index=False, sheet_name='Wheels Stock')
-    writer.close()
-    output.seek(0)
-    
-    return send_file(output, download_name='wheel_stock.xlsx', as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return export_response(itertools.chain([first_wheel], wheels), exporter.WHEEL_EXPORT_COLUMNS, 'wheel_stock', 'Wheels Stock')
 
 @app.route('/import_wheels_action', methods=('POST',))
 def import_wheels_action():
@@ -871,86 +1073,277 @@ def import_wheels_action():
         flash('ไม่ได้เลือกไฟล์', 'danger')
         return redirect(url_for('export_import', tab='wheels_excel'))
     
-    if file and allowed_excel_file(file.filename):
-        try:
-            df = pd.read_excel(file)
-            conn = get_db()
-            imported_count = 0
-            updated_count = 0
-            error_rows = []
-
-            expected_wheel_cols = [
-                'ยี่ห้อ', 'ลาย', 'ขอบ', 'รู', 'กว้าง', 'ET', 'สี', 'สต็อก',
-                'ทุน', 'ทุน Online', 'ราคาขายส่ง 1', 'ราคาขายส่ง 2', 'ราคาขายปลีก', 'ไฟล์รูปภาพ'
-            ]
-            if not all(col in df.columns for col in expected_wheel_cols):
-                missing_cols = [col for col in expected_wheel_cols if col not in df.columns]
-                flash(f'ไฟล์ Excel ขาดคอลัมน์ที่จำเป็น: {", ".join(missing_cols)}. โปรดดาวน์โหลดไฟล์ตัวอย่างเพื่อดูรูปแบบที่ถูกต้อง.', 'danger')
-                return redirect(url_for('export_import', tab='wheels_excel'))
-
-
-            for index, row in df.iterrows():
-                try:
-                    brand = str(row.get('ยี่ห้อ', '')).strip()
-                    model = str(row.get('ลาย', '')).strip()
-                    pcd = str(row.get('รู', '')).strip()
-
-                    if not brand or not model or not pcd:
-                            raise ValueError("ข้อมูล 'ยี่ห้อ', 'ลาย', หรือ 'รู' ไม่สามารถเว้นว่างได้")
-
-                    diameter = float(row['ขอบ']) if pd.notna(row['ขอบ']) else 0.0
-                    width = float(row['กว้าง']) if pd.notna(row['กว้าง']) else 0.0
-                    quantity = int(row['สต็อก']) if pd.notna(row['สต็อก']) else 0
-                    cost = float(row['ทุน']) if pd.notna(row['ทุน']) else None 
-                    retail_price = float(row['ราคาขายปลีก']) if pd.notna(row['ราคาขายปลีก']) else 0.0
-
-                    et = int(row['ET']) if pd.notna(row['ET']) else None
-                    color = str(row['สี']).strip() if pd.notna(row['สี']) else None
-                    cost_online = float(row['ทุน Online']) if pd.notna(row['ทุน Online']) else None
-                    wholesale_price1 = float(row['ราคาขายส่ง 1']) if pd.notna(row['ราคาขายส่ง 1']) else None
-                    wholesale_price2 = float(row['ราคาขายส่ง 2']) if pd.notna(row['ราคาขายส่ง 2']) else None
-                    image_filename = str(row['ไฟล์รูปภาพ']).strip() if pd.notna(row['ไฟล์รูปภาพ']) else None
-                    
-                    existing_wheel = conn.execute("SELECT id, quantity FROM wheels WHERE brand = ? AND model = ? AND diameter = ? AND pcd = ? AND width = ? AND (et IS ? OR et = ?) AND (color IS ? OR color = ?)", 
-                                                 (brand, model, diameter, pcd, width, et, et, color, color)).fetchone()
-
-                    if existing_wheel:
-                        wheel_id = existing_wheel['id']
-                        database.update_wheel_import(conn, wheel_id, brand, model, diameter, pcd, width, et, color, quantity, cost, cost_online, wholesale_price1, wholesale_price2, retail_price, image_filename)
-                        updated_count += 1
-                        
-                        old_quantity = existing_wheel['quantity']
-                        if quantity != old_quantity:
-                            movement_type = 'IN' if quantity > old_quantity else 'OUT'
-                            quantity_change_diff = abs(quantity - old_quantity)
-                            database.add_wheel_movement(conn, wheel_id, movement_type, quantity_change_diff, quantity, "Import from Excel (Qty Update)")
-                    else:
-                        new_wheel_id = database.add_wheel_import(conn, brand, model, diameter, pcd, width, et, color, quantity, cost, cost_online, wholesale_price1, wholesale_price2, retail_price, image_filename)
-                        database.add_wheel_movement(conn, new_wheel_id, 'IN', quantity, quantity, "Import from Excel (initial stock)")
-                        imported_count += 1
-                except Exception as row_e:
-                    error_rows.append(f"แถวที่ {index + 2}: {row_e} - {row.to_dict()}")
-            
-            conn.commit()
-            
-            message = f'นำเข้าข้อมูลแม็กสำเร็จ: เพิ่มใหม่ {imported_count} รายการ, อัปเดต {updated_count} รายการ.'
-            if error_rows:
-                message += f' พบข้อผิดพลาดใน {len(error_rows)} แถว: {"; ".join(error_rows[:3])}{"..." if len(error_rows) > 3 else ""}'
-                flash(message, 'warning')
-            else:
-                flash(message, 'success')
-            
-            return redirect(url_for('export_import', tab='wheels_excel'))
-
-        except Exception as e:
-            flash(f'เกิดข้อผิดพลาดในการนำเข้าไฟล์ Excel ของแม็ก: {e}', 'danger')
-            if 'db' in g and g.db is not None:
-                g.db.rollback()
-            return redirect(url_for('export_import', tab='wheels_excel'))
+    if file and allowed_import_file(file.filename):
+        # บันทึกไฟล์แล้วส่งเข้าคิวนำเข้าเบื้องหลัง ไม่ให้ request ค้างจน gunicorn timeout
+        job_id = save_import_upload(file, 'wheels')
+        flash(f'ได้รับไฟล์แล้ว กำลังนำเข้าข้อมูลแม็กเบื้องหลัง (งาน #{job_id}) ดูความคืบหน้าได้ในตารางด้านล่าง', 'info')
+        return redirect(url_for('export_import', tab='wheels_excel'))
     else:
-        flash('ชนิดไฟล์ไม่ถูกต้อง อนุญาตเฉพาะ .xlsx และ .xls เท่านั้น', 'danger')
+        flash('ชนิดไฟล์ไม่ถูกต้อง อนุญาตเฉพาะ .xlsx, .xls, .csv และ .parquet เท่านั้น', 'danger')
         return redirect(url_for('export_import', tab='wheels_excel'))
 
+# --- JSON API (v1) ---
+# ให้ POS/หน้าร้านออนไลน์อ่านข้อมูลแทนการ scrape หน้า index.html
+API_DEFAULT_LIMIT = 100
+API_MAX_LIMIT = 1000
+API_STREAM_CHUNK_ROWS = 200
+
+TIRE_API_FIELDS = ('id', 'brand', 'model', 'size', 'quantity', 'price_per_item', 'wholesale_price1', 'wholesale_price2',
+                   'cost_sc', 'cost_dunlop', 'cost_online', 'year_of_manufacture',
+                   'size_width', 'size_aspect', 'size_construction', 'size_rim', 'size_load_index', 'size_speed_rating',
+                   'promotion_id', 'promo_name', 'promo_type', 'promo_value1', 'promo_value2', 'promo_is_active',
+                   'display_promo_price_per_item', 'display_price_for_4', 'display_promo_description_text')
+WHEEL_API_FIELDS = ('id', 'brand', 'model', 'diameter', 'pcd', 'width', 'et', 'color', 'quantity',
+                    'cost', 'cost_online', 'wholesale_price1', 'wholesale_price2', 'retail_price', 'image_filename')
+FITMENT_API_FIELDS = ('id', 'wheel_id', 'brand', 'model', 'year_start', 'year_end')
+MOVEMENT_API_FIELDS = ('id', 'timestamp', 'type', 'quantity_change', 'remaining_quantity', 'notes')
+PROMOTION_API_FIELDS = ('id', 'name', 'type', 'value1', 'value2', 'is_active', 'created_at', 'description_text')
+
+def api_error(message, status=400):
+    return jsonify({'error': message}), status
+
+def parse_api_fields(allowed):
+    # ?fields=id,brand,quantity -> เลือกเฉพาะคอลัมน์ที่ต้องการ (ไม่ระบุ = ทุกคอลัมน์)
+    value = request.args.get('fields', '').strip()
+    if not value:
+        return allowed
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def parse_api_limit():
+    # ?limit=all ส่งทั้งหมดแบบ stream ไม่แบ่งหน้า
+    value = request.args.get('limit', '').strip()
+    if not value:
+        return API_DEFAULT_LIMIT
+    if value == 'all':
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer or 'all'")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, API_MAX_LIMIT)
+
+def parse_api_after(shape):
+    token = request.args.get('after')
+    after = database.decode_cursor(token, shape)
+    if token and after is None:
+        raise ValueError("Invalid cursor")
+    return after
+
+def stream_api_rows(rows, fields, limit, cursor_values):
+    # เขียน JSON ทีละชุดระหว่างอ่าน cursor: {"data": [...], "next_cursor": ...}
+    # rows ต้องขอมาเกิน limit หนึ่งแถว เพื่อรู้ว่ามีหน้าถัดไปหรือไม่
+    # ดึงแถวแรกก่อนส่ง header: ถ้า query ผิดพลาดจะได้ error ปกติ ไม่ใช่ 200 กับ JSON ที่ขาดกลางทาง
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is not None:
+        rows = itertools.chain([first], rows)
+
+    def generate():
+        yield '{"data": ['
+        chunk = []
+        count = 0
+        last = None
+        next_cursor = None
+        for row in rows:
+            if limit is not None and count == limit:
+                next_cursor = database.encode_cursor(cursor_values(last))
+                break
+            chunk.append(json.dumps({field: row[field] for field in fields}, ensure_ascii=False))
+            count += 1
+            last = row
+            if len(chunk) >= API_STREAM_CHUNK_ROWS:
+                yield (',' if count > len(chunk) else '') + ','.join(chunk)
+                chunk = []
+        if chunk:
+            yield (',' if count > len(chunk) else '') + ','.join(chunk)
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/api/v1/tires')
+@conditional_get('tires', 'promotions')
+def api_tires():
+    try:
+        fields = parse_api_fields(TIRE_API_FIELDS)
+        limit = parse_api_limit()
+        after = parse_api_after(database.TIRE_CURSOR_SHAPE)
+    except ValueError as e:
+        return api_error(str(e))
+    size_filters = {}
+    for key in ('width', 'aspect', 'rim'):
+        value = parse_size_filter_arg(request.args.get(key))
+        if value is not None:
+            size_filters[key] = value
+    rows = database.iter_tires(get_db(), query=request.args.get('q', '').strip(),
+                               brand_filter=request.args.get('brand', 'all').strip(),
+                               size_filters=size_filters, after=after,
+                               limit=None if limit is None else limit + 1)
+    return stream_api_rows(rows, fields, limit, database.tire_cursor_values)
+
+@app.route('/api/v1/wheels')
+@conditional_get('wheels')
+def api_wheels():
+    try:
+        fields = parse_api_fields(WHEEL_API_FIELDS)
+        limit = parse_api_limit()
+        after = parse_api_after(database.WHEEL_CURSOR_SHAPE)
+    except ValueError as e:
+        return api_error(str(e))
+    rows = database.iter_wheels(get_db(), query=request.args.get('q', '').strip(),
+                                brand_filter=request.args.get('brand', 'all').strip(),
+                                after=after, limit=None if limit is None else limit + 1)
+    return stream_api_rows(rows, fields, limit, database.wheel_cursor_values)
+
+@app.route('/api/v1/wheels/<int:wheel_id>/fitments')
+@conditional_get('wheels', 'wheel_fitments')
+def api_wheel_fitments(wheel_id):
+    try:
+        fields = parse_api_fields(FITMENT_API_FIELDS)
+    except ValueError as e:
+        return api_error(str(e))
+    conn = get_db()
+    if database.get_wheel(conn, wheel_id) is None:
+        return api_error('Wheel not found', 404)
+    fitments = database.get_wheel_fitments(conn, wheel_id)
+    return jsonify({'data': [{field: fitment[field] for field in fields} for fitment in fitments]})
+
+@app.route('/api/v1/promotions')
+@conditional_get('promotions')
+def api_promotions():
+    try:
+        fields = parse_api_fields(PROMOTION_API_FIELDS)
+    except ValueError as e:
+        return api_error(str(e))
+    include_inactive = request.args.get('include_inactive') in ('1', 'true')
+    promotions = database.get_all_promotions(get_db(), include_inactive=include_inactive)
+    return jsonify({'data': [{field: promo[field] for field in fields} for promo in promotions]})
+
+STOCK_BATCH_MAX_LINES = 1000
+
+def parse_stock_movement_lines(payload):
+    # {"notes": "...", "lines": [{"kind": "tire"|"wheel", "id": 1, "type": "IN"|"OUT", "quantity": 4, "notes": "..."}]}
+    # notes ระดับบิล ใช้เป็นค่าเริ่มต้นของทุกบรรทัด; ตรวจทุกบรรทัดแล้วคืนข้อผิดพลาดทั้งหมดในครั้งเดียว
+    if not isinstance(payload, dict) or not isinstance(payload.get('lines'), list) or not payload['lines']:
+        raise ValueError("Request body must be a JSON object with a non-empty 'lines' list")
+    if len(payload['lines']) > STOCK_BATCH_MAX_LINES:
+        raise ValueError(f"At most {STOCK_BATCH_MAX_LINES} lines per request")
+    default_notes = str(payload.get('notes') or '').strip()
+    lines = []
+    errors = []
+    for index, line in enumerate(payload['lines']):
+        if not isinstance(line, dict):
+            errors.append((index, 'line must be an object'))
+            continue
+        kind = line.get('kind')
+        move_type = line.get('type')
+        item_id = line.get('id')
+        quantity = line.get('quantity')
+        if kind not in database.STOCK_KINDS:
+            errors.append((index, "kind must be 'tire' or 'wheel'"))
+        elif move_type not in database.STOCK_MOVEMENT_SIGNS:
+            errors.append((index, "type must be 'IN' or 'OUT'"))
+        elif not isinstance(item_id, int) or isinstance(item_id, bool):
+            errors.append((index, 'id must be an integer'))
+        elif not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            errors.append((index, 'quantity must be a positive integer'))
+        else:
+            notes = str(line.get('notes') or '').strip() or default_notes
+            lines.append((kind, item_id, move_type, quantity, notes))
+    return lines, errors
+
+def stock_batch_error(message, errors, status):
+    return jsonify({'error': message,
+                    'errors': [{'line': index, 'message': line_message} for index, line_message in errors]}), status
+
+@app.route('/api/v1/stock_movements', methods=['POST'])
+def api_stock_movements():
+    # รับสินค้าเข้าทั้งตู้ / ตัดสต็อกทั้งบิลในคำขอเดียว: ทุกบรรทัดสำเร็จพร้อมกันหรือไม่บันทึกเลย
+    started = time.perf_counter()
+    try:
+        lines, errors = parse_stock_movement_lines(request.get_json(silent=True))
+    except ValueError as e:
+        return api_error(str(e))
+    if errors:
+        return stock_batch_error('Invalid lines', errors, 400)
+
+    results, errors = database.apply_stock_movements(get_db(), lines)
+    if errors:
+        return stock_batch_error('No movements were recorded', errors, 409)
+
+    elapsed = time.perf_counter() - started
+    return jsonify({
+        'data': [{'kind': kind, 'id': item_id, 'type': move_type, 'quantity_change': quantity,
+                  'remaining_quantity': remaining}
+                 for (kind, item_id, move_type, quantity, _), (_, _, remaining) in zip(lines, results)],
+        'lines': len(lines),
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'lines_per_second': round(len(lines) / elapsed, 1) if elapsed > 0 else None,
+    })
+
+@app.route('/api/v1/stock_movements', methods=['GET'])
+@conditional_get('tire_movements', 'wheel_movements', 'tires', 'wheels')
+def api_movement_history():
+    try:
+        filters = read_movement_filters(request.args)
+        config = database.STOCK_KINDS[filters['kind']]
+        fields = parse_api_fields(MOVEMENT_API_FIELDS + (config['movement_id'],) + config['item_columns'])
+        limit = parse_api_limit()
+        after = parse_api_after(database.MOVEMENT_CURSOR_SHAPE)
+    except ValueError as e:
+        return api_error(str(e))
+    rows = database.iter_movements(get_db(), after=after, limit=None if limit is None else limit + 1, **filters)
+    return stream_api_rows(rows, fields, limit, database.movement_cursor_values)
+
+@app.route('/api/v1/stock_on_hand')
+@conditional_get('tire_movements', 'wheel_movements', 'tires', 'wheels')
+def api_stock_on_hand():
+    # สต็อกคงเหลือและมูลค่า ณ สิ้นวันที่ระบุ (?kind=tire|wheel&date=YYYY-MM-DD, ไม่ระบุ = วันนี้)
+    kind = request.args.get('kind', 'tire')
+    if kind not in database.STOCK_KINDS:
+        return api_error("kind must be 'tire' or 'wheel'")
+    try:
+        as_of = date.fromisoformat(request.args['date']) if request.args.get('date') else get_bkk_time().date()
+    except ValueError:
+        return api_error("date must be YYYY-MM-DD")
+    conn = get_db()
+    rows, snapshot_date = database.get_stock_as_of(conn, kind, as_of.isoformat())
+    data = [{'id': row['item_id'], 'quantity': row['quantity'], 'unit_cost': row['unit_cost'],
+             'value': row['quantity'] * row['unit_cost'] if row['unit_cost'] is not None else None}
+            for row in rows if row['quantity']]
+    return jsonify({
+        'date': as_of.isoformat(),
+        'snapshot_date': snapshot_date,
+        'total_quantity': sum(item['quantity'] for item in data),
+        'total_value': sum(item['value'] for item in data if item['value'] is not None),
+        'data': data,
+    })
+
+@app.route('/api/v1/reports/valuation')
+@conditional_get('tires', 'wheels')
+def api_valuation_report():
+    try:
+        kind, group_by = read_valuation_args(request.args)
+    except ValueError as e:
+        return api_error(str(e))
+    rows, totals = database.get_valuation_report(get_db(), kind, group_by)
+    return jsonify({'kind': kind, 'group': group_by, 'data': rows, 'totals': totals})
+
+@app.route('/api/v1/low_stock')
+@conditional_get('tires', 'wheels', 'reorder_thresholds')
+def api_low_stock():
+    kind = request.args.get('kind', 'tire')
+    if kind not in database.STOCK_KINDS:
+        return api_error("kind must be 'tire' or 'wheel'")
+    alerts = database.get_low_stock_alerts(get_db(), kind, request.args.get('brand') or None)
+    return jsonify({'kind': kind, 'data': alerts})
+
+# รันตอน import ด้วย เพื่อให้ gunicorn worker ได้ตาราง/ดัชนีล่าสุด (migrate_db ป้องกันการรันซ้ำเอง)
+setup_database()
+
 if __name__ == '__main__':
-    setup_database()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
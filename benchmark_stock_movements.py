@@ -0,0 +1,54 @@
+# Throughput figure for database.move_stock(): workers hammer one tire and one wheel with OUT movements on a
+# scratch database holding half the stock they ask for. Correctness under concurrency is covered by
+# tests/test_stock_movements.py; this script only measures.
+#   python benchmark_stock_movements.py [workers] [moves_per_worker]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import database
+
+
+def benchmark_stock_movements(workers=8, moves_per_worker=250):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'benchmark.db')
+        conn = database._open_connection(db_path)
+        database.init_db(conn)
+        initial_quantity = workers * moves_per_worker // 4 # each kind gets half the attempts
+        conn.execute("INSERT INTO tires (brand, model, size, quantity, price_per_item) VALUES ('B', 'M', '205/55R16', ?, 0)",
+                     (initial_quantity,))
+        conn.execute("INSERT INTO wheels (brand, model, diameter, pcd, width, quantity, retail_price) VALUES ('B', 'M', 15, '4x100', 7, ?, 0)",
+                     (initial_quantity,))
+        conn.commit()
+        conn.close()
+
+        moved = []
+        def worker(worker_index):
+            worker_conn = database._open_connection(db_path)
+            count = 0
+            for move_index in range(moves_per_worker):
+                kind = 'tire' if (worker_index + move_index) % 2 == 0 else 'wheel'
+                ok, _ = database.move_stock(worker_conn, kind, 1, 'OUT', 1, 'benchmark')
+                count += ok
+            worker_conn.close()
+            moved.append(count)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    attempts = workers * moves_per_worker
+    return {'attempts': attempts, 'moved': sum(moved), 'seconds': elapsed,
+            'per_second': attempts / elapsed if elapsed > 0 else None}
+
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:3]]
+    result = benchmark_stock_movements(*arguments)
+    print(f"{result['attempts']} movements attempted, {result['moved']} applied in {result['seconds']:.2f}s "
+          f"({result['per_second']:.0f}/s)")
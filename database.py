@@ -1,16 +1,284 @@
+import base64
+import functools
+import heapq
+import itertools
+import json
+import os
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 import pytz
 
+DB_PATH = 'inventory.db'
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# PRAGMAs applied once when a pooled connection is opened (not on every request)
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),        # readers don't block the writer across gunicorn workers
+    ('synchronous', 'NORMAL'),      # safe with WAL, one fsync per checkpoint instead of per commit
+    ('mmap_size', 268435456),       # 256 MB memory-mapped reads
+    ('cache_size', -16000),         # ~16 MB page cache per connection (negative = KiB)
+    ('busy_timeout', 5000),         # wait up to 5s for a competing writer instead of failing
+    ('foreign_keys', 'ON'),
+    ('temp_store', 'MEMORY'),
+)
+
 def get_bkk_time():
     bkk_tz = pytz.timezone('Asia/Bangkok')
     return datetime.now(bkk_tz)
 
-def get_db_connection():
-    conn = sqlite3.connect('inventory.db')
+def _open_connection(db_path):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row # This allows accessing columns by name (e.g., row['column_name'])
+    for pragma, value in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {value}")
     return conn
 
+def fetch_dicts(conn, sql_query, params=()):
+    # Builds dicts straight from tuples; dict(sqlite3.Row) is several times slower on large result sets
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql_query, params)
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def iter_dicts(conn, sql_query, params=(), batch_size=500):
+    # Same as fetch_dicts but yields rows batch by batch, so a full table never sits in memory at once
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql_query, params)
+    names = [column[0] for column in cursor.description]
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        for row in batch:
+            yield dict(zip(names, row))
+
+def encode_cursor(values):
+    # Opaque, URL-safe keyset cursor for the listing pages and the API
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+# Cursor shapes: one accepted type per keyset column (see tire_cursor_values, wheel_cursor_values, movement_cursor_values,
+# ranked_cursor_values)
+TIRE_CURSOR_SHAPE = (str, str, str, int)
+WHEEL_CURSOR_SHAPE = (str, str, (int, float), int)
+MOVEMENT_CURSOR_SHAPE = (str, int)
+RANKED_CURSOR_SHAPE = ((int, float), int)
+
+def cursor_matches(values, shape):
+    # Right length and one scalar of the expected type per column (bool is an int subclass, reject it explicitly)
+    return (isinstance(values, list) and len(values) == len(shape)
+            and all(isinstance(value, types) and not isinstance(value, bool) for value, types in zip(values, shape)))
+
+def decode_cursor(token, shape):
+    # Returns None for a missing, malformed or wrong-shaped cursor, so it can never reach the SQL as bindings
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+    return values if cursor_matches(values, shape) else None
+
+class ConnectionPool:
+    def __init__(self, db_path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time_total': 0.0, 'wait_time_max': 0.0}
+
+    def acquire(self):
+        started = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._stats['hits'] += 1
+                    conn = self._idle.pop()
+                    break
+                if self._created < self.max_size:
+                    self._created += 1
+                    self._stats['misses'] += 1
+                    conn = None
+                    break
+                # Pool exhausted: wait for another thread to release a connection
+                if started is None:
+                    started = time.perf_counter()
+                    self._stats['waits'] += 1
+                remaining = self.timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    raise sqlite3.OperationalError('database connection pool exhausted')
+                self._cond.wait(remaining)
+            if started is not None:
+                waited = time.perf_counter() - started
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        if conn is not None:
+            return conn
+
+        # Open outside the lock so a slow open doesn't stall other requests
+        try:
+            return _open_connection(self.db_path)
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection: drop it and let the next acquire open a fresh one
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            conn.close()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._created
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._created - len(self._idle)
+            stats['max_size'] = self.max_size
+            requests = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = stats['hits'] / requests if requests else 0.0
+            stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+            return stats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    # One pool per worker process; gunicorn forks after import so re-create on pid change
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+def get_db_connection():
+    return get_pool().acquire()
+
+def release_db_connection(conn):
+    get_pool().release(conn)
+
+# --- Catalog Cache ---
+# Read-through cache for the full catalog listings. Entries are tagged with the data generation of the
+# tables they were built from; triggers bump data_generations on every write, so any worker sees a
+# change on its next lookup without a shared cache service.
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 64))
+CATALOG_CACHE_MAX_ROWS = int(os.environ.get('CATALOG_CACHE_MAX_ROWS', 200000))
+GENERATION_TABLES = ('tires', 'wheels', 'promotions', 'wheel_fitments', 'tire_movements', 'wheel_movements')
+
+class CatalogCache:
+    def __init__(self, max_entries=CATALOG_CACHE_MAX_ENTRIES, max_rows=CATALOG_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict() # key -> (generations, rows)
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, generations):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generations:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, generations, rows):
+        size = len(rows)
+        if size > self.max_rows:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._rows -= len(old[1])
+            self._entries[key] = (generations, rows)
+            self._rows += size
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._rows -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['rows'] = self._rows
+            stats['max_entries'] = self.max_entries
+            stats['max_rows'] = self.max_rows
+            return stats
+
+catalog_cache = CatalogCache()
+
+def get_data_generations(conn, tables=GENERATION_TABLES):
+    rows = conn.execute(
+        f"SELECT name, generation FROM data_generations WHERE name IN ({', '.join('?' * len(tables))})", tables
+    ).fetchall()
+    generations = {row['name']: row['generation'] for row in rows}
+    return tuple(generations.get(table, 0) for table in tables)
+
+def get_data_version(conn, tables):
+    # (generations, last modified as naive UTC datetime or None) for conditional GET
+    rows = conn.execute(
+        f"SELECT name, generation, updated_at FROM data_generations WHERE name IN ({', '.join('?' * len(tables))})", tables
+    ).fetchall()
+    by_name = {row['name']: row for row in rows}
+    generations = tuple(by_name[table]['generation'] if table in by_name else 0 for table in tables)
+    timestamps = [row['updated_at'] for row in rows if row['updated_at']]
+    last_modified = datetime.strptime(max(timestamps), '%Y-%m-%d %H:%M:%S') if timestamps else None
+    return generations, last_modified
+
+def cached_catalog_read(*tables):
+    # Results are shared between requests: callers must treat them as read-only
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(conn, *args, **kwargs):
+            if conn.in_transaction:
+                # Uncommitted writes would tag the entry with a generation that may be rolled back
+                return func(conn, *args, **kwargs)
+            key = (func.__name__, repr(args), repr(sorted(kwargs.items())))
+            generations = get_data_generations(conn, tables)
+            rows = catalog_cache.get(key, generations)
+            if rows is None:
+                rows = func(conn, *args, **kwargs)
+                catalog_cache.put(key, generations, rows)
+            return rows
+        return wrapper
+    return decorator
+
 def init_db(conn):
     cursor = conn.cursor()
 
@@ -108,8 +376,686 @@ def init_db(conn):
         );
     """)
     conn.commit()
+    migrate_db(conn)
+    ensure_search_fts(conn)
+
+# --- Schema Migrations ---
+# Each migration runs once, in order; the applied count is stored in PRAGMA user_version.
+def _migration_secondary_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tire_movements_tire_ts ON tire_movements(tire_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tire_movements_ts ON tire_movements(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_wheel_movements_wheel_ts ON wheel_movements(wheel_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_wheel_movements_ts ON wheel_movements(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tires_promotion_id ON tires(promotion_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_wheel_fitments_brand_model ON wheel_fitments(brand, model, year_start, wheel_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_promotions_active_name ON promotions(is_active, name)")
+    conn.execute("ANALYZE")
+
+FTS_TABLES = {
+    # fts table: (content table, indexed columns)
+    'tires_fts': ('tires', ('brand', 'model', 'size')),
+    'wheels_fts': ('wheels', ('brand', 'model', 'pcd', 'color')),
+}
+
+def _migration_search_fts(conn):
+    # External-content FTS5 tables with the trigram tokenizer (SQLite >= 3.34), kept in sync by triggers.
+    # If this SQLite build lacks FTS5/trigram the search keeps using LIKE (see ensure_search_fts).
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS _fts_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE _fts_probe")
+    except sqlite3.OperationalError:
+        return
+    for fts_table, (content_table, columns) in FTS_TABLES.items():
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{col}" for col in columns)
+        old_values = ", ".join(f"old.{col}" for col in columns)
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {column_list}, content='{content_table}', content_rowid='id', tokenize='trigram'
+            )
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {content_table} BEGIN
+                INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {content_table} BEGIN
+                INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {content_table} BEGIN
+                INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        """)
+        conn.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
+def _missing_fts_tables(conn):
+    return [fts_table for fts_table in FTS_TABLES
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)).fetchone()]
+
+def ensure_search_fts(conn):
+    # _migration_search_fts is recorded even when it had to skip (later migrations can't wait for it), so a
+    # database first migrated on a build without FTS5/trigram gets its FTS tables on the first start after an upgrade
+    if not _missing_fts_tables(conn):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if _missing_fts_tables(conn):
+            _migration_search_fts(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def _migration_tire_size_columns(conn):
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(tires)")}
+    for column, column_type in zip(TIRE_SIZE_COLUMNS, ('INTEGER', 'INTEGER', 'TEXT', 'REAL', 'INTEGER', 'TEXT')):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE tires ADD COLUMN {column} {column_type} NULL")
+    rows = conn.execute("SELECT id, size FROM tires").fetchall()
+    conn.executemany(
+        "UPDATE tires SET " + ", ".join(f"{col} = ?" for col in TIRE_SIZE_COLUMNS) + " WHERE id = ?",
+        [parse_tire_size(row['size']) + (row['id'],) for row in rows]
+    )
+    # "17 นิ้ว ซีรีส์ 65" -> rim first; width-first index serves "หน้ากว้าง 265" lookups
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tires_size_rim ON tires(size_rim, size_aspect, size_width)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tires_size_width ON tires(size_width, size_aspect, size_rim)")
+
+def refresh_effective_tire_prices_sql(where_sql):
+    return f"""
+        INSERT OR REPLACE INTO effective_tire_prices (tire_id, promo_price_per_item, price_for_4, promo_description_text)
+        SELECT t.id,
+               {TIRE_PROMO_PRICE_SQL},
+               COALESCE({TIRE_PROMO_PRICE_SQL}, t.price_per_item) * 4,
+               CASE WHEN t.promotion_id IS NOT NULL AND p.is_active = 1 AND t.price_per_item IS NOT NULL
+                    THEN {promotion_description_sql('p')} END
+        FROM tires t
+        LEFT JOIN promotions p ON t.promotion_id = p.id
+        WHERE {where_sql}
+    """
+
+def _migration_effective_tire_prices(conn):
+    # Stored projection of promo-adjusted prices, kept current by triggers so every write path
+    # (forms, importer, raw SQL) updates it and reads never run pricing code.
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(promotions)")}
+    if 'description_text' not in existing:
+        conn.execute("ALTER TABLE promotions ADD COLUMN description_text TEXT NULL")
+    for promo in conn.execute("SELECT id, type, value1, value2 FROM promotions").fetchall():
+        conn.execute("UPDATE promotions SET description_text = ? WHERE id = ?",
+                     (promotion_description(promo['type'], promo['value1'], promo['value2']), promo['id']))
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS effective_tire_prices (
+            tire_id INTEGER PRIMARY KEY,
+            promo_price_per_item REAL NULL,   -- NULL = ไม่มีโปรโมชันที่ใช้งานอยู่
+            price_for_4 REAL NULL,
+            promo_description_text TEXT NULL
+        )
+    """)
+    _create_effective_tire_price_triggers(conn)
+    conn.execute(refresh_effective_tire_prices_sql('1 = 1'))
+
+EFFECTIVE_TIRE_PRICE_TRIGGERS = ('effective_tire_prices_tire_ai', 'effective_tire_prices_tire_au', 'effective_tire_prices_tire_ad',
+                                 'effective_tire_prices_promo_au', 'effective_tire_prices_promo_ad')
+
+def _create_effective_tire_price_triggers(conn):
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS effective_tire_prices_tire_ai AFTER INSERT ON tires BEGIN
+            {refresh_effective_tire_prices_sql('t.id = new.id')};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS effective_tire_prices_tire_au AFTER UPDATE OF price_per_item, promotion_id ON tires BEGIN
+            {refresh_effective_tire_prices_sql('t.id = new.id')};
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS effective_tire_prices_tire_ad AFTER DELETE ON tires BEGIN
+            DELETE FROM effective_tire_prices WHERE tire_id = old.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS effective_tire_prices_promo_au AFTER UPDATE ON promotions BEGIN
+            {refresh_effective_tire_prices_sql('t.promotion_id = new.id')};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS effective_tire_prices_promo_ad AFTER DELETE ON promotions BEGIN
+            {refresh_effective_tire_prices_sql('t.promotion_id = old.id')};
+        END
+    """)
+
+def _migration_listing_indexes(conn):
+    # Keyset order for the paginated wheel listing; tires already have UNIQUE(brand, model, size) (+ rowid)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_wheels_listing ON wheels(brand, model, diameter, id)")
+
+def _migration_data_generations(conn):
+    # One counter per table, bumped by triggers on every insert/update/delete (cache + ETag validation)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_generations (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table in GENERATION_TABLES:
+        conn.execute("INSERT OR IGNORE INTO data_generations (name, generation) VALUES (?, 0)", (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_generation_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE data_generations SET generation = generation + 1 WHERE name = '{table}';
+                END
+            """)
+
+def _migration_data_generation_timestamps(conn):
+    # updated_at backs the Last-Modified header; triggers are recreated to maintain it
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(data_generations)")}
+    if 'updated_at' not in existing:
+        conn.execute("ALTER TABLE data_generations ADD COLUMN updated_at TEXT NULL")
+    conn.execute("UPDATE data_generations SET updated_at = CURRENT_TIMESTAMP")
+    for table in GENERATION_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_generation_{event.lower()}")
+            _create_generation_trigger(conn, table, event)
+
+def _create_generation_trigger(conn, table, event):
+    conn.execute(f"""
+        CREATE TRIGGER {table}_generation_{event.lower()} AFTER {event} ON {table} BEGIN
+            UPDATE data_generations SET generation = generation + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE name = '{table}';
+        END
+    """)
+
+def bump_generation(conn, table):
+    # One bump for a bulk statement that ran with the per-row trigger suspended (caller commits)
+    conn.execute("UPDATE data_generations SET generation = generation + 1, updated_at = CURRENT_TIMESTAMP WHERE name = ?",
+                 (table,))
+
+def _migration_import_jobs(conn):
+    # Background import jobs (see importer.py); row errors are kept per job so they can be paged through
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,             -- 'tires' หรือ 'wheels'
+            filename TEXT NOT NULL,         -- ชื่อไฟล์ที่ผู้ใช้อัปโหลด
+            file_path TEXT NOT NULL,        -- ไฟล์ที่บันทึกไว้ใน uploads/ รอ worker อ่าน
+            status TEXT NOT NULL,           -- 'queued', 'running', 'done', 'failed'
+            total_rows INTEGER NULL,
+            processed_rows INTEGER DEFAULT 0,
+            imported_count INTEGER DEFAULT 0,
+            updated_count INTEGER DEFAULT 0,
+            error_count INTEGER DEFAULT 0,
+            message TEXT NULL,
+            created_at TEXT NOT NULL,
+            started_at TEXT NULL,
+            finished_at TEXT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_job_errors (
+            job_id INTEGER NOT NULL,
+            row_number INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            PRIMARY KEY (job_id, row_number),
+            FOREIGN KEY (job_id) REFERENCES import_jobs(id) ON DELETE CASCADE
+        )
+    """)
+
+def _migration_import_rows(conn):
+    # Staged sheet rows per import job; a dry run keeps them (with their diff) until the user confirms or discards
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(import_jobs)")}
+    if 'mode' not in existing:
+        conn.execute("ALTER TABLE import_jobs ADD COLUMN mode TEXT NOT NULL DEFAULT 'apply'") # 'apply', 'preview', 'confirmed'
+    if 'unchanged_count' not in existing:
+        conn.execute("ALTER TABLE import_jobs ADD COLUMN unchanged_count INTEGER DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tire_import_rows (
+            job_id INTEGER NOT NULL,
+            row_number INTEGER NOT NULL,    -- เลขแถวในไฟล์ (แถว 1 คือหัวตาราง)
+            brand TEXT NOT NULL,
+            model TEXT NOT NULL,
+            size TEXT NOT NULL,
+            quantity INTEGER,
+            cost_sc REAL NULL,
+            cost_dunlop REAL NULL,
+            cost_online REAL NULL,
+            wholesale_price1 REAL NULL,
+            wholesale_price2 REAL NULL,
+            price_per_item REAL NOT NULL,
+            promotion_id INTEGER NULL,
+            year_of_manufacture INTEGER NULL,
+            size_width INTEGER NULL,
+            size_aspect INTEGER NULL,
+            size_construction TEXT NULL,
+            size_rim REAL NULL,
+            size_load_index INTEGER NULL,
+            size_speed_rating TEXT NULL,
+            action TEXT NULL,               -- 'insert', 'update', 'unchanged' (จาก classify_import_rows)
+            item_id INTEGER NULL,           -- tires.id ที่ตรงกัน
+            old_quantity INTEGER NULL,
+            old_price REAL NULL,
+            PRIMARY KEY (job_id, row_number),
+            FOREIGN KEY (job_id) REFERENCES import_jobs(id) ON DELETE CASCADE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS wheel_import_rows (
+            job_id INTEGER NOT NULL,
+            row_number INTEGER NOT NULL,
+            brand TEXT NOT NULL,
+            model TEXT NOT NULL,
+            diameter REAL NOT NULL,
+            pcd TEXT NOT NULL,
+            width REAL NOT NULL,
+            et INTEGER NULL,
+            color TEXT NULL,
+            quantity INTEGER,
+            cost REAL NULL,
+            cost_online REAL NULL,
+            wholesale_price1 REAL NULL,
+            wholesale_price2 REAL NULL,
+            retail_price REAL NOT NULL,
+            image_filename TEXT NULL,
+            action TEXT NULL,
+            item_id INTEGER NULL,           -- wheels.id ที่ตรงกัน
+            old_quantity INTEGER NULL,
+            old_price REAL NULL,
+            PRIMARY KEY (job_id, row_number),
+            FOREIGN KEY (job_id) REFERENCES import_jobs(id) ON DELETE CASCADE
+        )
+    """)
+
+def _migration_movement_history_indexes(conn):
+    # History pages filter by type (with or without an item) and walk (timestamp, id) backwards;
+    # the existing (item, timestamp) and (timestamp) indexes cover the other combinations (id rides along as rowid)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tire_movements_type_ts ON tire_movements(type, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tire_movements_tire_type_ts ON tire_movements(tire_id, type, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_wheel_movements_type_ts ON wheel_movements(type, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_wheel_movements_wheel_type_ts ON wheel_movements(wheel_id, type, timestamp)")
+
+def _migration_stock_snapshots(conn):
+    # End-of-day quantity/cost per item, built incrementally by build_stock_snapshots(); one run row per snapshot date
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_snapshots (
+            kind TEXT NOT NULL,             -- 'tire' / 'wheel'
+            snapshot_date TEXT NOT NULL,    -- YYYY-MM-DD, สต็อก ณ สิ้นวัน
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_cost REAL NULL,            -- ทุนต่อชิ้น ณ เวลาที่สร้าง snapshot
+            PRIMARY KEY (kind, snapshot_date, item_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_snapshot_runs (
+            kind TEXT NOT NULL,
+            snapshot_date TEXT NOT NULL,
+            period TEXT NOT NULL,           -- 'day' / 'month'
+            item_count INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (kind, snapshot_date)
+        ) WITHOUT ROWID
+    """)
+
+VALUATION_KINDS = {
+    # summary table, group columns, cost columns, price columns
+    'tire': {'table': 'tires', 'summary': 'tire_valuation_summary', 'group_columns': ('brand', 'size'),
+             'costs': ('cost_sc', 'cost_dunlop', 'cost_online'),
+             'prices': ('price_per_item', 'wholesale_price1', 'wholesale_price2')},
+    'wheel': {'table': 'wheels', 'summary': 'wheel_valuation_summary', 'group_columns': ('brand', 'diameter'),
+              'costs': ('cost', 'cost_online'),
+              'prices': ('retail_price', 'wholesale_price1', 'wholesale_price2')},
+}
+
+def _valuation_measures(kind, ref):
+    # (summary column, one item's contribution). ref is 'new.', 'old.' (triggers) or '' (full rebuild).
+    # {column}_quantity counts the stock that actually has that cost/price; margins are summed per
+    # (price, cost) pair over stock that has both, so a missing cost never inflates a margin.
+    config = VALUATION_KINDS[kind]
+    quantity = f"COALESCE({ref}quantity, 0)"
+    measures = [('item_count', f"CASE WHEN {ref}deleted_at IS NULL THEN 1 ELSE 0 END"), ('quantity', quantity)]
+    for column in config['costs'] + config['prices']:
+        measures += [(f"{column}_value", f"{quantity} * COALESCE({ref}{column}, 0)"),
+                     (f"{column}_quantity", f"CASE WHEN {ref}{column} IS NULL THEN 0 ELSE {quantity} END")]
+    for price in config['prices']:
+        for cost in config['costs']:
+            both = f"{ref}{price} IS NOT NULL AND {ref}{cost} IS NOT NULL"
+            measures += [(f"margin_{price}_{cost}", f"CASE WHEN {both} THEN {quantity} * ({ref}{price} - {ref}{cost}) ELSE 0 END"),
+                         (f"margin_base_{price}_{cost}", f"CASE WHEN {both} THEN {quantity} * {ref}{price} ELSE 0 END")]
+    return measures
+
+def _valuation_delta_sql(kind, ref, sign):
+    # Adds (sign=1) or removes (sign=-1) one item's contribution to its group row
+    config = VALUATION_KINDS[kind]
+    group_columns = config['group_columns']
+    measures = _valuation_measures(kind, ref + '.')
+    columns = list(group_columns) + [name for name, _ in measures]
+    values = [f"{ref}.{column}" for column in group_columns] + [f"{sign} * ({expression})" for _, expression in measures]
+    return f"""
+        INSERT INTO {config['summary']} ({", ".join(columns)}) VALUES ({", ".join(values)})
+        ON CONFLICT ({", ".join(group_columns)}) DO UPDATE SET
+            {", ".join(f"{name} = {name} + excluded.{name}" for name, _ in measures)}
+    """
+
+def _valuation_prune_sql(kind, ref):
+    config = VALUATION_KINDS[kind]
+    key_match = " AND ".join(f"{column} = {ref}.{column}" for column in config['group_columns'])
+    return f"DELETE FROM {config['summary']} WHERE {key_match} AND item_count = 0"
+
+def rebuild_valuation_summary(conn, kind):
+    # Full recompute from the catalog (migration backfill; also usable to verify the triggers)
+    config = VALUATION_KINDS[kind]
+    group_columns = ", ".join(config['group_columns'])
+    measures = _valuation_measures(kind, '')
+    conn.execute(f"DELETE FROM {config['summary']}")
+    conn.execute(f"""
+        INSERT INTO {config['summary']} ({group_columns}, {", ".join(name for name, _ in measures)})
+        SELECT {group_columns}, {", ".join(f"SUM({expression})" for _, expression in measures)}
+        FROM {config['table']} GROUP BY {group_columns}
+    """)
+
+def _migration_valuation_summaries(conn):
+    # Per (brand, size) / (brand, diameter) stock value at every cost and price column, kept current by
+    # triggers on every quantity/price/cost/key change, so the valuation report never scans the catalog
+    group_types = {'brand': 'TEXT', 'size': 'TEXT', 'diameter': 'REAL'}
+    _add_deleted_at_columns(conn) # item_count and the triggers below read it
+    for kind, config in VALUATION_KINDS.items():
+        table = config['table']
+        summary = config['summary']
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {summary} (
+                {", ".join(f"{column} {group_types[column]} NOT NULL" for column in config['group_columns'])},
+                {", ".join(f"{name} {'INTEGER' if name.endswith(('count', 'quantity')) else 'REAL'} NOT NULL"
+                           for name, _ in _valuation_measures(kind, ''))},
+                PRIMARY KEY ({", ".join(config['group_columns'])})
+            ) WITHOUT ROWID
+        """)
+        rebuild_valuation_summary(conn, kind)
+        _create_valuation_triggers(conn, kind)
+
+def _create_valuation_triggers(conn, kind):
+    config = VALUATION_KINDS[kind]
+    table = config['table']
+    summary = config['summary']
+    watched = config['group_columns'] + ('quantity', 'deleted_at') + config['costs'] + config['prices']
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {summary}_ai AFTER INSERT ON {table} BEGIN
+            {_valuation_delta_sql(kind, 'new', 1)};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {summary}_au AFTER UPDATE OF {", ".join(watched)} ON {table}
+        WHEN {" OR ".join(f"old.{column} IS NOT new.{column}" for column in watched)}
+        BEGIN
+            {_valuation_delta_sql(kind, 'old', -1)};
+            {_valuation_delta_sql(kind, 'new', 1)};
+            {_valuation_prune_sql(kind, 'old')};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {summary}_ad AFTER DELETE ON {table} BEGIN
+            {_valuation_delta_sql(kind, 'old', -1)};
+            {_valuation_prune_sql(kind, 'old')};
+        END
+    """)
+
+LOW_STOCK_DEFAULT_THRESHOLDS = {'tire': 5, 'wheel': 2} # เท่ากับเกณฑ์สีแดงในหน้ารายการสินค้า
+BKK_NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%S+07:00', 'now', '+7 hours')"
+
+def low_stock_threshold_sql(kind):
+    # Item reorder_point, else the brand threshold, else the kind default (brand '*')
+    return f"""COALESCE(i.reorder_point,
+        (SELECT r.reorder_point FROM reorder_thresholds r WHERE r.kind = '{kind}' AND r.brand = i.brand),
+        (SELECT r.reorder_point FROM reorder_thresholds r WHERE r.kind = '{kind}' AND r.brand = '*'))"""
+
+def refresh_low_stock_statements(kind, condition):
+    # Re-evaluates the items matching condition (SQL over alias i): low ones are upserted (keeping since), others dropped
+    table = STOCK_KINDS[kind]['table']
+    threshold = low_stock_threshold_sql(kind)
+    return (f"""
+        INSERT INTO low_stock_alerts (kind, item_id, quantity, reorder_point, since)
+        SELECT '{kind}', i.id, COALESCE(i.quantity, 0), {threshold}, {BKK_NOW_SQL}
+        FROM {table} i WHERE ({condition}) AND i.deleted_at IS NULL AND COALESCE(i.quantity, 0) <= {threshold}
+        ON CONFLICT (kind, item_id) DO UPDATE SET quantity = excluded.quantity, reorder_point = excluded.reorder_point
+    """, f"""
+        DELETE FROM low_stock_alerts WHERE kind = '{kind}' AND item_id IN (
+            SELECT i.id FROM {table} i
+            WHERE ({condition}) AND (i.deleted_at IS NOT NULL OR NOT COALESCE(i.quantity, 0) <= COALESCE({threshold}, -1))
+        )
+    """)
+
+def _low_stock_trigger_body(kind, condition):
+    return ";\n".join(refresh_low_stock_statements(kind, condition)) + ";"
+
+def _migration_low_stock_alerts(conn):
+    # Reorder thresholds per item (reorder_point) or per brand, and low_stock_alerts holding exactly the items at or
+    # below theirs. Triggers keep it current on every write path (movements, imports, forms), so /low_stock reads
+    # the alert rows instead of checking the whole catalog.
+    for kind, config in STOCK_KINDS.items():
+        existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({config['table']})")}
+        if 'reorder_point' not in existing:
+            conn.execute(f"ALTER TABLE {config['table']} ADD COLUMN reorder_point INTEGER NULL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reorder_thresholds (
+            kind TEXT NOT NULL,
+            brand TEXT NOT NULL,            -- '*' = ค่าเริ่มต้นของสินค้าประเภทนั้น
+            reorder_point INTEGER NOT NULL,
+            PRIMARY KEY (kind, brand)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS low_stock_alerts (
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            reorder_point INTEGER NOT NULL,
+            since TEXT NOT NULL,            -- เวลาที่สต็อกลดถึงเกณฑ์
+            PRIMARY KEY (kind, item_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_low_stock_alerts_kind_quantity ON low_stock_alerts(kind, quantity)")
+    conn.executemany("INSERT OR IGNORE INTO reorder_thresholds (kind, brand, reorder_point) VALUES (?, '*', ?)",
+                     LOW_STOCK_DEFAULT_THRESHOLDS.items())
+
+    # Threshold changes show up in the low-stock page's ETag like the catalog tables do
+    conn.execute("INSERT OR IGNORE INTO data_generations (name, generation, updated_at) VALUES ('reorder_thresholds', 0, CURRENT_TIMESTAMP)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS reorder_thresholds_generation_{event.lower()} AFTER {event} ON reorder_thresholds BEGIN
+                UPDATE data_generations SET generation = generation + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE name = 'reorder_thresholds';
+            END
+        """)
+
+    for kind in STOCK_KINDS:
+        for statement in refresh_low_stock_statements(kind, '1'):
+            conn.execute(statement)
+        _create_low_stock_triggers(conn, kind)
+
+LOW_STOCK_THRESHOLD_EVENTS = (
+    ('INSERT', 'new.kind', "new.brand = '*' OR i.brand = new.brand"),
+    ('UPDATE', 'new.kind', "new.brand = '*' OR old.brand = '*' OR i.brand IN (old.brand, new.brand)"),
+    ('DELETE', 'old.kind', "old.brand = '*' OR i.brand = old.brand"),
+)
+
+def _create_low_stock_triggers(conn, kind):
+    table = STOCK_KINDS[kind]['table']
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS low_stock_{table}_ai AFTER INSERT ON {table} BEGIN
+            {_low_stock_trigger_body(kind, 'i.id = new.id')}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS low_stock_{table}_au AFTER UPDATE OF quantity, reorder_point, brand, deleted_at ON {table}
+        WHEN old.quantity IS NOT new.quantity OR old.reorder_point IS NOT new.reorder_point OR old.brand IS NOT new.brand
+             OR old.deleted_at IS NOT new.deleted_at
+        BEGIN
+            {_low_stock_trigger_body(kind, 'i.id = new.id')}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS low_stock_{table}_ad AFTER DELETE ON {table} BEGIN
+            DELETE FROM low_stock_alerts WHERE kind = '{kind}' AND item_id = old.id;
+        END
+    """)
+    for event, kind_ref, condition in LOW_STOCK_THRESHOLD_EVENTS:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS low_stock_thresholds_{kind}_{event.lower()} AFTER {event} ON reorder_thresholds
+            WHEN {kind_ref} = '{kind}'
+            BEGIN
+                {_low_stock_trigger_body(kind, condition)}
+            END
+        """)
+
+def _migration_ledger_partitions(conn):
+    # Registry of per-year ledger archive tables (see archive_ledger) and the unified *_movements_all views
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_partitions (
+            kind TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            table_name TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            archived_at TEXT NOT NULL,
+            PRIMARY KEY (kind, year)
+        ) WITHOUT ROWID
+    """)
+    for kind in STOCK_KINDS:
+        _create_ledger_view(conn, kind)
+
+def _migration_import_job_worker(conn):
+    # pid of the worker process running the job, so a restarted server can tell orphaned jobs from live ones
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(import_jobs)")}
+    if 'worker_pid' not in existing:
+        conn.execute("ALTER TABLE import_jobs ADD COLUMN worker_pid INTEGER NULL")
+
+def _migration_import_job_worker_token(conn):
+    # worker_pid alone is ambiguous once pids are reused (after a reboot or a long uptime): see worker_token()
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(import_jobs)")}
+    if 'worker_token' not in existing:
+        conn.execute("ALTER TABLE import_jobs ADD COLUMN worker_token TEXT NULL")
+
+def _migration_promotion_description_sql(conn):
+    # Promotion texts are derived in SQL: promotions.description_text by its own triggers and the per-tire copy
+    # inside the effective_tire_prices triggers, so promotions edited with raw SQL no longer leave them stale
+    description = promotion_description_sql('new')
+    for event in ('INSERT', 'UPDATE'):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS promotions_description_{event.lower()} AFTER {event} ON promotions
+            WHEN new.description_text IS NOT ({description})
+            BEGIN
+                UPDATE promotions SET description_text = ({description}) WHERE id = new.id;
+            END
+        """)
+    conn.execute(f"UPDATE promotions SET description_text = ({promotion_description_sql('promotions')})")
+    for trigger in EFFECTIVE_TIRE_PRICE_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    _create_effective_tire_price_triggers(conn)
+    conn.execute(refresh_effective_tire_prices_sql('1 = 1'))
+
+def _add_deleted_at_columns(conn):
+    # delete_item keeps the row of an item that has stock history and sets deleted_at, which hides it from the catalog
+    for config in STOCK_KINDS.values():
+        existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({config['table']})")}
+        if 'deleted_at' not in existing:
+            conn.execute(f"ALTER TABLE {config['table']} ADD COLUMN deleted_at TEXT NULL")
+
+def _migration_item_soft_delete(conn):
+    # Valuation and low-stock alerts skip deleted items; recreate their triggers to watch deleted_at and resync
+    _add_deleted_at_columns(conn)
+    for kind, config in VALUATION_KINDS.items():
+        for event in ('ai', 'au', 'ad'):
+            conn.execute(f"DROP TRIGGER IF EXISTS {config['summary']}_{event}")
+        _create_valuation_triggers(conn, kind)
+        rebuild_valuation_summary(conn, kind)
+    for kind, config in STOCK_KINDS.items():
+        for event in ('ai', 'au', 'ad'):
+            conn.execute(f"DROP TRIGGER IF EXISTS low_stock_{config['table']}_{event}")
+        for event, _, _ in LOW_STOCK_THRESHOLD_EVENTS:
+            conn.execute(f"DROP TRIGGER IF EXISTS low_stock_thresholds_{kind}_{event.lower()}")
+        _create_low_stock_triggers(conn, kind)
+        for statement in refresh_low_stock_statements(kind, '1'):
+            conn.execute(statement)
+
+MIGRATIONS = [
+    _migration_secondary_indexes,
+    _migration_search_fts,
+    _migration_tire_size_columns,
+    _migration_effective_tire_prices,
+    _migration_listing_indexes,
+    _migration_data_generations,
+    _migration_data_generation_timestamps,
+    _migration_import_jobs,
+    _migration_import_rows,
+    _migration_movement_history_indexes,
+    _migration_stock_snapshots,
+    _migration_valuation_summaries,
+    _migration_low_stock_alerts,
+    _migration_ledger_partitions,
+    _migration_import_job_worker,
+    _migration_promotion_description_sql,
+    _migration_item_soft_delete,
+    _migration_import_job_worker_token,
+]
+
+def iter_ranked_search(conn, columns, from_sql, fts_table, alias, conditions, params, after=None, limit=None):
+    # Search results best match first, keyset on (rank, id). conditions[0] is the FTS filter built by the
+    # *_filter_conditions helpers; it becomes the MATCH itself, as in get_all_tires. The cursor comparison is
+    # spelled out: a row value over the FTS5 rank column matches nothing on SQLite 3.40.
+    conditions[0] = f"{fts_table} MATCH ?"
+    if after:
+        conditions.append(f"({fts_table}.rank > ? OR ({fts_table}.rank = ? AND {alias}.id > ?))")
+        params.extend([after[0], after[0], after[1]])
+    sql_query = f"""
+        SELECT {columns}, {fts_table}.rank AS search_rank {from_sql}
+        JOIN {fts_table} ON {fts_table}.rowid = {alias}.id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {fts_table}.rank, {alias}.id LIMIT ?
+    """
+    params.append(-1 if limit is None else limit)
+    return iter_dicts(conn, sql_query, params)
+
+def ranked_cursor_values(row):
+    return [row['search_rank'], row['id']]
+
+def page_cursor_shape(conn, kind, query):
+    # get_tires_page / get_wheels_page switch to a (rank, id) cursor when the query goes through the FTS index
+    fts_table, shape = {'tire': ('tires_fts', TIRE_CURSOR_SHAPE), 'wheel': ('wheels_fts', WHEEL_CURSOR_SHAPE)}[kind]
+    return RANKED_CURSOR_SHAPE if query and fts_match_expression(conn, fts_table, query) else shape
+
+def fts_match_expression(conn, fts_table, query):
+    # Trigram tokens need at least 3 characters; shorter terms (and builds without FTS5) fall back to LIKE
+    query = (query or '').strip()
+    if len(query) < 3:
+        return None
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)).fetchone()
+    if not exists:
+        return None
+    return '"' + query.replace('"', '""') + '"'
+
+def migrate_db(conn):
+    # BEGIN IMMEDIATE + re-reading user_version keeps concurrently starting workers from applying a migration twice
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < number:
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
 # --- Promotion Functions ---
+def promotion_description(promo_type, value1, value2):
+    # Same text calculate_tire_promo_prices() produces; it doesn't depend on the tire price.
+    # Values are read back from REAL columns, so format them as floats here too.
+    value1 = float(value1) if value1 is not None else None
+    value2 = float(value2) if value2 is not None else None
+    return calculate_tire_promo_prices(1.0, promo_type, value1, value2)['promo_description_text']
+
 def add_promotion(conn, name, promo_type, value1, value2, is_active):
     created_at = get_bkk_time().isoformat()
     cursor = conn.cursor()
@@ -151,15 +1097,50 @@ def delete_promotion(conn, promo_id):
     conn.execute("DELETE FROM promotions WHERE id = ?", (promo_id,))
     conn.commit()
 
+# --- Tire Size Parsing ---
+# "265/65R17", "LT265/75R16 112/109Q", "225/45ZR18 95W", "195R14", "205/55-16"
+METRIC_TIRE_SIZE_RE = re.compile(
+    r'^\s*(?:P|LT|ST)?\s*(?P<width>\d{3})\s*(?:/\s*(?P<aspect>\d{2,3}))?\s*'
+    r'(?P<construction>ZR|R|D|B|-)\s*(?P<rim>\d{2}(?:\.\d)?)'
+    r'(?:\s*(?P<load>\d{2,3})(?:/\d{2,3})?\s*\(?(?P<speed>[A-Z])\)?(?![A-Z]))?',
+    re.IGNORECASE
+)
+# Flotation sizes such as "31*10.5R15" or "30x9.5R15": only the rim is comparable with metric sizes
+FLOTATION_TIRE_SIZE_RE = re.compile(
+    r'^\s*\d{2}(?:\.\d+)?\s*[xX*]\s*\d{1,2}(?:\.\d+)?\s*(?P<construction>R|-)?\s*(?P<rim>\d{2}(?:\.\d)?)'
+)
+TIRE_SIZE_COLUMNS = ('size_width', 'size_aspect', 'size_construction', 'size_rim', 'size_load_index', 'size_speed_rating')
+
+def parse_tire_size(size):
+    # Returns values in TIRE_SIZE_COLUMNS order; all None when the text is not a recognisable size
+    size = (size or '').strip()
+    match = METRIC_TIRE_SIZE_RE.match(size)
+    if match:
+        construction = match.group('construction').upper()
+        return (
+            int(match.group('width')),
+            int(match.group('aspect')) if match.group('aspect') else None,
+            'D' if construction == '-' else construction,
+            float(match.group('rim')),
+            int(match.group('load')) if match.group('load') else None,
+            match.group('speed').upper() if match.group('speed') else None,
+        )
+    match = FLOTATION_TIRE_SIZE_RE.match(size)
+    if match:
+        construction = (match.group('construction') or 'R').upper()
+        return (None, None, 'D' if construction == '-' else construction, float(match.group('rim')), None, None)
+    return (None,) * len(TIRE_SIZE_COLUMNS)
+
 # --- Tire Functions (Modified) ---
 def add_tire(conn, brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture):
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO tires (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture))
+    values = dict(zip(('brand', 'model', 'size', 'quantity', 'cost_sc', 'cost_dunlop', 'cost_online', 'wholesale_price1', 'wholesale_price2',
+                       'price_per_item', 'promotion_id', 'year_of_manufacture') + TIRE_SIZE_COLUMNS,
+                      (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2,
+                       price_per_item, promotion_id, year_of_manufacture) + parse_tire_size(size)))
+    tire_id = _insert_or_restore_item(conn, 'tire', values)
+    _record_initial_stock(conn, 'tire', tire_id, quantity)
     conn.commit()
-    return cursor.lastrowid
+    return tire_id
 
 def get_tire(conn, tire_id):
     cursor = conn.execute("""
@@ -168,30 +1149,20 @@ def get_tire(conn, tire_id):
                p.type AS promo_type, 
                p.value1 AS promo_value1, 
                p.value2 AS promo_value2,
-               p.is_active AS promo_is_active
+               p.is_active AS promo_is_active,
+               e.promo_price_per_item AS display_promo_price_per_item,
+               e.price_for_4 AS display_price_for_4,
+               e.promo_description_text AS display_promo_description_text
         FROM tires t
         LEFT JOIN promotions p ON t.promotion_id = p.id
+        LEFT JOIN effective_tire_prices e ON e.tire_id = t.id
         WHERE t.id = ?
     """, (tire_id,))
     tire = cursor.fetchone()
     
     if tire:
-        tire_dict = dict(tire) 
-        tire_dict['display_promo_price_per_item'] = None # Default to None
-        tire_dict['display_price_for_4'] = tire_dict['price_per_item'] * 4 # Default for 4 items
-        tire_dict['display_promo_description'] = None # Default description
-
-        if tire_dict['promotion_id'] is not None and tire_dict['promo_is_active'] == 1:
-            promo_calc_result = calculate_tire_promo_prices(
-                tire_dict['price_per_item'],
-                tire_dict['promo_type'],
-                tire_dict['promo_value1'],
-                tire_dict['promo_value2']
-            )
-            tire_dict['display_promo_price_per_item'] = promo_calc_result['price_per_item_promo']
-            tire_dict['display_price_for_4'] = promo_calc_result['price_for_4_promo']
-            tire_dict['display_promo_description'] = promo_calc_result['promo_description_text']
-        
+        tire_dict = dict(tire) # display_* prices come from effective_tire_prices
+        tire_dict['display_promo_description'] = tire_dict.pop('display_promo_description_text')
         return tire_dict 
     return tire
 
@@ -209,18 +1180,25 @@ def update_tire(conn, tire_id, brand, model, size, cost_sc, cost_dunlop, cost_on
             wholesale_price2 = ?,
             price_per_item = ?,
             promotion_id = ?,
-            year_of_manufacture = ?
+            year_of_manufacture = ?,
+            size_width = ?,
+            size_aspect = ?,
+            size_construction = ?,
+            size_rim = ?,
+            size_load_index = ?,
+            size_speed_rating = ?
         WHERE id = ?
-    """, (brand, model, size, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture, tire_id))
+    """, (brand, model, size, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture) + parse_tire_size(size) + (tire_id,))
     conn.commit()
 
 # Function for Import from Excel (updated for promotion_id and price_per_item)
 def add_tire_import(conn, brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture): 
     cursor = conn.cursor()
     cursor.execute("""
-        INSERT INTO tires (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture))
+        INSERT INTO tires (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture,
+                           size_width, size_aspect, size_construction, size_rim, size_load_index, size_speed_rating)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture) + parse_tire_size(size))
     conn.commit()
     return cursor.lastrowid
 
@@ -239,9 +1217,15 @@ def update_tire_import(conn, tire_id, brand, model, size, quantity, cost_sc, cos
             wholesale_price2 = ?,
             price_per_item = ?,
             promotion_id = ?,
-            year_of_manufacture = ?
+            year_of_manufacture = ?,
+            size_width = ?,
+            size_aspect = ?,
+            size_construction = ?,
+            size_rim = ?,
+            size_load_index = ?,
+            size_speed_rating = ?
         WHERE id = ?
-    """, (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture, tire_id))
+    """, (brand, model, size, quantity, cost_sc, cost_dunlop, cost_online, wholesale_price1, wholesale_price2, price_per_item, promotion_id, year_of_manufacture) + parse_tire_size(size) + (tire_id,))
     conn.commit()
 
 # NEW: Unified function to calculate prices for display based on promo type
@@ -310,21 +1294,65 @@ def calculate_tire_promo_prices(price_per_item, promo_type, promo_value1, promo_
     }
 
 
-def get_all_tires(conn, query=None, brand_filter='all'):
-    sql_query = """
-        SELECT t.*, 
-               p.name AS promo_name, 
-               p.type AS promo_type, 
-               p.value1 AS promo_value1, 
-               p.value2 AS promo_value2,
-               p.is_active AS promo_is_active
-        FROM tires t
-        LEFT JOIN promotions p ON t.promotion_id = p.id
+# Set-based equivalent of calculate_tire_promo_prices() for tires joined as `t` with promotions as `p`,
+# used to maintain effective_tire_prices. Same arithmetic in the same order (IEEE doubles), so the results
+# match the Python function exactly: no active promotion -> promo price NULL; invalid values / unknown
+# type -> fall back to price_per_item.
+TIRE_PROMO_PRICE_SQL = """
+    CASE
+        WHEN t.promotion_id IS NULL OR p.is_active IS NOT 1 THEN NULL
+        WHEN t.price_per_item IS NULL OR p.type IS NULL THEN NULL
+        WHEN p.type = 'buy_x_get_y' AND p.value1 > 0 AND p.value2 >= 0 AND (p.value1 + p.value2) > 0
+            THEN (t.price_per_item * p.value1) / (p.value1 + p.value2)
+        WHEN p.type = 'percentage_discount' AND p.value1 >= 0 AND p.value1 <= 100
+            THEN t.price_per_item * (1 - (p.value1 / 100))
+        WHEN p.type = 'fixed_price_per_n' AND p.value1 IS NOT NULL AND p.value2 > 0
+            THEN p.value1 / p.value2
+        ELSE t.price_per_item
+    END
+"""
+
+def promotion_description_sql(ref):
+    # SQL twin of promotion_description() over a promotions row (alias, or new/old in a trigger). printf's %d
+    # truncates like int(), and a REAL renders as '10.0' / '12.5' the way an f-string renders a float.
+    return f"""
+        CASE
+            WHEN {ref}.type = 'buy_x_get_y' AND {ref}.value1 > 0 AND {ref}.value2 >= 0
+                THEN printf('ซื้อ %d แถม %d ฟรี', {ref}.value1, {ref}.value2)
+            WHEN {ref}.type = 'percentage_discount' AND {ref}.value1 >= 0 AND {ref}.value1 <= 100
+                THEN 'ลด ' || CAST({ref}.value1 AS REAL) || '%'
+            WHEN {ref}.type = 'fixed_price_per_n' AND {ref}.value1 IS NOT NULL AND {ref}.value2 > 0
+                THEN printf('ราคา %.2f บาท สำหรับ %d เส้น', {ref}.value1, {ref}.value2)
+        END
     """
-    params = []
-    conditions = []
 
-    if query:
+TIRE_SIZE_FILTER_COLUMNS = {'width': 'size_width', 'aspect': 'size_aspect', 'rim': 'size_rim'}
+
+TIRE_SELECT_COLUMNS = """
+    t.*, 
+           p.name AS promo_name, 
+           p.type AS promo_type, 
+           p.value1 AS promo_value1, 
+           p.value2 AS promo_value2,
+           p.is_active AS promo_is_active,
+           e.promo_price_per_item AS display_promo_price_per_item,
+           e.price_for_4 AS display_price_for_4,
+           e.promo_description_text AS display_promo_description_text
+"""
+TIRE_FROM_SQL = """
+    FROM tires t
+    LEFT JOIN promotions p ON t.promotion_id = p.id
+    LEFT JOIN effective_tire_prices e ON e.tire_id = t.id
+"""
+TIRE_SELECT_SQL = f"SELECT {TIRE_SELECT_COLUMNS}{TIRE_FROM_SQL}"
+
+def _tire_filter_conditions(query, brand_filter, size_filters, fts_query):
+    conditions = []
+    params = []
+    if fts_query:
+        conditions.append("t.id IN (SELECT rowid FROM tires_fts WHERE tires_fts MATCH ?)")
+        params.append(fts_query)
+    elif query:
         search_term = f"%{query}%"
         conditions.append("(t.brand LIKE ? OR t.model LIKE ? OR t.size LIKE ?)")
         params.extend([search_term, search_term, search_term])
@@ -332,97 +1360,215 @@ def get_all_tires(conn, query=None, brand_filter='all'):
     if brand_filter != 'all':
         conditions.append("t.brand = ?")
         params.append(brand_filter)
+    conditions.append("t.deleted_at IS NULL")
+
+    # size_filters: {'rim': 17, 'aspect': (60, 65)} -> exact value or inclusive (min, max) range
+    for key, value in (size_filters or {}).items():
+        column = TIRE_SIZE_FILTER_COLUMNS[key]
+        if isinstance(value, (tuple, list)):
+            low, high = value
+            if low is not None:
+                conditions.append(f"t.{column} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"t.{column} <= ?")
+                params.append(high)
+        elif value is not None:
+            conditions.append(f"t.{column} = ?")
+            params.append(value)
+    return conditions, params
+
+@cached_catalog_read('tires', 'promotions')
+def get_all_tires(conn, query=None, brand_filter='all', size_filters=None):
+    sql_query = TIRE_SELECT_SQL
+    order_by = " ORDER BY t.brand, t.model, t.size"
+
+    fts_query = fts_match_expression(conn, 'tires_fts', query) if query else None
+    conditions, params = _tire_filter_conditions(query, brand_filter, size_filters, fts_query)
+    if fts_query:
+        # Trigram index answers substring search; best matches first
+        sql_query += " JOIN tires_fts ON tires_fts.rowid = t.id"
+        conditions[0] = "tires_fts MATCH ?"
+        order_by = " ORDER BY tires_fts.rank, t.brand, t.model, t.size"
     
     if conditions:
         sql_query += " WHERE " + " AND ".join(conditions)
     
-    sql_query += " ORDER BY t.brand, t.model, t.size"
+    sql_query += order_by
     
-    cursor = conn.execute(sql_query, params)
-    tires = cursor.fetchall()
-
-    processed_tires = []
-    for tire in tires:
-        tire_dict = dict(tire) 
-        
-        # Calculate display prices for each tire
-        promo_calc_result = {
-            'price_per_item_promo': None, 
-            'price_for_4_promo': tire_dict['price_per_item'] * 4 if tire_dict['price_per_item'] is not None else None,
-            'promo_description_text': None
-        }
+    # Display prices and promo text are read from effective_tire_prices; no per-row pricing work here
+    return fetch_dicts(conn, sql_query, params)
 
-        if tire_dict['promotion_id'] is not None and tire_dict['promo_is_active'] == 1:
-            promo_calc_result = calculate_tire_promo_prices(
-                tire_dict['price_per_item'], 
-                tire_dict['promo_type'], 
-                tire_dict['promo_value1'], 
-                tire_dict['promo_value2']
-            )
-        
-        tire_dict['display_promo_price_per_item'] = promo_calc_result['price_per_item_promo']
-        tire_dict['display_price_for_4'] = promo_calc_result['price_for_4_promo']
-        tire_dict['display_promo_description_text'] = promo_calc_result['promo_description_text']
-        
-        processed_tires.append(tire_dict)
-    
-    return processed_tires
+def get_tire_brand_counts(conn, query=None, brand_filter='all', size_filters=None):
+    fts_query = fts_match_expression(conn, 'tires_fts', query) if query else None
+    conditions, params = _tire_filter_conditions(query, brand_filter, size_filters, fts_query)
+    sql_query = "SELECT t.brand, COUNT(*) AS item_count FROM tires t"
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " GROUP BY t.brand ORDER BY t.brand"
+    return conn.execute(sql_query, params).fetchall()
 
-def update_tire_quantity(conn, tire_id, new_quantity):
-    conn.execute("UPDATE tires SET quantity = ? WHERE id = ?", (new_quantity, tire_id))
-    conn.commit()
+def iter_tires(conn, query=None, brand_filter='all', size_filters=None, after=None, limit=None):
+    # Streams tires in keyset order (brand, model, size, id); limit=None reads to the end
+    fts_query = fts_match_expression(conn, 'tires_fts', query) if query else None
+    conditions, params = _tire_filter_conditions(query, brand_filter, size_filters, fts_query)
+    if after:
+        conditions.append("(t.brand, t.model, t.size, t.id) > (?, ?, ?, ?)")
+        params.extend(after)
+    sql_query = TIRE_SELECT_SQL
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " ORDER BY t.brand, t.model, t.size, t.id LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    return iter_dicts(conn, sql_query, params)
 
-def add_tire_movement(conn, tire_id, move_type, quantity_change, remaining_quantity, notes):
-    timestamp = get_bkk_time().isoformat()
-    conn.execute("""
-        INSERT INTO tire_movements (tire_id, timestamp, type, quantity_change, remaining_quantity, notes)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (tire_id, timestamp, move_type, quantity_change, remaining_quantity, notes))
-    conn.commit()
+def tire_cursor_values(tire):
+    return [tire['brand'], tire['model'], tire['size'], tire['id']]
+
+def get_tires_page(conn, query=None, brand_filter='all', size_filters=None, after=None, limit=50):
+    # Keyset pagination on (brand, model, size, id): every page is an index seek, however deep.
+    # A search through the FTS index pages best matches first instead, on (rank, id): see page_cursor_shape
+    fts_query = fts_match_expression(conn, 'tires_fts', query) if query else None
+    if fts_query:
+        conditions, params = _tire_filter_conditions(query, brand_filter, size_filters, fts_query)
+        rows = list(iter_ranked_search(conn, TIRE_SELECT_COLUMNS, TIRE_FROM_SQL, 'tires_fts', 't', conditions, params,
+                                       after=after, limit=limit + 1))
+        cursor_values = ranked_cursor_values
+    else:
+        rows = list(iter_tires(conn, query, brand_filter, size_filters, after=after, limit=limit + 1))
+        cursor_values = tire_cursor_values
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = cursor_values(rows[-1])
+    return rows, next_after
+
+GET_RECENT_TIRE_MOVEMENTS_SQL = """
+    SELECT tm.*, t.brand, t.model, t.size
+    FROM tire_movements tm
+    JOIN tires t ON tm.tire_id = t.id
+    ORDER BY tm.timestamp DESC
+    LIMIT ?
+"""
+
+def get_recent_tire_movements(conn, limit=50):
+    cursor = conn.execute(GET_RECENT_TIRE_MOVEMENTS_SQL, (limit,))
+    return cursor.fetchall()
 
 def delete_tire(conn, tire_id):
-    conn.execute("DELETE FROM tires WHERE id = ?", (tire_id,))
-    conn.commit()
+    return delete_item(conn, 'tire', tire_id)
 
+@cached_catalog_read('tires')
 def get_all_tire_brands(conn):
-    cursor = conn.execute("SELECT DISTINCT brand FROM tires ORDER BY brand")
+    cursor = conn.execute("SELECT DISTINCT brand FROM tires WHERE deleted_at IS NULL ORDER BY brand")
     return [row['brand'] for row in cursor.fetchall()]
 
 # --- Wheel Functions ---
-def get_all_wheels(conn, query=None, brand_filter='all'):
-    sql_query = "SELECT * FROM wheels"
-    params = []
-    conditions = []
+GET_RECENT_WHEEL_MOVEMENTS_SQL = """
+    SELECT wm.*, w.brand, w.model, w.diameter
+    FROM wheel_movements wm
+    JOIN wheels w ON wm.wheel_id = w.id
+    ORDER BY wm.timestamp DESC
+    LIMIT ?
+"""
 
-    if query:
+def get_recent_wheel_movements(conn, limit=50):
+    cursor = conn.execute(GET_RECENT_WHEEL_MOVEMENTS_SQL, (limit,))
+    return cursor.fetchall()
+
+def _wheel_filter_conditions(query, brand_filter, fts_query):
+    conditions = []
+    params = []
+    if fts_query:
+        conditions.append("w.id IN (SELECT rowid FROM wheels_fts WHERE wheels_fts MATCH ?)")
+        params.append(fts_query)
+    elif query:
         search_term = f"%{query}%"
-        conditions.append("(brand LIKE ? OR model LIKE ? OR pcd LIKE ? OR color LIKE ?)")
+        conditions.append("(w.brand LIKE ? OR w.model LIKE ? OR w.pcd LIKE ? OR w.color LIKE ?)")
         params.extend([search_term, search_term, search_term, search_term])
     
     if brand_filter != 'all':
-        conditions.append("brand = ?")
+        conditions.append("w.brand = ?")
         params.append(brand_filter)
+    conditions.append("w.deleted_at IS NULL")
+    return conditions, params
+
+@cached_catalog_read('wheels')
+def get_all_wheels(conn, query=None, brand_filter='all'):
+    sql_query = "SELECT w.* FROM wheels w"
+    order_by = " ORDER BY w.brand, w.model, w.diameter"
+
+    fts_query = fts_match_expression(conn, 'wheels_fts', query) if query else None
+    conditions, params = _wheel_filter_conditions(query, brand_filter, fts_query)
+    if fts_query:
+        sql_query += " JOIN wheels_fts ON wheels_fts.rowid = w.id"
+        conditions[0] = "wheels_fts MATCH ?"
+        order_by = " ORDER BY wheels_fts.rank, w.brand, w.model, w.diameter"
     
     if conditions:
         sql_query += " WHERE " + " AND ".join(conditions)
     
-    sql_query += " ORDER BY brand, model, diameter"
+    sql_query += order_by
     
     cursor = conn.execute(sql_query, params)
     return cursor.fetchall()
 
+def get_wheel_brand_counts(conn, query=None, brand_filter='all'):
+    fts_query = fts_match_expression(conn, 'wheels_fts', query) if query else None
+    conditions, params = _wheel_filter_conditions(query, brand_filter, fts_query)
+    sql_query = "SELECT w.brand, COUNT(*) AS item_count FROM wheels w"
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " GROUP BY w.brand ORDER BY w.brand"
+    return conn.execute(sql_query, params).fetchall()
+
+def iter_wheels(conn, query=None, brand_filter='all', after=None, limit=None):
+    # Streams wheels in keyset order (brand, model, diameter, id), served by idx_wheels_listing
+    fts_query = fts_match_expression(conn, 'wheels_fts', query) if query else None
+    conditions, params = _wheel_filter_conditions(query, brand_filter, fts_query)
+    if after:
+        conditions.append("(w.brand, w.model, w.diameter, w.id) > (?, ?, ?, ?)")
+        params.extend(after)
+    sql_query = "SELECT w.* FROM wheels w"
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " ORDER BY w.brand, w.model, w.diameter, w.id LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    return iter_dicts(conn, sql_query, params)
+
+def wheel_cursor_values(wheel):
+    return [wheel['brand'], wheel['model'], wheel['diameter'], wheel['id']]
+
+def get_wheels_page(conn, query=None, brand_filter='all', after=None, limit=50):
+    # Keyset pagination on (brand, model, diameter, id), or on (rank, id) for a search through the FTS index
+    fts_query = fts_match_expression(conn, 'wheels_fts', query) if query else None
+    if fts_query:
+        conditions, params = _wheel_filter_conditions(query, brand_filter, fts_query)
+        rows = list(iter_ranked_search(conn, "w.*", "FROM wheels w", 'wheels_fts', 'w', conditions, params,
+                                       after=after, limit=limit + 1))
+        cursor_values = ranked_cursor_values
+    else:
+        rows = list(iter_wheels(conn, query, brand_filter, after=after, limit=limit + 1))
+        cursor_values = wheel_cursor_values
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = cursor_values(rows[-1])
+    return rows, next_after
+
 def get_wheel(conn, wheel_id):
     cursor = conn.execute("SELECT * FROM wheels WHERE id = ?", (wheel_id,))
     return cursor.fetchone()
 
 def add_wheel(conn, brand, model, diameter, pcd, width, et, color, quantity, cost, cost_online, wholesale_price1, wholesale_price2, retail_price, image_filename):
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO wheels (brand, model, diameter, pcd, width, et, color, quantity, cost, cost_online, wholesale_price1, wholesale_price2, retail_price, image_filename)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (brand, model, diameter, pcd, width, et, color, quantity, cost, cost_online, wholesale_price1, wholesale_price2, retail_price, image_filename))
+    values = dict(zip(('brand', 'model', 'diameter', 'pcd', 'width', 'et', 'color', 'quantity', 'cost', 'cost_online',
+                       'wholesale_price1', 'wholesale_price2', 'retail_price', 'image_filename'),
+                      (brand, model, diameter, pcd, width, et, color, quantity, cost, cost_online,
+                       wholesale_price1, wholesale_price2, retail_price, image_filename)))
+    wheel_id = _insert_or_restore_item(conn, 'wheel', values)
+    _record_initial_stock(conn, 'wheel', wheel_id, quantity)
     conn.commit()
-    return cursor.lastrowid
+    return wheel_id
 
 def update_wheel(conn, wheel_id, brand, model, diameter, pcd, width, et, color, cost, cost_online, wholesale_price1, wholesale_price2, retail_price, image_filename):
     cursor = conn.cursor()
@@ -477,11 +1623,11 @@ def update_wheel_import(conn, wheel_id, brand, model, diameter, pcd, width, et,
     conn.commit()
 
 def delete_wheel(conn, wheel_id):
-    conn.execute("DELETE FROM wheels WHERE id = ?", (wheel_id,))
-    conn.commit()
+    return delete_item(conn, 'wheel', wheel_id)
 
+@cached_catalog_read('wheels')
 def get_all_wheel_brands(conn):
-    cursor = conn.execute("SELECT DISTINCT brand FROM wheels ORDER BY brand")
+    cursor = conn.execute("SELECT DISTINCT brand FROM wheels WHERE deleted_at IS NULL ORDER BY brand")
     return [row['brand'] for row in cursor.fetchall()]
 
 def add_wheel_fitment(conn, wheel_id, brand, model, year_start, year_end):
@@ -498,4 +1644,1179 @@ def get_wheel_fitments(conn, wheel_id):
 
 def delete_wheel_fitment(conn, fitment_id):
     conn.execute("DELETE FROM wheel_fitments WHERE id = ?", (fitment_id,))
-    conn.commit()
\ No newline at end of file
+    conn.commit()
+
+# --- Stock Movements ---
+# Tires and wheels share one path: a conditional UPDATE ... RETURNING (never below zero, no read-modify-write
+# race between workers) plus the ledger row with the remaining-quantity snapshot, in a single transaction.
+STOCK_MOVEMENT_SIGNS = {'IN': 1, 'OUT': -1}
+
+STOCK_KINDS = {
+    'tire': {'table': 'tires', 'movements': 'tire_movements', 'movement_id': 'tire_id',
+             'item_columns': ('brand', 'model', 'size'),
+             'unit_cost': "COALESCE(i.cost_sc, i.cost_dunlop, i.cost_online)"},
+    'wheel': {'table': 'wheels', 'movements': 'wheel_movements', 'movement_id': 'wheel_id',
+              'item_columns': ('brand', 'model', 'diameter', 'pcd', 'width', 'color'),
+              'unit_cost': "COALESCE(i.cost, i.cost_online)"},
+}
+
+def _apply_stock_delta(conn, kind, item_id, move_type, quantity_change):
+    # Returns (remaining, None) when applied, (None, available) when stock is short, (None, None) when missing
+    table = STOCK_KINDS[kind]['table']
+    delta = STOCK_MOVEMENT_SIGNS[move_type] * quantity_change
+    row = conn.execute(f"""
+        UPDATE {table} SET quantity = quantity + ? WHERE id = ? AND quantity + ? >= 0 RETURNING quantity
+    """, (delta, item_id, delta)).fetchone()
+    if row is not None:
+        return row['quantity'], None
+    current = conn.execute(f"SELECT quantity FROM {table} WHERE id = ?", (item_id,)).fetchone()
+    return None, current['quantity'] if current else None
+
+def _insert_stock_movements(conn, kind, movements):
+    # movements: [(item_id, timestamp, move_type, quantity_change, remaining_quantity, notes), ...]
+    config = STOCK_KINDS[kind]
+    conn.executemany(f"""
+        INSERT INTO {config['movements']} ({config['movement_id']}, timestamp, type, quantity_change, remaining_quantity, notes)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, movements)
+
+def _insert_or_restore_item(conn, kind, values):
+    # A soft-deleted item still holds its key (see delete_item), so adding the same item again brings that row
+    # back with the new values and keeps its ledger; otherwise a new row is inserted. Returns the item id (caller commits).
+    table = STOCK_KINDS[kind]['table']
+    key = IMPORT_KINDS[table]['key']
+    row = conn.execute(f"""
+        UPDATE {table} SET {", ".join(f"{column} = ?" for column in values)}, deleted_at = NULL
+        WHERE {" AND ".join(f"{column} IS ?" for column in key)} AND deleted_at IS NOT NULL
+        RETURNING id
+    """, tuple(values.values()) + tuple(values[column] for column in key)).fetchone()
+    if row is not None:
+        return row['id']
+    cursor = conn.execute(f"INSERT INTO {table} ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+                          tuple(values.values()))
+    return cursor.lastrowid
+
+def _record_initial_stock(conn, kind, item_id, quantity):
+    # Like an imported item's "initial stock" row: dates the item's first stock (even 0), so stock-as-of for an
+    # earlier day replays it back to 0 instead of falling through to the current quantity (caller commits)
+    _insert_stock_movements(conn, kind, [(item_id, get_bkk_time().isoformat(), 'IN', quantity or 0, quantity or 0,
+                                          "Added manually (initial stock)")])
+
+def move_stock(conn, kind, item_id, move_type, quantity_change, notes):
+    # Returns (True, remaining) on success, (False, available) when stock is short, (False, None) when missing
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        remaining_quantity, available = _apply_stock_delta(conn, kind, item_id, move_type, quantity_change)
+        if remaining_quantity is None:
+            conn.rollback()
+            return False, available
+        _insert_stock_movements(conn, kind, [(item_id, get_bkk_time().isoformat(), move_type, quantity_change,
+                                              remaining_quantity, notes)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True, remaining_quantity
+
+def apply_stock_movements(conn, lines):
+    # lines: [(kind, item_id, move_type, quantity_change, notes), ...] -- all applied in one transaction, or none.
+    # Every line is checked (so the caller can report all problems at once); any error rolls the batch back.
+    # Returns (results, errors): results are (kind, item_id, remaining_quantity), errors are (line_index, message).
+    timestamp = get_bkk_time().isoformat()
+    results = []
+    errors = []
+    movements = {kind: [] for kind in STOCK_KINDS}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for index, (kind, item_id, move_type, quantity_change, notes) in enumerate(lines):
+            remaining_quantity, available = _apply_stock_delta(conn, kind, item_id, move_type, quantity_change)
+            if remaining_quantity is None:
+                if available is None:
+                    errors.append((index, f"{kind} {item_id} not found"))
+                else:
+                    errors.append((index, f"insufficient stock for {kind} {item_id}: {available} available"))
+                continue
+            results.append((kind, item_id, remaining_quantity))
+            movements[kind].append((item_id, timestamp, move_type, quantity_change, remaining_quantity, notes))
+        if errors:
+            conn.rollback()
+            return [], errors
+        for kind, rows in movements.items():
+            _insert_stock_movements(conn, kind, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results, errors
+
+def movement_history_sql(kind, source, conditions):
+    # One ledger table (current or an archived year) in keyset order; used by iter_movements and the plan check
+    config = STOCK_KINDS[kind]
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return f"""
+        SELECT m.*, {", ".join(f"i.{column}" for column in config['item_columns'])}
+        FROM {source} m
+        JOIN {config['table']} i ON i.id = m.{config['movement_id']}
+        {where}
+        ORDER BY m.timestamp DESC, m.id DESC LIMIT ?
+    """
+
+def movement_history_conditions(kind, item_id=None, move_type=None, since=None, until=None, after=None):
+    conditions = []
+    params = []
+    if item_id is not None:
+        conditions.append(f"m.{STOCK_KINDS[kind]['movement_id']} = ?")
+        params.append(item_id)
+    if move_type:
+        conditions.append("m.type = ?")
+        params.append(move_type)
+    if since:
+        conditions.append("m.timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("m.timestamp < ?")
+        params.append(until)
+    if after:
+        conditions.append("(m.timestamp, m.id) < (?, ?)")
+        params.extend(after)
+    return conditions, params
+
+def iter_movements(conn, kind, item_id=None, move_type=None, since=None, until=None, after=None, limit=None):
+    # Streams ledger rows newest first in keyset order (timestamp, id); since is inclusive, until exclusive.
+    # Each filter combination has an index ending in timestamp, so a page is one index seek per ledger table.
+    # The current ledger and the archived years the filters can reach are merged on (timestamp, id), so the
+    # order holds even if backdated rows sit in the current table next to an archived year.
+    if after is not None and not cursor_matches(after, MOVEMENT_CURSOR_SHAPE):
+        raise ValueError("after must be a [timestamp, id] cursor")
+    conditions, params = movement_history_conditions(kind, item_id, move_type, since, until, after)
+    params.append(-1 if limit is None else limit)
+    streams = [iter_dicts(conn, movement_history_sql(kind, source, conditions), params)
+               for source in _ledger_sources(conn, kind, since, until, after)]
+    rows = heapq.merge(*streams, key=movement_cursor_values, reverse=True) if len(streams) > 1 else streams[0]
+    yield from itertools.islice(rows, limit)
+
+def movement_cursor_values(movement):
+    return [movement['timestamp'], movement['id']]
+
+def get_movements_page(conn, kind, item_id=None, move_type=None, since=None, until=None, after=None, limit=50):
+    rows = list(iter_movements(conn, kind, item_id, move_type, since, until, after=after, limit=limit + 1))
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = movement_cursor_values(rows[-1])
+    return rows, next_after
+
+# --- Ledger Archive ---
+# Movements older than the hot window move into per-year tables (tire_movements_2024, ...) by the
+# `--archive-ledger` cron job (never from the web workers, which would race each other). Writes and the
+# operational reads (recent movements, stock changes) only ever see the current table; history pages walk the
+# partitions they need, and tire_movements_all / wheel_movements_all union everything for reporting.
+LEDGER_HOT_YEARS = int(os.environ.get('LEDGER_HOT_YEARS', 2)) # ปีปัจจุบัน + ปีก่อนหน้า อยู่ในตารางหลัก
+LEDGER_INDEXES = (('item_ts', '{movement_id}, timestamp'), ('ts', 'timestamp'), ('type_ts', 'type, timestamp'),
+                  ('item_type_ts', '{movement_id}, type, timestamp'))
+
+def _ledger_columns(kind):
+    return ('id', STOCK_KINDS[kind]['movement_id'], 'timestamp', 'type', 'quantity_change', 'remaining_quantity', 'notes')
+
+def get_ledger_partitions(conn, kind):
+    cursor = conn.execute("SELECT year, table_name, row_count FROM ledger_partitions WHERE kind = ? ORDER BY year DESC", (kind,))
+    return cursor.fetchall()
+
+def _ledger_sources(conn, kind, since=None, until=None, after=None):
+    # Current table first, then archived years (newest first) that overlap [since, until) and lie before the cursor
+    sources = [STOCK_KINDS[kind]['movements']]
+    for partition in get_ledger_partitions(conn, kind):
+        year_start, year_end = f"{partition['year']}-01-01", f"{partition['year'] + 1}-01-01"
+        if (since and since >= year_end) or (until and until <= year_start) or (after and after[0] < year_start):
+            continue
+        sources.append(partition['table_name'])
+    return sources
+
+def _create_ledger_view(conn, kind):
+    movements = STOCK_KINDS[kind]['movements']
+    columns = ", ".join(_ledger_columns(kind))
+    selects = [f"SELECT {columns} FROM {movements}"]
+    selects += [f"SELECT {columns} FROM {partition['table_name']}" for partition in get_ledger_partitions(conn, kind)]
+    conn.execute(f"DROP VIEW IF EXISTS {movements}_all")
+    conn.execute(f"CREATE VIEW {movements}_all AS {' UNION ALL '.join(selects)}")
+
+def item_has_movements(conn, kind, item_id):
+    # Any ledger row for the item, in the current table or an archived year
+    config = STOCK_KINDS[kind]
+    return any(conn.execute(f"SELECT 1 FROM {source} WHERE {config['movement_id']} = ? LIMIT 1", (item_id,)).fetchone()
+               for source in _ledger_sources(conn, kind))
+
+def delete_item(conn, kind, item_id):
+    # The movement ledger is the audit trail and is never deleted. An item without history is removed; one with
+    # history (in any year: archived tables carry no foreign key, hence the explicit check) is soft-deleted instead:
+    # remaining stock is written off with an OUT movement, and deleted_at hides it from the catalog, valuation and
+    # low-stock alerts while the ledger keeps pointing at it. Returns 'deleted', 'soft_deleted' or None when missing.
+    table = STOCK_KINDS[kind]['table']
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(f"SELECT quantity FROM {table} WHERE id = ?", (item_id,)).fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        if not item_has_movements(conn, kind, item_id):
+            conn.execute(f"DELETE FROM {table} WHERE id = ?", (item_id,))
+            result = 'deleted'
+        else:
+            now = get_bkk_time().isoformat()
+            if row['quantity'] and row['quantity'] > 0:
+                _apply_stock_delta(conn, kind, item_id, 'OUT', row['quantity'])
+                _insert_stock_movements(conn, kind, [(item_id, now, 'OUT', row['quantity'], 0, "Deleted (stock written off)")])
+            conn.execute(f"UPDATE {table} SET deleted_at = ? WHERE id = ?", (now, item_id))
+            result = 'soft_deleted'
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+def ledger_archive_boundary(hot_years=LEDGER_HOT_YEARS):
+    # Movements before this date (YYYY-01-01) belong in the archive
+    return f"{get_bkk_time().year - hot_years + 1}-01-01"
+
+def _oldest_hot_movement(conn, kind):
+    row = conn.execute(f"SELECT timestamp FROM {STOCK_KINDS[kind]['movements']} ORDER BY timestamp LIMIT 1").fetchone()
+    return row['timestamp'] if row else None
+
+def ledger_archive_due(conn, hot_years=LEDGER_HOT_YEARS):
+    boundary = ledger_archive_boundary(hot_years)
+    return any((_oldest_hot_movement(conn, kind) or boundary) < boundary for kind in STOCK_KINDS)
+
+def archive_ledger_year(conn, kind, year):
+    # Moves one year of the current ledger into its archive table in a single transaction; returns rows moved.
+    # BEGIN IMMEDIATE takes the write lock before reading, so concurrent runs serialize instead of failing with
+    # BUSY_SNAPSHOT, and a run that finds the year already moved just moves 0 rows. The per-row generation
+    # trigger is suspended inside the transaction (nobody else can see it missing) and bumped once instead.
+    config = STOCK_KINDS[kind]
+    movements = config['movements']
+    table_name = f"{movements}_{year}"
+    columns = ", ".join(_ledger_columns(kind))
+    year_range = (f"{year}-01-01", f"{year + 1}-01-01")
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                id INTEGER PRIMARY KEY,
+                {config['movement_id']} INTEGER NOT NULL,
+                timestamp TEXT NOT NULL,
+                type TEXT NOT NULL,
+                quantity_change INTEGER NOT NULL,
+                remaining_quantity INTEGER NOT NULL,
+                notes TEXT
+            )
+        """)
+        for suffix, index_columns in LEDGER_INDEXES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_{suffix} ON {table_name}"
+                         f"({index_columns.format(movement_id=config['movement_id'])})")
+        moved = conn.execute(f"""
+            INSERT INTO {table_name} ({columns})
+            SELECT {columns} FROM {movements} WHERE timestamp >= ? AND timestamp < ?
+        """, year_range).rowcount
+        if moved:
+            conn.execute(f"DROP TRIGGER {movements}_generation_delete")
+            conn.execute(f"DELETE FROM {movements} WHERE timestamp >= ? AND timestamp < ?", year_range)
+            _create_generation_trigger(conn, movements, 'DELETE')
+            bump_generation(conn, movements)
+            is_new = conn.execute("SELECT 1 FROM ledger_partitions WHERE kind = ? AND year = ?", (kind, year)).fetchone() is None
+            conn.execute("""
+                INSERT INTO ledger_partitions (kind, year, table_name, row_count, archived_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (kind, year) DO UPDATE SET row_count = row_count + excluded.row_count, archived_at = excluded.archived_at
+            """, (kind, year, table_name, moved, get_bkk_time().isoformat()))
+            if is_new:
+                _create_ledger_view(conn, kind)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+def archive_ledger(conn, hot_years=LEDGER_HOT_YEARS):
+    # Archives every year before the hot window, oldest first (cron: python database.py --archive-ledger).
+    # Returns {kind: [(year, rows moved), ...]}.
+    boundary = ledger_archive_boundary(hot_years)
+    archived = {}
+    for kind in STOCK_KINDS:
+        archived[kind] = []
+        while True:
+            oldest = _oldest_hot_movement(conn, kind)
+            if oldest is None or oldest >= boundary:
+                break
+            year = int(oldest[:4])
+            archived[kind].append((year, archive_ledger_year(conn, kind, year)))
+    return archived
+
+# --- Stock Snapshots ---
+# stock_snapshots holds every item's quantity (and unit cost) at the end of a day. A snapshot is built from the
+# previous one plus the ledger tail since then (the last remaining_quantity per item), so only the first build
+# reads the whole ledger. Point-in-time stock is the nearest snapshot on or before the date plus the same replay.
+SNAPSHOT_PERIODS = ('day', 'month')
+
+def _stock_as_of_sql(kind, next_sources):
+    # Params: base snapshot date (or None), tail start (inclusive, or None), tail end (exclusive).
+    # Items missing from the base snapshot and the tail take the quantity they had just before their next
+    # movement, or the current quantity when they have not moved since.
+    # next_sources: the ledger tables that can hold movements on/after tail end, oldest first (see
+    # _next_movement_sources). Tables cover disjoint periods, so the first one with a movement has the next one;
+    # each lookup is an index seek, where a correlated subquery on the *_all view would read the whole ledger per item.
+    config = STOCK_KINDS[kind]
+    movements = config['movements'] + '_all' # includes archived years
+    movement_id = config['movement_id']
+    next_movement = ",\n               ".join(f"""(
+                   SELECT m.remaining_quantity - CASE m.type WHEN 'IN' THEN m.quantity_change ELSE -m.quantity_change END
+                   FROM {source} m
+                   WHERE m.{movement_id} = i.id AND m.timestamp >= params.tail_end
+                   ORDER BY m.timestamp, m.id LIMIT 1
+               )""" for source in next_sources)
+    return f"""
+        WITH params AS (SELECT ? AS base_date, ? AS tail_start, ? AS tail_end),
+        tail AS (
+            SELECT item_id, remaining_quantity FROM (
+                SELECT m.{movement_id} AS item_id, m.remaining_quantity,
+                       row_number() OVER (PARTITION BY m.{movement_id} ORDER BY m.timestamp DESC, m.id DESC) AS position
+                FROM {movements} m, params
+                WHERE m.timestamp >= COALESCE(params.tail_start, '') AND m.timestamp < params.tail_end
+            ) WHERE position = 1
+        )
+        SELECT i.id AS item_id,
+               COALESCE(tail.remaining_quantity, s.quantity, {next_movement}, i.quantity, 0) AS quantity,
+               COALESCE(s.unit_cost, {config['unit_cost']}) AS unit_cost
+        FROM {config['table']} i
+        CROSS JOIN params
+        LEFT JOIN tail ON tail.item_id = i.id
+        LEFT JOIN stock_snapshots s ON s.kind = '{kind}' AND s.snapshot_date = params.base_date AND s.item_id = i.id
+    """
+
+def _next_movement_sources(conn, kind, tail_end):
+    sources = _ledger_sources(conn, kind, since=tail_end) # current table, then archived years newest first
+    return sources[:0:-1] + sources[:1]
+
+def _next_day(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+def get_latest_snapshot_date(conn, kind, on_or_before=None):
+    row = conn.execute("""
+        SELECT snapshot_date FROM stock_snapshot_runs
+        WHERE kind = ? AND snapshot_date <= ? ORDER BY snapshot_date DESC LIMIT 1
+    """, (kind, on_or_before or '9999-12-31')).fetchone()
+    return row['snapshot_date'] if row else None
+
+def build_stock_snapshot(conn, kind, snapshot_date, period='day'):
+    # Records end-of-day stock for snapshot_date (YYYY-MM-DD) from the previous snapshot + ledger tail
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        base_date = get_latest_snapshot_date(conn, kind, snapshot_date)
+        if base_date == snapshot_date:
+            conn.rollback()
+            return 0
+        tail_start = _next_day(base_date) if base_date else None
+        cursor = conn.execute(f"""
+            INSERT INTO stock_snapshots (kind, snapshot_date, item_id, quantity, unit_cost)
+            SELECT ?, ?, item_id, quantity, unit_cost
+            FROM ({_stock_as_of_sql(kind, _next_movement_sources(conn, kind, _next_day(snapshot_date)))})
+        """, (kind, snapshot_date, base_date, tail_start, _next_day(snapshot_date)))
+        item_count = cursor.rowcount
+        conn.execute("""
+            INSERT INTO stock_snapshot_runs (kind, snapshot_date, period, item_count, created_at) VALUES (?, ?, ?, ?, ?)
+        """, (kind, snapshot_date, period, item_count, get_bkk_time().isoformat()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return item_count
+
+def _is_period_end(day, period):
+    return period == 'day' or (day + timedelta(days=1)).day == 1
+
+def _due_snapshot_dates(last_date, through, period):
+    # Every day (or month end) after last_date up to through; the first run records only the latest one
+    if last_date is None:
+        if not _is_period_end(through, period):
+            through = through.replace(day=1) - timedelta(days=1)
+        return [through]
+    dates = []
+    day = date.fromisoformat(last_date) + timedelta(days=1)
+    while day <= through:
+        if _is_period_end(day, period):
+            dates.append(day)
+        day += timedelta(days=1)
+    return dates
+
+def build_stock_snapshots(conn, period='month', through=None):
+    # Catches up on every due snapshot (cron: python database.py --build-snapshots [day|month]).
+    # through defaults to yesterday: only closed days are snapshotted. Returns {kind: [snapshot dates built]}.
+    if period not in SNAPSHOT_PERIODS:
+        raise ValueError(f"period must be one of {', '.join(SNAPSHOT_PERIODS)}")
+    through = through or get_bkk_time().date() - timedelta(days=1)
+    built = {}
+    for kind in STOCK_KINDS:
+        built[kind] = []
+        for snapshot_date in _due_snapshot_dates(get_latest_snapshot_date(conn, kind), through, period):
+            build_stock_snapshot(conn, kind, snapshot_date.isoformat(), period)
+            built[kind].append(snapshot_date.isoformat())
+    return built
+
+def get_stock_as_of(conn, kind, as_of_date):
+    # Stock on hand at the end of as_of_date (YYYY-MM-DD): nearest snapshot + short replay of the ledger tail.
+    # Returns (rows, base_snapshot_date); rows are dicts of item_id, quantity, unit_cost.
+    base_date = get_latest_snapshot_date(conn, kind, as_of_date)
+    tail_start = _next_day(base_date) if base_date else None
+    tail_end = _next_day(as_of_date)
+    rows = fetch_dicts(conn, _stock_as_of_sql(kind, _next_movement_sources(conn, kind, tail_end)) + " ORDER BY i.id",
+                       (base_date, tail_start, tail_end))
+    return rows, base_date
+
+# --- Low Stock ---
+# low_stock_alerts is maintained by triggers (see _migration_low_stock_alerts); these only read it or change thresholds
+def get_low_stock_alerts(conn, kind, brand=None):
+    config = STOCK_KINDS[kind]
+    sql_query = f"""
+        SELECT a.item_id, a.quantity, a.reorder_point, a.since, {", ".join(f"i.{column}" for column in config['item_columns'])}
+        FROM low_stock_alerts a JOIN {config['table']} i ON i.id = a.item_id
+        WHERE a.kind = ?
+    """
+    params = [kind]
+    if brand:
+        sql_query += " AND i.brand = ?"
+        params.append(brand)
+    sql_query += " ORDER BY a.quantity, a.item_id"
+    return fetch_dicts(conn, sql_query, params)
+
+def get_low_stock_counts(conn):
+    counts = {kind: 0 for kind in STOCK_KINDS}
+    for row in conn.execute("SELECT kind, COUNT(*) AS alerts FROM low_stock_alerts GROUP BY kind"):
+        counts[row['kind']] = row['alerts']
+    return counts
+
+def get_reorder_thresholds(conn, kind):
+    cursor = conn.execute("SELECT brand, reorder_point FROM reorder_thresholds WHERE kind = ? ORDER BY brand", (kind,))
+    return cursor.fetchall()
+
+def set_brand_reorder_point(conn, kind, brand, reorder_point):
+    # brand '*' is the default for the kind; reorder_point None removes the brand's own threshold
+    if reorder_point is None:
+        conn.execute("DELETE FROM reorder_thresholds WHERE kind = ? AND brand = ?", (kind, brand))
+    else:
+        conn.execute("""
+            INSERT INTO reorder_thresholds (kind, brand, reorder_point) VALUES (?, ?, ?)
+            ON CONFLICT (kind, brand) DO UPDATE SET reorder_point = excluded.reorder_point
+        """, (kind, brand, reorder_point))
+    conn.commit()
+
+def set_item_reorder_point(conn, kind, item_id, reorder_point):
+    # reorder_point None falls back to the brand/default threshold; returns False when the item does not exist
+    cursor = conn.execute(f"UPDATE {STOCK_KINDS[kind]['table']} SET reorder_point = ? WHERE id = ?", (reorder_point, item_id))
+    conn.commit()
+    return cursor.rowcount == 1
+
+# --- Valuation Report ---
+VALUATION_GROUPS = ('brand', 'size', 'brand_size')
+
+def valuation_group_columns(kind, group_by):
+    # group_by: 'brand', 'size' (size = diameter for wheels) or 'brand_size'
+    brand_column, size_column = VALUATION_KINDS[kind]['group_columns']
+    return {'brand': (brand_column,), 'size': (size_column,), 'brand_size': (brand_column, size_column)}[group_by]
+
+def get_valuation_report(conn, kind, group_by='brand'):
+    # Reads only the summary table (one row per brand/size), so the cost does not grow with the catalog.
+    # Returns (rows, totals); margins and margin_pct_* cover only stock that has both the price and the cost.
+    config = VALUATION_KINDS[kind]
+    group_columns = valuation_group_columns(kind, group_by)
+    measures = [name for name, _ in _valuation_measures(kind, '')]
+    sums = ", ".join(f"COALESCE(SUM({name}), 0) AS {name}" for name in measures)
+    rows = fetch_dicts(conn, f"""
+        SELECT {", ".join(group_columns)}, {sums} FROM {config['summary']}
+        GROUP BY {", ".join(group_columns)} ORDER BY {", ".join(group_columns)}
+    """)
+    totals = fetch_dicts(conn, f"SELECT {sums} FROM {config['summary']}")[0]
+    for row in rows + [totals]:
+        for name in measures:
+            if isinstance(row[name], float):
+                row[name] = round(row[name], 2)
+        for price in config['prices']:
+            for cost in config['costs']:
+                base = row.pop(f"margin_base_{price}_{cost}")
+                row[f"margin_pct_{price}_{cost}"] = round(row[f"margin_{price}_{cost}"] * 100 / base, 2) if base else None
+    return rows, totals
+
+# --- Bulk Import ---
+# Set-based import: sheet rows are staged per job in tire_import_rows/wheel_import_rows with executemany,
+# compared with current stock in one pass (classify_import_rows), then applied with a handful of
+# UPDATE ... FROM / INSERT ... SELECT statements inside one transaction. Unchanged rows are never written.
+TIRE_IMPORT_FIELDS = ('brand', 'model', 'size', 'quantity', 'cost_sc', 'cost_dunlop', 'cost_online',
+                      'wholesale_price1', 'wholesale_price2', 'price_per_item', 'promotion_id', 'year_of_manufacture')
+WHEEL_IMPORT_FIELDS = ('brand', 'model', 'diameter', 'pcd', 'width', 'et', 'color', 'quantity',
+                       'cost', 'cost_online', 'wholesale_price1', 'wholesale_price2', 'retail_price', 'image_filename')
+TIRE_IMPORT_KEY = ('brand', 'model', 'size')
+WHEEL_IMPORT_KEY = ('brand', 'model', 'diameter', 'pcd', 'width', 'et', 'color')
+
+IMPORT_KINDS = {
+    'tires': {'table': 'tires', 'rows_table': 'tire_import_rows', 'movements': 'tire_movements', 'movement_id': 'tire_id',
+              'fields': TIRE_IMPORT_FIELDS, 'key': TIRE_IMPORT_KEY, 'price': 'price_per_item'},
+    'wheels': {'table': 'wheels', 'rows_table': 'wheel_import_rows', 'movements': 'wheel_movements', 'movement_id': 'wheel_id',
+               'fields': WHEEL_IMPORT_FIELDS, 'key': WHEEL_IMPORT_KEY, 'price': 'retail_price'},
+}
+
+def _import_columns(kind):
+    # Tire sizes are parsed while staging, so the size columns are written along with the sheet fields
+    fields = IMPORT_KINDS[kind]['fields']
+    return fields + TIRE_SIZE_COLUMNS if kind == 'tires' else fields
+
+def stage_import_rows(conn, kind, job_id, rows):
+    # rows: iterable of (row_number, *fields) with typed values. Returns [(row_number, message)] for rejected rows.
+    config = IMPORT_KINDS[kind]
+    columns = _import_columns(kind)
+    if kind == 'tires':
+        rows = (tuple(row) + parse_tire_size(row[3]) for row in rows)
+    conn.executemany(f"""
+        INSERT OR REPLACE INTO {config['rows_table']} (job_id, row_number, {", ".join(columns)})
+        VALUES ({", ".join("?" * (len(columns) + 2))})
+    """, ((job_id,) + tuple(row) for row in rows))
+    errors = _reject_unknown_promotions(conn, kind, job_id)
+    conn.commit()
+    return errors
+
+def _reject_unknown_promotions(conn, kind, job_id):
+    # promotion_id has a foreign key: report unknown ids per row instead of failing the whole import
+    if kind != 'tires':
+        return []
+    rejected = conn.execute("""
+        SELECT row_number, promotion_id FROM tire_import_rows r
+        WHERE job_id = ? AND promotion_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM promotions p WHERE p.id = r.promotion_id)
+    """, (job_id,)).fetchall()
+    conn.executemany("DELETE FROM tire_import_rows WHERE job_id = ? AND row_number = ?",
+                     [(job_id, row['row_number']) for row in rejected])
+    return [(row['row_number'], f"ไม่พบโปรโมชัน ID {row['promotion_id']}") for row in rejected]
+
+def classify_import_rows(conn, kind, job_id):
+    # One pass over the staged rows: 'insert', 'update' or 'unchanged' against current stock.
+    # When a key appears more than once, the last sheet row wins (as the old row-by-row loop ended up doing).
+    config = IMPORT_KINDS[kind]
+    rows_table = config['rows_table']
+    key_match = " AND ".join(f"i.{column} IS r.{column}" for column in config['key'])
+    unchanged = " AND ".join(f"r.{field} IS i.{field}" for field in config['fields'])
+    conn.execute(f"""
+        DELETE FROM {rows_table} WHERE job_id = ? AND row_number NOT IN (
+            SELECT MAX(row_number) FROM {rows_table} WHERE job_id = ? GROUP BY {", ".join(config['key'])}
+        )
+    """, (job_id, job_id))
+    conn.execute(f"""
+        UPDATE {rows_table} SET action = 'insert', item_id = NULL, old_quantity = NULL, old_price = NULL
+        WHERE job_id = ?
+    """, (job_id,))
+    conn.execute(f"""
+        UPDATE {rows_table} AS r
+        SET item_id = i.id, old_quantity = i.quantity, old_price = i.{config['price']},
+            action = CASE WHEN {unchanged} AND i.deleted_at IS NULL THEN 'unchanged' ELSE 'update' END
+        FROM {config['table']} AS i
+        WHERE r.job_id = ? AND {key_match}
+    """, (job_id,))
+
+def get_import_diff_summary(conn, kind, job_id):
+    config = IMPORT_KINDS[kind]
+    row = conn.execute(f"""
+        SELECT COALESCE(SUM(action = 'insert'), 0) AS inserted,
+               COALESCE(SUM(action = 'update'), 0) AS updated,
+               COALESCE(SUM(action = 'unchanged'), 0) AS unchanged,
+               COALESCE(SUM(action = 'update' AND quantity IS NOT old_quantity), 0) AS quantity_changed,
+               COALESCE(SUM(CASE WHEN action = 'insert' THEN quantity
+                                 WHEN action = 'update' THEN quantity - old_quantity ELSE 0 END), 0) AS quantity_delta,
+               COALESCE(SUM(action = 'update' AND {config['price']} IS NOT old_price), 0) AS price_changed,
+               COALESCE(SUM(CASE WHEN action = 'update' THEN {config['price']} - old_price ELSE 0 END), 0) AS price_delta
+        FROM {config['rows_table']} WHERE job_id = ?
+    """, (job_id,)).fetchone()
+    return dict(row)
+
+def get_import_diff_rows(conn, kind, job_id, actions=('insert', 'update'), after=0, limit=100):
+    # Keyset pagination on row_number; key columns identify the item in the listing
+    config = IMPORT_KINDS[kind]
+    cursor = conn.execute(f"""
+        SELECT row_number, action, item_id, {", ".join(config['key'])},
+               old_quantity, quantity, old_price, {config['price']} AS price
+        FROM {config['rows_table']}
+        WHERE job_id = ? AND action IN ({", ".join("?" * len(actions))}) AND row_number > ?
+        ORDER BY row_number LIMIT ?
+    """, (job_id,) + tuple(actions) + (after, limit))
+    return cursor.fetchall()
+
+def apply_import_rows(conn, kind, job_id, source='Excel'):
+    # Applies every staged row of the job in one transaction and clears them.
+    # Rows are re-classified first, so a diff confirmed later still starts from the current stock.
+    # Returns (imported_count, updated_count, unchanged_count, errors).
+    config = IMPORT_KINDS[kind]
+    rows_table = config['rows_table']
+    table = config['table']
+    columns = _import_columns(kind)
+    key_match = " AND ".join(f"i.{column} IS r.{column}" for column in config['key'])
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        errors = _reject_unknown_promotions(conn, kind, job_id)
+        classify_import_rows(conn, kind, job_id)
+        summary = get_import_diff_summary(conn, kind, job_id)
+
+        conn.execute(f"""
+            UPDATE {table} SET {", ".join(f"{column} = r.{column}" for column in columns)}, deleted_at = NULL
+            FROM {rows_table} AS r
+            WHERE {table}.id = r.item_id AND r.job_id = ? AND r.action = 'update'
+        """, (job_id,))
+        conn.execute(f"""
+            INSERT INTO {table} ({", ".join(columns)})
+            SELECT {", ".join(columns)} FROM {rows_table}
+            WHERE job_id = ? AND action = 'insert' ORDER BY row_number
+        """, (job_id,))
+        conn.execute(f"""
+            UPDATE {rows_table} AS r SET item_id = i.id
+            FROM {table} AS i WHERE r.job_id = ? AND r.action = 'insert' AND {key_match}
+        """, (job_id,))
+
+        conn.execute(f"""
+            INSERT INTO {config['movements']} ({config['movement_id']}, timestamp, type, quantity_change, remaining_quantity, notes)
+            SELECT item_id, ?,
+                   CASE WHEN action = 'insert' OR quantity > old_quantity THEN 'IN' ELSE 'OUT' END,
+                   CASE WHEN action = 'insert' THEN quantity ELSE abs(quantity - old_quantity) END,
+                   quantity,
+                   CASE WHEN action = 'insert' THEN ? ELSE ? END
+            FROM {rows_table}
+            WHERE job_id = ? AND (action = 'insert' OR (action = 'update' AND quantity IS NOT old_quantity))
+            ORDER BY row_number
+        """, (get_bkk_time().isoformat(), f"Import from {source} (initial stock)", f"Import from {source} (Qty Update)", job_id))
+
+        conn.execute(f"DELETE FROM {rows_table} WHERE job_id = ?", (job_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return summary['inserted'], summary['updated'], summary['unchanged'], errors
+
+def discard_import_rows(conn, kind, job_id):
+    conn.execute(f"DELETE FROM {IMPORT_KINDS[kind]['rows_table']} WHERE job_id = ?", (job_id,))
+    conn.commit()
+
+# --- Import Jobs ---
+MAINTENANCE_JOB_KIND = 'maintenance'
+
+def create_import_job(conn, kind, filename, file_path, mode='apply'):
+    # mode 'preview' only stages and diffs the file; the rows are applied later by confirm_import_job()
+    cursor = conn.execute("""
+        INSERT INTO import_jobs (kind, filename, file_path, status, mode, created_at)
+        VALUES (?, ?, ?, 'queued', ?, ?)
+    """, (kind, filename, file_path, mode, get_bkk_time().isoformat()))
+    conn.commit()
+    return cursor.lastrowid
+
+def claim_import_job(conn, job_id):
+    # Only one worker may move a job from queued to running
+    cursor = conn.execute("""
+        UPDATE import_jobs SET status = 'running', started_at = ?, worker_pid = ?, worker_token = ?
+        WHERE id = ? AND status = 'queued'
+    """, (get_bkk_time().isoformat(), os.getpid(), worker_token(os.getpid()), job_id))
+    conn.commit()
+    return cursor.rowcount == 1
+
+def set_import_job_total(conn, job_id, total_rows):
+    conn.execute("UPDATE import_jobs SET total_rows = ? WHERE id = ?", (total_rows, job_id))
+    conn.commit()
+
+def record_import_job_chunk(conn, job_id, row_count, imported_count, updated_count, unchanged_count, errors):
+    # Called after every chunk; counters accumulate so progress is visible while the job runs
+    conn.executemany("INSERT OR IGNORE INTO import_job_errors (job_id, row_number, message) VALUES (?, ?, ?)",
+                     ((job_id, row_number, message) for row_number, message in errors))
+    conn.execute("""
+        UPDATE import_jobs SET processed_rows = processed_rows + ?, imported_count = imported_count + ?,
+               updated_count = updated_count + ?, unchanged_count = unchanged_count + ?, error_count = error_count + ?
+        WHERE id = ?
+    """, (row_count, imported_count, updated_count, unchanged_count, len(errors), job_id))
+    conn.commit()
+
+def finish_import_job(conn, job_id, status='done', counts=None, message=None):
+    # counts=(imported, updated, unchanged) replaces the accumulated counters (dry run / confirmed diff)
+    if counts is not None:
+        conn.execute("UPDATE import_jobs SET imported_count = ?, updated_count = ?, unchanged_count = ? WHERE id = ?",
+                     tuple(counts) + (job_id,))
+    if message is not None:
+        conn.execute("UPDATE import_jobs SET message = ? WHERE id = ?", (message, job_id))
+    conn.execute("""
+        UPDATE import_jobs SET status = ?, total_rows = processed_rows, finished_at = ? WHERE id = ?
+    """, (status, get_bkk_time().isoformat(), job_id))
+    conn.commit()
+
+def confirm_import_job(conn, job_id):
+    # A previewed job goes back to the queue; the worker then applies its staged rows
+    cursor = conn.execute("""
+        UPDATE import_jobs SET status = 'queued', mode = 'confirmed' WHERE id = ? AND status = 'previewed'
+    """, (job_id,))
+    conn.commit()
+    return cursor.rowcount == 1
+
+def discard_import_job(conn, job_id):
+    job = get_import_job(conn, job_id)
+    if job is None or job['status'] != 'previewed':
+        return False
+    conn.execute("UPDATE import_jobs SET status = 'discarded', finished_at = ? WHERE id = ?",
+                 (get_bkk_time().isoformat(), job_id))
+    discard_import_rows(conn, job['kind'], job_id)
+    return True
+
+def fail_import_job(conn, job_id, message):
+    conn.execute("UPDATE import_jobs SET status = 'failed', message = ?, finished_at = ? WHERE id = ?",
+                 (message, get_bkk_time().isoformat(), job_id))
+    conn.commit()
+
+def get_import_job(conn, job_id):
+    cursor = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,))
+    return cursor.fetchone()
+
+def get_import_jobs_by_status(conn, status):
+    cursor = conn.execute("SELECT * FROM import_jobs WHERE status = ? ORDER BY id", (status,))
+    return cursor.fetchall()
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # exists, owned by another user
+    return True
+
+def worker_token(pid):
+    # Identifies one run of a process: boot id + pid + the process start time (in clock ticks since boot), so a
+    # pid reused after a reboot or by a later process no longer matches. None where /proc is not available.
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot_id = f.read().strip()
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm (field 2) may contain spaces and parentheses; starttime is field 22, the 20th after the closing ')'
+    start_time = stat[stat.rindex(')') + 2:].split()[19]
+    return f"{boot_id}:{pid}:{start_time}"
+
+def fail_orphaned_import_job(conn, job, message):
+    # A 'running' job whose worker process is gone (restart, recycled or killed worker) will never finish.
+    # A job this process claimed cannot still be running here: the caller runs this before any job starts.
+    # The worker counts as live only if the process behind worker_pid is the one that claimed the job; jobs
+    # claimed without a token (before it was recorded, or without /proc) fall back to checking the pid.
+    # Returns False if the job is still owned by a live worker or was picked up by someone else meanwhile.
+    pid = job['worker_pid']
+    token = job['worker_token']
+    if pid is not None and pid != os.getpid():
+        alive = _process_alive(pid) if token is None else worker_token(pid) == token
+        if alive:
+            return False
+    cursor = conn.execute("""
+        UPDATE import_jobs SET status = 'failed', message = ?, finished_at = ?
+        WHERE id = ? AND status = 'running' AND worker_pid IS ? AND worker_token IS ?
+    """, (message, get_bkk_time().isoformat(), job['id'], pid, token))
+    conn.commit()
+    return cursor.rowcount == 1
+
+def create_maintenance_job(conn, steps, min_interval):
+    # Maintenance runs (backup_database & co.) share the import job table and executor. One statement checks and
+    # inserts, so across all workers at most one run is queued/running and runs start at least min_interval apart.
+    # Returns the job id, or None when refused.
+    now = get_bkk_time()
+    cursor = conn.execute("""
+        INSERT INTO import_jobs (kind, filename, file_path, status, mode, created_at)
+        SELECT ?, ?, '', 'queued', ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM import_jobs WHERE kind = ? AND (status IN ('queued', 'running') OR created_at > ?)
+        )
+    """, (MAINTENANCE_JOB_KIND, ' '.join(steps), MAINTENANCE_JOB_KIND, now.isoformat(),
+          MAINTENANCE_JOB_KIND, (now - timedelta(seconds=min_interval)).isoformat()))
+    conn.commit()
+    return cursor.lastrowid if cursor.rowcount == 1 else None
+
+def get_recent_import_jobs(conn, limit=10):
+    cursor = conn.execute("SELECT * FROM import_jobs WHERE kind != ? ORDER BY id DESC LIMIT ?", (MAINTENANCE_JOB_KIND, limit))
+    return cursor.fetchall()
+
+def get_import_job_errors(conn, job_id, after=0, limit=100):
+    # Keyset pagination on row_number
+    cursor = conn.execute("""
+        SELECT row_number, message FROM import_job_errors
+        WHERE job_id = ? AND row_number > ? ORDER BY row_number LIMIT ?
+    """, (job_id, after, limit))
+    return cursor.fetchall()
+
+# --- Query Plan Check ---
+# Hot paths that must be answered from an index. Run `python database.py --check-query-plans`.
+# Each probe calls the real function against an empty copy of the schema and every statement it executes is
+# captured (set_trace_callback) and planned, so the check can't drift from the SQL the app actually runs.
+# The second element lists plan steps a probe is allowed to take, matched on the step's leading words:
+# sorting a filtered subset, and reports that by definition visit every item or summary row.
+PLAN_CURSOR_TIME = '9999-12-31T00:00:00+07:00'
+
+SORTED_SUBSET = ('USE TEMP B-TREE FOR ORDER BY',)
+STAGED_DEDUPE = ('USE TEMP B-TREE FOR GROUP BY',) # one job's staged rows
+
+def _uncached(func):
+    return getattr(func, '__wrapped__', func) # bypass cached_catalog_read so the SQL really runs
+
+HOT_QUERIES = {
+    'get_tire': (lambda conn: get_tire(conn, 1), ()),
+    'get_all_tires': (lambda conn: _uncached(get_all_tires)(conn), ()),
+    'get_all_tires_by_brand': (lambda conn: _uncached(get_all_tires)(conn, brand_filter='x'), ()),
+    'search_tires': (lambda conn: _uncached(get_all_tires)(conn, query='265/65'),
+                     ('SCAN sqlite_master', 'USE TEMP B-TREE FOR ORDER BY')), # FTS table probe, rank order
+    'tires_by_rim_aspect': (lambda conn: _uncached(get_all_tires)(conn, size_filters={'rim': 17.0, 'aspect': 65.0}), SORTED_SUBSET),
+    'tires_by_rim_range': (lambda conn: _uncached(get_all_tires)(conn, size_filters={'rim': (16.0, 18.0)}), SORTED_SUBSET),
+    'tires_by_width': (lambda conn: _uncached(get_all_tires)(conn, size_filters={'width': 265.0, 'aspect': (60.0, 70.0)}), SORTED_SUBSET),
+    'get_tire_brand_counts': (lambda conn: get_tire_brand_counts(conn), ()),
+    'get_tires_page': (lambda conn: get_tires_page(conn, brand_filter='x', after=['x', 'x', 'x', 1]), ()),
+    'search_tires_page': (lambda conn: get_tires_page(conn, query='265/65', brand_filter='x', after=[-1.0, 1]),
+                          ('SCAN sqlite_master', 'USE TEMP B-TREE FOR ORDER BY')), # as search_tires
+    'get_all_tire_brands': (lambda conn: _uncached(get_all_tire_brands)(conn), ()),
+    'get_all_promotions': (lambda conn: get_all_promotions(conn), ()),
+    'delete_promotion': (lambda conn: delete_promotion(conn, 1), ()),
+    'get_all_wheels': (lambda conn: _uncached(get_all_wheels)(conn), ()),
+    'get_all_wheels_by_brand': (lambda conn: _uncached(get_all_wheels)(conn, brand_filter='x'), ()),
+    'get_wheel_brand_counts': (lambda conn: get_wheel_brand_counts(conn), ()),
+    'get_wheels_page': (lambda conn: get_wheels_page(conn, brand_filter='x', after=['x', 'x', 17.0, 1]), ()),
+    'search_wheels_page': (lambda conn: get_wheels_page(conn, query='4x100', brand_filter='x', after=[-1.0, 1]),
+                           ('SCAN sqlite_master', 'USE TEMP B-TREE FOR ORDER BY')),
+    'get_all_wheel_brands': (lambda conn: _uncached(get_all_wheel_brands)(conn), ()),
+    'get_wheel_fitments': (lambda conn: get_wheel_fitments(conn, 1), ()),
+    'get_recent_tire_movements': (lambda conn: get_recent_tire_movements(conn), ()),
+    'get_recent_wheel_movements': (lambda conn: get_recent_wheel_movements(conn), ()),
+    'move_stock': (lambda conn: move_stock(conn, 'tire', 1, 'OUT', 1, 'plan check'), ()),
+    'movements_page': (lambda conn: get_movements_page(conn, 'tire', since='2000-01-01', until='9999-01-01',
+                                                       after=[PLAN_CURSOR_TIME, 1]), ()),
+    'movements_page_by_item': (lambda conn: get_movements_page(conn, 'wheel', item_id=1, after=[PLAN_CURSOR_TIME, 1]), ()),
+    'movements_page_by_type': (lambda conn: get_movements_page(conn, 'tire', move_type='OUT', since='2000-01-01',
+                                                               after=[PLAN_CURSOR_TIME, 1]), ()),
+    'movements_page_by_item_type': (lambda conn: get_movements_page(conn, 'tire', item_id=1, move_type='OUT',
+                                                                    after=[PLAN_CURSOR_TIME, 1]), ()),
+    'get_stock_as_of': (lambda conn: get_stock_as_of(conn, 'tire', '2025-02-15'),
+                        ('SCAN i', 'SCAN params', 'SCAN (subquery)', 'USE TEMP B-TREE FOR ORDER BY')),
+    'get_low_stock_alerts': (lambda conn: get_low_stock_alerts(conn, 'tire'), ()),
+    'get_low_stock_alerts_by_brand': (lambda conn: get_low_stock_alerts(conn, 'wheel', brand='x'), ()),
+    'set_brand_reorder_point': (lambda conn: set_brand_reorder_point(conn, 'tire', 'x', 3), ()),
+    'get_valuation_report': (lambda conn: get_valuation_report(conn, 'tire', 'brand'),
+                             ('SCAN tire_valuation_summary',)), # one row per brand/size, read whole by design
+    # trigger bodies aren't traced separately, so the low-stock refresh is probed through its builder
+    'low_stock_refresh_item': (lambda conn: [conn.execute(statement) for statement in
+                                             refresh_low_stock_statements('tire', 'i.id = 1')], ()),
+    'low_stock_refresh_brand': (lambda conn: [conn.execute(statement) for statement in
+                                              refresh_low_stock_statements('wheel', "i.brand = 'x'")], ()),
+    'get_import_job_errors': (lambda conn: get_import_job_errors(conn, 1), ()),
+    'apply_import_tires': (lambda conn: apply_import_rows(conn, 'tires', 1), STAGED_DEDUPE),
+    'apply_import_wheels': (lambda conn: apply_import_rows(conn, 'wheels', 1), STAGED_DEDUPE),
+    'delete_tire': (lambda conn: delete_tire(conn, 1), ()),
+}
+
+def _prepare_plan_copy(conn):
+    # One archived year per kind, so the probes plan the partition reads as well as the current ledger
+    for kind, config in STOCK_KINDS.items():
+        conn.execute(f"""
+            INSERT INTO {config['movements']} ({config['movement_id']}, timestamp, type, quantity_change, remaining_quantity)
+            VALUES (1, '2000-06-01T00:00:00+07:00', 'IN', 1, 1)
+        """)
+        conn.commit()
+        archive_ledger_year(conn, kind, 2000)
+
+PLANNED_STATEMENTS = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+def capture_hot_queries(conn):
+    # {probe name: [(SQL as executed with bound values inlined, its query plan)]} from every probe on a schema copy
+    copy = _schema_only_copy(conn)
+    _prepare_plan_copy(copy)
+    captured = {}
+    try:
+        for name, (probe, _) in HOT_QUERIES.items():
+            statements = []
+            copy.set_trace_callback(statements.append)
+            try:
+                probe(copy)
+            finally:
+                copy.set_trace_callback(None)
+                if copy.in_transaction:
+                    copy.rollback()
+            captured[name] = [(statement, copy.execute("EXPLAIN QUERY PLAN " + statement).fetchall())
+                              for statement in OrderedDict.fromkeys(statements)
+                              if statement.lstrip().upper().startswith(PLANNED_STATEMENTS)]
+    finally:
+        copy.close()
+    return captured
+
+def _plan_problems(plan_rows):
+    problems = []
+    for row in plan_rows:
+        detail = row['detail']
+        # "SCAN t USING (COVERING) INDEX ..." walks an index in order and is fine; a bare SCAN or a sort is not.
+        # FTS5 MATCH shows up as "SCAN x VIRTUAL TABLE INDEX n:M..." and is an index lookup too
+        if detail.startswith('SCAN') and not any(ok in detail for ok in ('USING', 'CONSTANT ROW', 'VIRTUAL TABLE INDEX')):
+            problems.append(detail)
+        elif 'USE TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+def _schema_only_copy(conn):
+    # Plans are checked against an empty in-memory copy of the schema: a missing index shows up as a SCAN
+    # regardless of how small the live tables (and their sqlite_stat1 figures) happen to be.
+    copy = sqlite3.connect(':memory:')
+    copy.row_factory = sqlite3.Row
+    entries = conn.execute("""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND type IN ('table', 'index', 'view', 'trigger') AND name NOT LIKE 'sqlite_%'
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 WHEN 'view' THEN 2 ELSE 3 END, rowid
+    """).fetchall()
+    virtual_tables = [entry['name'] for entry in entries if entry['sql'].upper().startswith('CREATE VIRTUAL TABLE')]
+    for entry in entries:
+        if any(entry['name'].startswith(virtual + '_') for virtual in virtual_tables):
+            continue # FTS shadow tables are created by their virtual table
+        copy.execute(entry['sql'])
+    return copy
+
+def _plan_step_matches(problem, step):
+    problem = re.sub(r'\(subquery-\d+\)', '(subquery)', problem) # numbering depends on the statement
+    return problem == step or problem.startswith(step + ' ')
+
+def check_query_plans(conn):
+    failures = {}
+    for name, statements in capture_hot_queries(conn).items():
+        allowed = HOT_QUERIES[name][1]
+        problems = []
+        for statement, plan in statements:
+            problems += [problem for problem in _plan_problems(plan)
+                         if not any(_plan_step_matches(problem, step) for step in allowed)]
+        if not statements:
+            problems.append("probe executed no statements")
+        if problems:
+            failures[name] = problems
+    return failures
+
+
+# --- Backup & Maintenance ---
+# Online copies of the live database. backup_database() uses the SQLite backup API a few pages per step and
+# sleeps in between, so writers only wait for one short step rather than the whole copy. vacuum_into()
+# writes a compacted copy (also the way to reclaim space after archive_ledger). Both write to a temporary
+# name and rename on success, so a backup file on disk is never half written.
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7)) # จำนวนไฟล์ที่เก็บไว้ต่อประเภท
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 1024))
+BACKUP_STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', 0.01))
+BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 3))
+BACKUP_PREFIXES = {'backup': 'inventory-backup', 'vacuum': 'inventory-vacuum'}
+BACKUP_MIN_INTERVAL = int(os.environ.get('BACKUP_MIN_INTERVAL', 600)) # วินาที ระหว่างการสั่งผ่าน /admin/backup
+_maintenance_lock = threading.Lock()
+
+def _backup_target(kind, dest_path=None):
+    if dest_path:
+        return dest_path
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    return os.path.join(BACKUP_DIR, f"{BACKUP_PREFIXES[kind]}-{get_bkk_time().strftime('%Y%m%d-%H%M%S')}.db")
+
+def _database_bytes(conn):
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+def _remove_if_exists(path):
+    for file_path in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def _finish_copy(path):
+    # The copy inherits WAL mode from the live database; switch it back so the backup stays a single file
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
+
+class _BackupRestarting(Exception):
+    pass
+
+def backup_database(dest_path=None, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP, max_restarts=BACKUP_MAX_RESTARTS):
+    # Consistent snapshot of the live database while it keeps taking writes. A write from another connection
+    # between steps makes SQLite restart the copy; under constant writes that could go on forever, so after
+    # max_restarts the copy is redone in one step (in WAL mode that holds only a read snapshot, writers go on).
+    dest_path = _backup_target('backup', dest_path)
+    temp_path = dest_path + '.part'
+    progress = {'steps': 0, 'restarts': 0, 'remaining': None, 'total_pages': 0}
+    def on_progress(status, remaining, total):
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > max_restarts:
+                raise _BackupRestarting()
+        progress['steps'] += 1
+        progress['remaining'] = remaining
+        progress['total_pages'] = total
+
+    started = time.perf_counter()
+    source = _open_connection(DB_PATH)
+    single_step = False
+    try:
+        while True:
+            _remove_if_exists(temp_path)
+            target = sqlite3.connect(temp_path)
+            try:
+                source.backup(target, pages=-1 if single_step else pages, progress=on_progress, sleep=sleep)
+                break
+            except _BackupRestarting:
+                single_step = True
+                progress['remaining'] = None
+            finally:
+                target.close()
+        _finish_copy(temp_path)
+        os.replace(temp_path, dest_path)
+    except Exception:
+        _remove_if_exists(temp_path)
+        raise
+    finally:
+        source.close()
+    return {
+        'step': 'backup',
+        'path': dest_path,
+        'seconds': round(time.perf_counter() - started, 3),
+        'bytes': os.path.getsize(dest_path),
+        'pages': progress['total_pages'],
+        'steps': progress['steps'],
+        'restarts': progress['restarts'],
+        'single_step_fallback': single_step,
+    }
+
+def vacuum_into(dest_path=None):
+    # Compacted, defragmented copy of the live database (one read transaction; writers are not blocked in WAL mode)
+    dest_path = _backup_target('vacuum', dest_path)
+    temp_path = dest_path + '.part'
+    _remove_if_exists(temp_path)
+    started = time.perf_counter()
+    conn = _open_connection(DB_PATH)
+    try:
+        source_bytes = _database_bytes(conn)
+        conn.execute("VACUUM INTO ?", (temp_path,))
+        _finish_copy(temp_path)
+        os.replace(temp_path, dest_path)
+    except Exception:
+        _remove_if_exists(temp_path)
+        raise
+    finally:
+        conn.close()
+    return {
+        'step': 'vacuum_into',
+        'path': dest_path,
+        'seconds': round(time.perf_counter() - started, 3),
+        'bytes': source_bytes,
+        'output_bytes': os.path.getsize(dest_path),
+    }
+
+def _stat1_rows(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        return set()
+    return set(conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1").fetchall())
+
+# Read-only statements over the tables whose index choice depends on statistics (several candidate indexes for
+# the listing, size, ledger and alert filters). Planning them marks those tables as used for PRAGMA optimize.
+OPTIMIZE_PROBE_QUERIES = (
+    "SELECT id FROM tires WHERE brand = '' AND size_rim = 0 AND size_width = 0 AND promotion_id = 0 ORDER BY brand, model, size",
+    "SELECT id FROM wheels WHERE brand = '' ORDER BY brand, model, diameter, id",
+    "SELECT wheel_id FROM wheel_fitments WHERE brand = '' AND model = '' AND year_start <= 0",
+    "SELECT id FROM promotions WHERE is_active = 1 ORDER BY name",
+    "SELECT id FROM tire_movements WHERE tire_id = 0 AND type = 'IN' AND timestamp >= '' ORDER BY timestamp",
+    "SELECT id FROM wheel_movements WHERE wheel_id = 0 AND type = 'IN' AND timestamp >= '' ORDER BY timestamp",
+    "SELECT item_id FROM low_stock_alerts WHERE kind = 'tire' ORDER BY quantity",
+)
+
+def optimize_database(analyze=False):
+    # PRAGMA optimize only looks at tables the connection's own queries used; from SQLite 3.46 the 0x10000 flag makes
+    # it check every table, older versions ignore that flag, so there the fixed probes above are planned first.
+    # analyze=True forces a full ANALYZE instead.
+    # Both take the write lock up front: run in autocommit they read first and then upgrade, which fails at once
+    # (no busy wait) or stalls when the app has committed in between.
+    started = time.perf_counter()
+    conn = _open_connection(DB_PATH)
+    try:
+        before = _stat1_rows(conn)
+        if not analyze and sqlite3.sqlite_version_info < (3, 46):
+            for statement in OPTIMIZE_PROBE_QUERIES:
+                conn.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("ANALYZE" if analyze else "PRAGMA optimize = 0x10002")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        changed = {row[0] for row in _stat1_rows(conn) ^ before}
+        size = _database_bytes(conn)
+    finally:
+        conn.close()
+    return {'step': 'analyze' if analyze else 'optimize', 'seconds': round(time.perf_counter() - started, 3), 'bytes': size,
+            'analyzed_tables': sorted(changed)}
+
+def prune_backups(keep=BACKUP_KEEP):
+    # Keeps the newest `keep` files of each kind in BACKUP_DIR (names sort by timestamp); returns removed paths
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    removed = []
+    for prefix in BACKUP_PREFIXES.values():
+        names = sorted(name for name in os.listdir(BACKUP_DIR) if name.startswith(prefix + '-') and name.endswith('.db'))
+        for name in names[:-keep] if keep > 0 else names:
+            _remove_if_exists(os.path.join(BACKUP_DIR, name))
+            removed.append(os.path.join(BACKUP_DIR, name))
+    return removed
+
+MAINTENANCE_STEPS = {
+    'backup': backup_database,
+    'vacuum': vacuum_into,
+    'optimize': optimize_database,
+    'analyze': lambda: optimize_database(analyze=True),
+}
+
+def run_maintenance(steps=('backup',), keep=BACKUP_KEEP):
+    # Runs the named steps in order and returns one report per step (seconds and bytes processed each).
+    # Returns None if another maintenance run is already in progress in this process.
+    if not _maintenance_lock.acquire(blocking=False):
+        return None
+    try:
+        reports = [MAINTENANCE_STEPS[step]() for step in steps]
+        if any(step in ('backup', 'vacuum') for step in steps):
+            started = time.perf_counter()
+            removed = prune_backups(keep)
+            reports.append({'step': 'prune', 'seconds': round(time.perf_counter() - started, 3), 'removed': removed})
+        return reports
+    finally:
+        _maintenance_lock.release()
+
+if __name__ == '__main__':
+    import sys
+    if '--check-query-plans' in sys.argv:
+        conn = get_db_connection()
+        init_db(conn)
+        failures = check_query_plans(conn)
+        for name, problems in failures.items():
+            print(f"FAIL {name}: {'; '.join(problems)}")
+        print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} hot queries use an index")
+        sys.exit(1 if failures else 0)
+    if '--build-snapshots' in sys.argv:
+        # cron รายวัน: python database.py --build-snapshots day (ค่าเริ่มต้นคือ month = เฉพาะสิ้นเดือน)
+        arguments = sys.argv[sys.argv.index('--build-snapshots') + 1:]
+        period = arguments[0] if arguments and arguments[0] in SNAPSHOT_PERIODS else 'month'
+        conn = get_db_connection()
+        init_db(conn)
+        for kind, dates in build_stock_snapshots(conn, period).items():
+            print(f"{kind}: {len(dates)} snapshot(s) built" + (f" ({dates[0]} .. {dates[-1]})" if dates else ''))
+    if '--archive-ledger' in sys.argv:
+        # cron รายวัน/รายเดือน: python database.py --archive-ledger
+        conn = get_db_connection()
+        init_db(conn)
+        if not ledger_archive_due(conn):
+            print("nothing to archive")
+        for kind, years in archive_ledger(conn).items():
+            for year, moved in years:
+                print(f"{kind} {year}: {moved} movements archived")
+        print(f"current ledger keeps movements from {ledger_archive_boundary()}")
+    if '--maintenance' in sys.argv:
+        # cron: python database.py --maintenance backup          (ทุกชั่วโมง/ทุกวัน)
+        #       python database.py --maintenance vacuum optimize (สัปดาห์ละครั้ง)
+        arguments = sys.argv[sys.argv.index('--maintenance') + 1:]
+        steps = [argument for argument in arguments if argument in MAINTENANCE_STEPS] or ['backup']
+        for report in run_maintenance(steps):
+            details = ", ".join(f"{key}={value}" for key, value in report.items() if key not in ('step', 'seconds'))
+            print(f"{report['step']}: {report['seconds']:.3f}s ({details})")
@@ -0,0 +1,106 @@
+import csv
+import io
+import itertools
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+# หัวคอลัมน์ในไฟล์ส่งออก -> คีย์ในแถวที่อ่านจากฐานข้อมูล, ชนิดข้อมูล (ใช้กับ Parquet)
+# ปีผลิตเก็บเป็นข้อความ (บางแถวเป็นรหัสสัปดาห์+ปี เช่น '4924')
+TIRE_EXPORT_COLUMNS = [
+    ('ID', 'id', 'int'),
+    ('ยี่ห้อ', 'brand', 'text'),
+    ('รุ่นยาง', 'model', 'text'),
+    ('เบอร์ยาง', 'size', 'text'),
+    ('สต็อก', 'quantity', 'int'),
+    ('ทุน SC', 'cost_sc', 'float'),
+    ('ทุน Dunlop', 'cost_dunlop', 'float'),
+    ('ทุน Online', 'cost_online', 'float'),
+    ('ราคาขายส่ง 1', 'wholesale_price1', 'float'),
+    ('ราคาขายส่ง 2', 'wholesale_price2', 'float'),
+    ('ราคาต่อเส้น', 'price_per_item', 'float'),
+    ('ID โปรโมชัน', 'promotion_id', 'int'),
+    ('ชื่อโปรโมชัน', 'promo_name', 'text'),
+    ('ประเภทโปรโมชัน', 'promo_type', 'text'),
+    ('ค่าโปรโมชัน Value1', 'promo_value1', 'float'),
+    ('ค่าโปรโมชัน Value2', 'promo_value2', 'float'),
+    ('รายละเอียดโปรโมชัน', 'display_promo_description_text', 'text'),
+    ('ราคาโปรโมชันคำนวณ(เส้น)', 'display_promo_price_per_item', 'float'),
+    ('ราคาโปรโมชันคำนวณ(4เส้น)', 'display_price_for_4', 'float'),
+    ('ปีผลิต', 'year_of_manufacture', 'text'),
+]
+
+WHEEL_EXPORT_COLUMNS = [
+    ('ID', 'id', 'int'),
+    ('ยี่ห้อ', 'brand', 'text'),
+    ('ลาย', 'model', 'text'),
+    ('ขอบ', 'diameter', 'float'),
+    ('รู', 'pcd', 'text'),
+    ('กว้าง', 'width', 'float'),
+    ('ET', 'et', 'int'),
+    ('สี', 'color', 'text'),
+    ('สต็อก', 'quantity', 'int'),
+    ('ทุน', 'cost', 'float'),
+    ('ทุน Online', 'cost_online', 'float'),
+    ('ราคาขายส่ง 1', 'wholesale_price1', 'float'),
+    ('ราคาขายส่ง 2', 'wholesale_price2', 'float'),
+    ('ราคาขายปลีก', 'retail_price', 'float'),
+    ('ไฟล์รูปภาพ', 'image_filename', 'text'),
+]
+
+# ไฟล์ผลลัพธ์เล็กกว่านี้อยู่ในหน่วยความจำ ใหญ่กว่านี้ย้ายไปเป็นไฟล์ชั่วคราวบนดิสก์
+EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+def write_xlsx(rows, columns, sheet_name):
+    # constant_memory: xlsxwriter เขียนทีละแถวแล้วปล่อยทิ้ง ใช้หน่วยความจำคงที่ไม่ว่าสินค้าจะมีกี่รายการ
+    # rows อ่านต่อเนื่องจาก cursor ได้เลย (ไม่ต้องสร้าง list/DataFrame)
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'in_memory': False})
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({'bold': True})
+    worksheet.write_row(0, 0, [header for header, _, _ in columns], header_format)
+    keys = [key for _, key, _ in columns]
+    for row_index, row in enumerate(rows, start=1):
+        worksheet.write_row(row_index, 0, [row[key] for key in keys])
+    workbook.close()
+    output.seek(0)
+    return output
+
+def iter_csv(rows, columns, chunk_rows=500):
+    # CSV ส่งออกเป็น stream: เขียนทีละชุดลง buffer เล็กๆ แล้ว yield ออกไปเลย
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for header, _, _ in columns])
+    keys = [key for _, key, _ in columns]
+    for row_index, row in enumerate(rows, start=1):
+        writer.writerow([row[key] for key in keys])
+        if row_index % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+PARQUET_TYPES = {
+    'int': (pa.int64(), int),
+    'float': (pa.float64(), float),
+    'text': (pa.string(), str),
+}
+
+def write_parquet(rows, columns, batch_rows=10000):
+    # Parquet มีชนิดข้อมูลในตัว ระบบอื่นอ่านได้ทันทีโดยไม่ต้องแปลง; เขียนเป็น row group ทีละ batch_rows แถว
+    schema = pa.schema([(header, PARQUET_TYPES[kind][0]) for header, _, kind in columns])
+    converters = [(key, PARQUET_TYPES[kind][1]) for _, key, kind in columns]
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    with pq.ParquetWriter(output, schema) as writer:
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, batch_rows))
+            if not batch:
+                break
+            arrays = [pa.array([None if row[key] is None else convert(row[key]) for row in batch], type=field.type)
+                      for (key, convert), field in zip(converters, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    output.seek(0)
+    return output
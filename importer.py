@@ -0,0 +1,286 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow.parquet as pq
+
+import database
+
+# จำนวน thread ที่รันงานนำเข้าเบื้องหลังต่อ process (SQLite เขียนได้ทีละ transaction อยู่แล้ว)
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', '1'))
+
+# คอลัมน์ในไฟล์นำเข้า (หัวตารางภาษาไทย) -> ฟิลด์ในฐานข้อมูล, ชนิดข้อมูล, ค่าเริ่มต้นเมื่อเว้นว่าง
+# 'key' = ข้อความที่ห้ามว่าง, 'text' = ข้อความ, 'int'/'float' = ตัวเลข
+TIRE_IMPORT_COLUMNS = [
+    ('ยี่ห้อ', 'brand', 'key', None),
+    ('รุ่นยาง', 'model', 'key', None),
+    ('เบอร์ยาง', 'size', 'key', None),
+    ('สต็อก', 'quantity', 'int', 0),
+    ('ทุน SC', 'cost_sc', 'float', None),
+    ('ทุน Dunlop', 'cost_dunlop', 'float', None),
+    ('ทุน Online', 'cost_online', 'float', None),
+    ('ราคาขายส่ง 1', 'wholesale_price1', 'float', None),
+    ('ราคาขายส่ง 2', 'wholesale_price2', 'float', None),
+    ('ราคาต่อเส้น', 'price_per_item', 'float', 0.0),
+    ('ID โปรโมชัน', 'promotion_id', 'int', None),
+    ('ปีผลิต', 'year_of_manufacture', 'int', None),
+]
+
+WHEEL_IMPORT_COLUMNS = [
+    ('ยี่ห้อ', 'brand', 'key', None),
+    ('ลาย', 'model', 'key', None),
+    ('ขอบ', 'diameter', 'float', 0.0),
+    ('รู', 'pcd', 'key', None),
+    ('กว้าง', 'width', 'float', 0.0),
+    ('ET', 'et', 'int', None),
+    ('สี', 'color', 'text', None),
+    ('สต็อก', 'quantity', 'int', 0),
+    ('ทุน', 'cost', 'float', None),
+    ('ทุน Online', 'cost_online', 'float', None),
+    ('ราคาขายส่ง 1', 'wholesale_price1', 'float', None),
+    ('ราคาขายส่ง 2', 'wholesale_price2', 'float', None),
+    ('ราคาขายปลีก', 'retail_price', 'float', 0.0),
+    ('ไฟล์รูปภาพ', 'image_filename', 'text', None),
+]
+
+TIRE_KEY_ERROR = "ข้อมูล 'ยี่ห้อ', 'รุ่นยาง', หรือ 'เบอร์ยาง' ไม่สามารถเว้นว่างได้"
+WHEEL_KEY_ERROR = "ข้อมูล 'ยี่ห้อ', 'ลาย', หรือ 'รู' ไม่สามารถเว้นว่างได้"
+
+def missing_columns(df, import_columns):
+    return [column for column, _, _, _ in import_columns if column not in df.columns]
+
+def convert_frame(df, import_columns, key_error):
+    # แปลงทั้งคอลัมน์ทีเดียว (ไม่วน iterrows) คืน (แถวที่พร้อมเขียน, [(เลขแถว, ข้อความผิดพลาด)])
+    # df.index คือลำดับแถวข้อมูลในไฟล์ (เริ่ม 0) -> เลขแถวแบบ Excel ที่แถว 1 คือหัวตาราง
+    row_numbers = pd.Series(np.asarray(df.index) + 2)
+    errors = pd.Series([None] * len(df), dtype=object)
+    columns = {'row_number': row_numbers}
+
+    for column, field, kind, default in import_columns:
+        values = df[column].reset_index(drop=True)
+        present = values.notna()
+        if kind in ('key', 'text'):
+            text = values.astype(str).str.strip().where(present, None)
+            if kind == 'key':
+                blank = ~present | (text == '')
+                errors = errors.where(~blank | errors.notna(), key_error)
+            columns[field] = text
+        else:
+            numbers = pd.to_numeric(values, errors='coerce')
+            invalid = present & numbers.isna()
+            if invalid.any():
+                messages = f"ค่า '{column}' ไม่ใช่ตัวเลข: " + values.astype(str)
+                errors = errors.where(~invalid | errors.notna(), messages)
+            if default is not None:
+                numbers = numbers.fillna(default)
+            if kind == 'int':
+                numbers = np.trunc(numbers).astype('Int64')
+            # object dtype ให้ได้ int/float ของ Python และ None สำหรับค่าว่าง (sqlite3 ไม่รับชนิดของ numpy)
+            columns[field] = numbers.astype(object).where(numbers.notna(), None)
+
+    frame = pd.DataFrame(columns)
+    failed = errors.notna()
+    error_rows = list(zip(row_numbers[failed].tolist(), errors[failed].tolist()))
+    return frame[~failed], error_rows
+
+def frame_rows(frame):
+    return frame.itertuples(index=False, name=None)
+
+# รูปแบบไฟล์ที่นำเข้าได้: นามสกุล -> ชื่อที่ใช้ในหมายเหตุการเคลื่อนไหว (เช่น 'Import from CSV (Qty Update)')
+IMPORT_FORMATS = {
+    'xlsx': 'Excel',
+    'xls': 'Excel',
+    'csv': 'CSV',
+    'parquet': 'Parquet',
+}
+
+# จำนวนแถวต่อชุดเมื่ออ่านไฟล์นำเข้า: หน่วยความจำสูงสุดขึ้นกับค่านี้ ไม่ใช่ขนาดไฟล์
+IMPORT_CHUNK_ROWS = int(os.environ.get('IMPORT_CHUNK_ROWS', '5000'))
+
+def iter_excel_chunks(file_path, chunk_rows):
+    # openpyxl read_only อ่านชีตทีละแถวจาก XML โดยไม่โหลดทั้ง workbook
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        width = len(header)
+        chunk = []
+        positions = []
+        yielded = False
+        for position, values in enumerate(rows):
+            if all(value is None for value in values):
+                continue # แถวว่าง (pd.read_excel ก็ข้ามเหมือนกัน) แต่ยังนับเลขแถวต่อ
+            chunk.append(tuple(values[:width]) + (None,) * (width - len(values)))
+            positions.append(position)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=header, index=positions)
+                yielded = True
+                chunk = []
+                positions = []
+        if chunk or not yielded:
+            yield pd.DataFrame(chunk, columns=header, index=positions)
+    finally:
+        workbook.close()
+
+def iter_parquet_chunks(file_path, chunk_rows):
+    parquet_file = pq.ParquetFile(file_path)
+    offset = 0
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+        df = batch.to_pandas()
+        df.index = pd.RangeIndex(offset, offset + len(df))
+        offset += len(df)
+        yield df
+    if offset == 0:
+        yield parquet_file.schema_arrow.empty_table().to_pandas()
+
+def iter_import_chunks(file_path, chunk_rows=IMPORT_CHUNK_ROWS):
+    # คืน (DataFrame ทีละชุด, จำนวนแถวทั้งหมดโดยประมาณหรือ None); index ของแต่ละชุดคือลำดับแถวในไฟล์
+    # CSV อ่านทุกคอลัมน์เป็นข้อความ ให้ convert_frame แปลงชนิดเอง (เลขอย่าง ET/สี จะไม่กลายเป็น 1.0)
+    extension = file_path.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        return pd.read_csv(file_path, dtype=str, encoding='utf-8-sig', chunksize=chunk_rows), None
+    if extension == 'parquet':
+        return iter_parquet_chunks(file_path, chunk_rows), pq.ParquetFile(file_path).metadata.num_rows
+    if extension == 'xls':
+        # openpyxl อ่าน .xls รุ่นเก่าไม่ได้ ต้องโหลดทั้งไฟล์ผ่าน pandas แล้วค่อยแบ่งชุด
+        df = pd.read_excel(file_path)
+        return (df.iloc[start:start + chunk_rows] for start in range(0, max(len(df), 1), chunk_rows)), len(df)
+    # max_row มาจาก <dimension> ของชีต (อาจนับแถวว่างท้ายไฟล์ด้วย) ใช้แสดงความคืบหน้าโดยประมาณ
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    max_row = workbook.active.max_row
+    workbook.close()
+    return iter_excel_chunks(file_path, chunk_rows), (max_row - 1 if max_row else None)
+
+# --- Background Import Jobs ---
+IMPORTERS = {
+    'tires': (TIRE_IMPORT_COLUMNS, TIRE_KEY_ERROR),
+    'wheels': (WHEEL_IMPORT_COLUMNS, WHEEL_KEY_ERROR),
+}
+
+def import_source(file_path):
+    return IMPORT_FORMATS.get(file_path.rsplit('.', 1)[-1].lower(), 'Excel')
+
+def import_chunks(conn, kind, job_id, chunks, source):
+    # ตรวจสอบแล้วพักแถวไว้ในตาราง *_import_rows ทีละชุด (ในหน่วยความจำมีแค่ชุดเดียว) ยังไม่แตะสต็อกจริง
+    # yield ผลของแต่ละชุด: (จำนวนแถว, [(เลขแถว, ข้อความผิดพลาด)])
+    import_columns, key_error = IMPORTERS[kind]
+    for chunk_number, df in enumerate(chunks):
+        if chunk_number == 0:
+            missing_cols = missing_columns(df, import_columns)
+            if missing_cols:
+                raise ValueError(f'ไฟล์ {source} ขาดคอลัมน์ที่จำเป็น: {", ".join(missing_cols)}')
+        frame, errors = convert_frame(df, import_columns, key_error)
+        errors += database.stage_import_rows(conn, kind, job_id, frame_rows(frame))
+        yield len(df), sorted(errors)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    # สร้างใหม่หลัง gunicorn fork เหมือน database.get_pool() (thread ไม่ติดไปกับ fork)
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='import-job')
+            _executor_pid = os.getpid()
+        return _executor
+
+def submit_import_job(conn, kind, filename, file_path, mode='apply'):
+    job_id = database.create_import_job(conn, kind, filename, file_path, mode=mode)
+    get_executor().submit(run_import_job, job_id)
+    return job_id
+
+def confirm_import_job(conn, job_id):
+    if not database.confirm_import_job(conn, job_id):
+        return False
+    get_executor().submit(run_import_job, job_id)
+    return True
+
+def recover_import_jobs(conn):
+    # งานอยู่ในคิวของ executor ในหน่วยความจำเท่านั้น: หลัง gunicorn รีสตาร์ท/เปลี่ยน worker ต้องอ่าน import_jobs ใหม่
+    # งาน 'queued' ส่งเข้าคิวอีกครั้ง (claim_import_job กันไม่ให้หลาย worker ทำงานเดียวกัน)
+    # งาน 'running' ที่ process เจ้าของไม่อยู่แล้วถือว่าล้มเหลว ลบแถวที่พักไว้และไฟล์ ให้ผู้ใช้นำเข้าใหม่
+    failed = []
+    for job in database.get_import_jobs_by_status(conn, 'running'):
+        if database.fail_orphaned_import_job(conn, job, 'งานหยุดกลางคันเพราะเซิร์ฟเวอร์รีสตาร์ท กรุณาสั่งใหม่อีกครั้ง'):
+            if job['kind'] != database.MAINTENANCE_JOB_KIND:
+                database.discard_import_rows(conn, job['kind'], job['id'])
+            if job['file_path'] and os.path.exists(job['file_path']):
+                os.remove(job['file_path'])
+            failed.append(job['id'])
+    queued = [job for job in database.get_import_jobs_by_status(conn, 'queued')]
+    for job in queued:
+        runner = run_maintenance_job if job['kind'] == database.MAINTENANCE_JOB_KIND else run_import_job
+        get_executor().submit(runner, job['id'])
+    return [job['id'] for job in queued], failed
+
+# --- Background Maintenance Jobs ---
+def submit_maintenance_job(conn, steps, min_interval=database.BACKUP_MIN_INTERVAL):
+    # backup/VACUUM INTO บนฐานข้อมูลใหญ่ใช้เวลานานเกิน timeout ของ gunicorn จึงรันใน executor เดียวกับงานนำเข้า
+    job_id = database.create_maintenance_job(conn, steps, min_interval)
+    if job_id is not None:
+        get_executor().submit(run_maintenance_job, job_id)
+    return job_id
+
+def run_maintenance_job(job_id):
+    # รายงานของแต่ละขั้น (เวลา, จำนวน byte) เก็บเป็น JSON ใน message ของงาน
+    conn = database.get_db_connection()
+    try:
+        if not database.claim_import_job(conn, job_id):
+            return
+        steps = database.get_import_job(conn, job_id)['filename'].split()
+        try:
+            reports = database.run_maintenance(steps)
+            if reports is None:
+                database.fail_import_job(conn, job_id, 'มีงานบำรุงรักษาฐานข้อมูลกำลังทำงานอยู่')
+            else:
+                database.finish_import_job(conn, job_id, message=json.dumps(reports, ensure_ascii=False))
+        except Exception as e:
+            database.fail_import_job(conn, job_id, str(e))
+    finally:
+        database.release_db_connection(conn)
+
+def run_import_job(job_id):
+    # mode: 'apply' = อ่านไฟล์แล้วนำเข้าทันที, 'preview' = อ่านไฟล์แล้วสรุปความเปลี่ยนแปลงรอยืนยัน,
+    # 'confirmed' = นำแถวที่ preview ไว้ไปบันทึก (ไม่อ่านไฟล์ซ้ำ)
+    conn = database.get_db_connection()
+    try:
+        if not database.claim_import_job(conn, job_id):
+            return
+        job = database.get_import_job(conn, job_id)
+        source = import_source(job['file_path'])
+        try:
+            if job['mode'] != 'confirmed':
+                chunks, total_rows = iter_import_chunks(job['file_path'])
+                if total_rows is not None:
+                    database.set_import_job_total(conn, job_id, total_rows)
+                for row_count, errors in import_chunks(conn, job['kind'], job_id, chunks, source):
+                    database.record_import_job_chunk(conn, job_id, row_count, 0, 0, 0, errors)
+            if job['mode'] == 'preview':
+                database.classify_import_rows(conn, job['kind'], job_id)
+                conn.commit()
+                summary = database.get_import_diff_summary(conn, job['kind'], job_id)
+                database.finish_import_job(conn, job_id, status='previewed',
+                                           counts=(summary['inserted'], summary['updated'], summary['unchanged']))
+            else:
+                # ทุกแถวของไฟล์ upsert ใน transaction เดียว: ไฟล์เสียกลางทางจะไม่ทิ้งสต็อกที่อัปเดตไปครึ่งไฟล์
+                imported_count, updated_count, unchanged_count, errors = database.apply_import_rows(conn, job['kind'], job_id, source)
+                database.record_import_job_chunk(conn, job_id, 0, 0, 0, 0, errors)
+                database.finish_import_job(conn, job_id, counts=(imported_count, updated_count, unchanged_count))
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            database.discard_import_rows(conn, job['kind'], job_id)
+            database.fail_import_job(conn, job_id, str(e))
+        finally:
+            if os.path.exists(job['file_path']):
+                os.remove(job['file_path'])
+    finally:
+        database.release_db_connection(conn)
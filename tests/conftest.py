@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # A fresh, fully migrated database file per test; connections come from database._open_connection
+    # so the tests run with the app's PRAGMAs (WAL, busy_timeout)
+    path = str(tmp_path / 'inventory.db')
+    conn = database._open_connection(path)
+    database.init_db(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = database._open_connection(db_path)
+    yield conn
+    conn.close()
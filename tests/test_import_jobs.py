@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+import database
+import importer
+
+HEADER = ','.join(column for column, _, _, _ in importer.TIRE_IMPORT_COLUMNS)
+
+
+def tire_line(model, quantity):
+    values = {'brand': 'B', 'model': model, 'size': '205/55R16', 'quantity': quantity, 'price_per_item': 1000}
+    return ','.join(str(values.get(field, '')) for _, field, _, _ in importer.TIRE_IMPORT_COLUMNS)
+
+
+@pytest.fixture
+def import_file(db_path, tmp_path, monkeypatch):
+    # run_import_job takes its connection from the pool, so point the pool at the test database;
+    # two rows per chunk so a short file still spans several chunks
+    monkeypatch.setattr(database, 'DB_PATH', db_path)
+    monkeypatch.setattr(database, '_pool', None)
+    iter_import_chunks = importer.iter_import_chunks
+    monkeypatch.setattr(importer, 'iter_import_chunks', lambda file_path: iter_import_chunks(file_path, chunk_rows=2))
+
+    def write(lines):
+        path = tmp_path / 'tires.csv'
+        path.write_text('\n'.join([HEADER] + lines) + '\n', encoding='utf-8')
+        return str(path)
+    return write
+
+
+def run_job(conn, file_path):
+    job_id = database.create_import_job(conn, 'tires', 'tires.csv', file_path)
+    importer.run_import_job(job_id)
+    return database.get_import_job(conn, job_id)
+
+
+def test_import_applies_every_chunk(conn, import_file):
+    file_path = import_file([tire_line(f'M{number}', number) for number in range(5)])
+
+    job = run_job(conn, file_path)
+
+    assert job['status'] == 'done'
+    assert (job['processed_rows'], job['imported_count']) == (5, 5)
+    assert (job['worker_pid'], job['worker_token']) == (os.getpid(), database.worker_token(os.getpid()))
+    assert conn.execute("SELECT count(*) FROM tires").fetchone()[0] == 5
+    assert conn.execute("SELECT count(*) FROM tire_movements").fetchone()[0] == 5
+
+
+def test_failed_import_leaves_stock_untouched(conn, import_file, monkeypatch):
+    # The file breaks while the second chunk is read: the rows of the first chunk must not be applied either
+    conn.execute("INSERT INTO tires (brand, model, size, quantity, price_per_item) VALUES ('B', 'M0', '205/55R16', 9, 1000)")
+    conn.commit()
+    file_path = import_file([tire_line('M0', 1), tire_line('M1', 1), tire_line('M2', 1)])
+    iter_import_chunks = importer.iter_import_chunks
+
+    def breaking_chunks(file_path):
+        chunks, total_rows = iter_import_chunks(file_path)
+        def chunks_then_error():
+            yield next(iter(chunks))
+            raise ValueError('ไฟล์เสีย')
+        return chunks_then_error(), total_rows
+    monkeypatch.setattr(importer, 'iter_import_chunks', breaking_chunks)
+
+    job = run_job(conn, file_path)
+
+    assert (job['status'], job['message']) == ('failed', 'ไฟล์เสีย')
+    assert [tuple(row) for row in conn.execute("SELECT model, quantity FROM tires")] == [('M0', 9)]
+    assert conn.execute("SELECT count(*) FROM tire_movements").fetchone()[0] == 0
+    assert conn.execute("SELECT count(*) FROM tire_import_rows").fetchone()[0] == 0
+
+
+def test_reimport_restores_a_deleted_item(conn, import_file):
+    job = run_job(conn, import_file([tire_line('M0', 4)]))
+    assert database.delete_item(conn, 'tire', 1) == 'soft_deleted'
+
+    job = run_job(conn, import_file([tire_line('M0', 4)]))
+
+    assert (job['status'], job['updated_count']) == ('done', 1)
+    assert tuple(conn.execute("SELECT quantity, deleted_at FROM tires").fetchone()) == (4, None)
+    assert [row[0] for row in conn.execute("SELECT type FROM tire_movements ORDER BY id")] == ['IN', 'OUT', 'IN']
+
+
+@pytest.mark.skipif(database.worker_token(os.getpid()) is None, reason='needs /proc')
+def test_running_job_is_orphaned_when_its_pid_was_reused(conn):
+    # The parent process is alive, but a token taken from a different process run means the pid was reused
+    live_pid = os.getppid()
+    jobs = {}
+    for name, token in (('reused', 'old-boot:1:1'), ('live', database.worker_token(live_pid))):
+        job_id = database.create_import_job(conn, 'tires', f'{name}.csv', '')
+        conn.execute("UPDATE import_jobs SET status = 'running', worker_pid = ?, worker_token = ? WHERE id = ?",
+                     (live_pid, token, job_id))
+        conn.commit()
+        jobs[name] = database.get_import_job(conn, job_id)
+
+    assert database.fail_orphaned_import_job(conn, jobs['reused'], 'restarted') is True
+    assert database.fail_orphaned_import_job(conn, jobs['live'], 'restarted') is False
+    assert database.get_import_job(conn, jobs['reused']['id'])['status'] == 'failed'
+    assert database.get_import_job(conn, jobs['live']['id'])['status'] == 'running'
@@ -0,0 +1,14 @@
+import database
+
+
+def test_optimize_plans_only_its_fixed_probes(db_path, conn, monkeypatch):
+    # The probes must match the live schema (no errors swallowed), and optimize must not touch the plan-check harness
+    monkeypatch.setattr(database, 'DB_PATH', db_path)
+    monkeypatch.setattr(database, 'capture_hot_queries', None)
+    monkeypatch.setattr(database.sqlite3, 'sqlite_version_info', (3, 45, 0))
+    for statement in database.OPTIMIZE_PROBE_QUERIES:
+        conn.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+
+    report = database.optimize_database()
+
+    assert report['step'] == 'optimize'
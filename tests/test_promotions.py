@@ -0,0 +1,32 @@
+import itertools
+
+import database
+
+VALUES = (None, -1, 0, 1, 2.5, 3, 10, 12.5, 33.3, 100, 101, 2900, 1999.99)
+
+
+def test_sql_description_matches_python():
+    conn = database._open_connection(':memory:')
+    conn.execute("CREATE TABLE promotions (type TEXT, value1 REAL, value2 REAL)")
+    types = ('buy_x_get_y', 'percentage_discount', 'fixed_price_per_n', 'unknown')
+    conn.executemany("INSERT INTO promotions VALUES (?, ?, ?)", itertools.product(types, VALUES, VALUES))
+    rows = conn.execute(f"SELECT type, value1, value2, {database.promotion_description_sql('promotions')} AS text FROM promotions")
+    for row in rows:
+        assert row['text'] == database.promotion_description(row['type'], row['value1'], row['value2']), tuple(row)
+    conn.close()
+
+
+def test_raw_sql_promotion_changes_reach_tire_prices(conn):
+    promo_id = database.add_promotion(conn, 'ลด 10', 'percentage_discount', 10, None, 1)
+    conn.execute("INSERT INTO tires (brand, model, size, quantity, price_per_item, promotion_id) VALUES ('B', 'M', '205/55R16', 1, 1000, ?)",
+                 (promo_id,))
+    conn.commit()
+
+    conn.execute("UPDATE promotions SET type = 'buy_x_get_y', value1 = 3, value2 = 1 WHERE id = ?", (promo_id,))
+    conn.commit()
+
+    promotion = database.get_promotion(conn, promo_id)
+    prices = conn.execute("SELECT * FROM effective_tire_prices").fetchone()
+    assert promotion['description_text'] == 'ซื้อ 3 แถม 1 ฟรี'
+    assert prices['promo_description_text'] == 'ซื้อ 3 แถม 1 ฟรี'
+    assert prices['promo_price_per_item'] == 750
@@ -0,0 +1,43 @@
+import database
+
+
+def test_init_db_creates_fts_skipped_by_the_migration(conn):
+    # State left by _migration_search_fts on a build without FTS5/trigram: migration recorded, no FTS tables
+    conn.execute("INSERT INTO tires (brand, model, size, quantity, price_per_item) VALUES ('Michelin', 'Primacy 4', '205/55R16', 1, 0)")
+    conn.commit()
+    for fts_table in database.FTS_TABLES:
+        for suffix in ('ai', 'ad', 'au'):
+            conn.execute(f"DROP TRIGGER {fts_table}_{suffix}")
+        conn.execute(f"DROP TABLE {fts_table}")
+    assert database._missing_fts_tables(conn) == list(database.FTS_TABLES)
+
+    database.init_db(conn)
+
+    assert database._missing_fts_tables(conn) == []
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+    assert [row[0] for row in conn.execute("SELECT rowid FROM tires_fts WHERE tires_fts MATCH '\"rimac\"'")] == [1]
+
+
+def test_search_pages_follow_rank(conn):
+    # Paging one result at a time through the index walks the FTS rank order, not the (brand, model, size) keyset
+    models = ['A Primacy', 'B Primacy Primacy Primacy', 'C Pilot Sport Primacy Tour', 'D Primacy Primacy', 'E Energy']
+    conn.executemany("INSERT INTO tires (brand, model, size, quantity, price_per_item) VALUES ('Michelin', ?, '205/55R16', 1, 0)",
+                     [(model,) for model in models])
+    conn.commit()
+    ranked = [row[0] for row in conn.execute("""
+        SELECT rowid FROM tires_fts WHERE tires_fts MATCH '"primacy"' ORDER BY rank, rowid
+    """)]
+    assert ranked != sorted(ranked)
+
+    seen = []
+    after = None
+    while True:
+        rows, next_after = database.get_tires_page(conn, query='primacy', brand_filter='Michelin', after=after, limit=1)
+        seen += [row['id'] for row in rows]
+        if next_after is None:
+            break
+        token = database.encode_cursor(next_after)
+        after = database.decode_cursor(token, database.page_cursor_shape(conn, 'tire', 'primacy'))
+        assert after == next_after
+
+    assert seen == ranked
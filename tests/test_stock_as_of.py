@@ -0,0 +1,22 @@
+import database
+
+
+def test_item_added_after_as_of_date_had_no_stock(conn):
+    database.add_tire(conn, 'B', 'M', '205/55R16', 50, None, None, None, None, None, 1000, None, None)
+    database.add_wheel(conn, 'B', 'M', 15, '4x100', 7, None, None, 8, None, None, None, None, 5000, None)
+    today = database.get_bkk_time().date().isoformat()
+
+    for kind, quantity in (('tire', 50), ('wheel', 8)):
+        before, _ = database.get_stock_as_of(conn, kind, '2020-01-01')
+        now, _ = database.get_stock_as_of(conn, kind, today)
+        assert [row['quantity'] for row in before] == [0]
+        assert [row['quantity'] for row in now] == [quantity]
+
+
+def test_stock_as_of_replays_movements_after_creation(conn):
+    tire_id = database.add_tire(conn, 'B', 'M', '205/55R16', 10, None, None, None, None, None, 1000, None, None)
+    database.move_stock(conn, 'tire', tire_id, 'OUT', 4, 'test')
+    today = database.get_bkk_time().date().isoformat()
+
+    assert [row['quantity'] for row in database.get_stock_as_of(conn, 'tire', '2020-01-01')[0]] == [0]
+    assert [row['quantity'] for row in database.get_stock_as_of(conn, 'tire', today)[0]] == [6]
@@ -0,0 +1,159 @@
+import threading
+
+import pytest
+
+import database
+
+WORKERS = 8
+MOVES_PER_WORKER = 100
+
+
+def add_items(conn, quantity, model='M'):
+    conn.execute("INSERT INTO tires (brand, model, size, quantity, price_per_item) VALUES ('B', ?, '205/55R16', ?, 0)",
+                 (model, quantity))
+    conn.execute("INSERT INTO wheels (brand, model, diameter, pcd, width, quantity, retail_price) VALUES ('B', ?, 15, '4x100', 7, ?, 0)",
+                 (model, quantity))
+    conn.commit()
+
+
+def run_workers(db_path, moves):
+    # moves(worker_index, move_index) -> (kind, move_type, quantity_change); each worker uses its own connection
+    applied = []
+    lock = threading.Lock()
+    errors = []
+
+    def worker(worker_index):
+        worker_conn = database._open_connection(db_path)
+        try:
+            for move_index in range(MOVES_PER_WORKER):
+                kind, move_type, quantity_change = moves(worker_index, move_index)
+                ok, _ = database.move_stock(worker_conn, kind, 1, move_type, quantity_change, 'test')
+                if ok:
+                    with lock:
+                        applied.append((kind, move_type, quantity_change))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            worker_conn.close()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    return applied
+
+
+def ledger(conn, kind):
+    config = database.STOCK_KINDS[kind]
+    return conn.execute(f"""
+        SELECT type, quantity_change, remaining_quantity FROM {config['movements']} ORDER BY id
+    """).fetchall()
+
+
+def quantity(conn, kind):
+    return conn.execute(f"SELECT quantity FROM {database.STOCK_KINDS[kind]['table']} WHERE id = 1").fetchone()['quantity']
+
+
+def test_concurrent_out_movements_never_oversell(conn, db_path):
+    # Workers ask for twice the stock there is; exactly the available units may leave, one ledger row each
+    initial = WORKERS * MOVES_PER_WORKER // 4
+    add_items(conn, initial)
+
+    applied = run_workers(db_path, lambda worker, move: ('tire' if (worker + move) % 2 == 0 else 'wheel', 'OUT', 1))
+
+    for kind in database.STOCK_KINDS:
+        moved = sum(1 for applied_kind, _, _ in applied if applied_kind == kind)
+        rows = ledger(conn, kind)
+        assert moved == initial
+        assert quantity(conn, kind) == 0
+        assert len(rows) == moved
+        assert sorted(row['remaining_quantity'] for row in rows) == list(range(initial))
+
+
+def test_concurrent_mixed_movements_keep_ledger_consistent(conn, db_path):
+    # IN and OUT interleaved from every worker: the ledger replays to the final quantity, snapshot by snapshot
+    initial = 10
+    add_items(conn, initial)
+
+    def moves(worker, move):
+        kind = 'tire' if worker % 2 == 0 else 'wheel'
+        return (kind, 'IN', 2) if move % 3 == 0 else (kind, 'OUT', 1)
+
+    applied = run_workers(db_path, moves)
+
+    for kind in database.STOCK_KINDS:
+        running = initial
+        for row in ledger(conn, kind):
+            running += database.STOCK_MOVEMENT_SIGNS[row['type']] * row['quantity_change']
+            assert row['remaining_quantity'] == running
+            assert running >= 0
+        assert quantity(conn, kind) == running
+        assert len(ledger(conn, kind)) == sum(1 for applied_kind, _, _ in applied if applied_kind == kind)
+
+
+@pytest.mark.parametrize('kind', list(database.STOCK_KINDS))
+def test_out_movement_beyond_stock_is_refused(conn, kind):
+    add_items(conn, 3)
+
+    assert database.move_stock(conn, kind, 1, 'OUT', 5, 'test') == (False, 3)
+    assert database.move_stock(conn, kind, 999, 'OUT', 1, 'test') == (False, None)
+    assert database.move_stock(conn, kind, 1, 'OUT', 3, 'test') == (True, 0)
+    assert quantity(conn, kind) == 0
+    assert len(ledger(conn, kind)) == 1
+
+
+@pytest.mark.parametrize('kind', list(database.STOCK_KINDS))
+def test_items_with_history_are_soft_deleted(conn, kind):
+    # The ledger outlives the item, including rows already moved to an archived year; an item without history goes
+    config = database.STOCK_KINDS[kind]
+    add_items(conn, 0)
+    add_items(conn, 0, model='N')
+    conn.execute(f"""
+        INSERT INTO {config['movements']} ({config['movement_id']}, timestamp, type, quantity_change, remaining_quantity)
+        VALUES (1, '2000-06-01T00:00:00+07:00', 'IN', 1, 1)
+    """)
+    conn.commit()
+    database.archive_ledger_year(conn, kind, 2000)
+
+    assert database.delete_item(conn, kind, 1) == 'soft_deleted'
+    assert database.delete_item(conn, kind, 2) == 'deleted'
+    assert [row['id'] for row in conn.execute(f"SELECT id FROM {config['table']}")] == [1]
+    assert conn.execute(f"SELECT count(*) FROM {config['movements']}_all").fetchone()[0] == 1
+
+
+@pytest.mark.parametrize('kind', list(database.STOCK_KINDS))
+def test_imported_item_is_hidden_with_stock_written_off(conn, kind):
+    # Every imported item has its "initial stock" row, so deleting one must not be refused: its remaining stock
+    # leaves through the ledger and it drops out of the listing, valuation and low-stock alerts
+    config = database.STOCK_KINDS[kind]
+    add_items(conn, 4)
+    conn.execute(f"""
+        INSERT INTO {config['movements']} ({config['movement_id']}, timestamp, type, quantity_change, remaining_quantity, notes)
+        VALUES (1, '2024-01-01T00:00:00+07:00', 'IN', 4, 4, 'Import from Excel (initial stock)')
+    """)
+    conn.commit()
+    summary = database.VALUATION_KINDS[kind]['summary']
+    list_items = database.get_all_tires if kind == 'tire' else database.get_all_wheels
+
+    assert database.delete_item(conn, kind, 1) == 'soft_deleted'
+
+    assert quantity(conn, kind) == 0
+    assert [tuple(row) for row in ledger(conn, kind)] == [('IN', 4, 4), ('OUT', 4, 0)]
+    assert list(list_items(conn)) == []
+    assert list(list_items(conn, query='B')) == []
+    assert conn.execute(f"SELECT COALESCE(SUM(item_count), 0) FROM {summary}").fetchone()[0] == 0
+    assert conn.execute("SELECT count(*) FROM low_stock_alerts WHERE kind = ?", (kind,)).fetchone()[0] == 0
+
+
+def test_adding_a_deleted_item_again_restores_it(conn):
+    database.add_tire(conn, 'B', 'M', '205/55R16', 2, None, None, None, None, None, 1000, None, None)
+    assert database.delete_item(conn, 'tire', 1) == 'soft_deleted'
+
+    tire_id = database.add_tire(conn, 'B', 'M', '205/55R16', 3, None, None, None, None, None, 1200, None, None)
+
+    tire = database.get_tire(conn, tire_id)
+    assert (tire_id, tire['deleted_at'], tire['quantity'], tire['price_per_item']) == (1, None, 3, 1200)
+    assert [tuple(row) for row in ledger(conn, 'tire')] == [('IN', 2, 2), ('OUT', 2, 0), ('IN', 3, 3)]
+    assert [tire['id'] for tire in database.get_all_tires(conn)] == [1]